@@ -1,13 +1,19 @@
 import os
+import shutil
+import tempfile
 from dotenv import load_dotenv
 from aiohttp import web
 from ragtools import attach_rag_tools
 from rtmt import RTMiddleTier
-from azure.identity import DefaultAzureCredential
+from scheduler import SessionScheduler
+from metrics import metrics_handler
+from workers import MULTI_WORKER_SUPPORTED, WorkerSupervisor, attach_heartbeat
 from azure.core.credentials import AzureKeyCredential
 
-if __name__ == "__main__":
-    load_dotenv()
+HOST = "localhost"
+PORT = 8765
+
+def create_app(primary: bool = True) -> web.Application:
     llm_endpoint = os.environ.get("AZURE_OPENAI_ENDPOINT")
     llm_deployment = os.environ.get("AZURE_OPENAI_DEPLOYMENT")
     llm_key = os.environ.get("AZURE_OPENAI_API_KEY")
@@ -15,12 +21,16 @@ if __name__ == "__main__":
     database_name = os.environ.get("MONGO_DB_NAME")
     collection_name = os.environ.get("MONGO_COLLECTION_NAME")
 
-    credentials = DefaultAzureCredential() if not llm_key else None
+    if llm_key:
+        credentials = AzureKeyCredential(llm_key)
+    else:
+        from azure.identity import DefaultAzureCredential  # Only needed without a key
+        credentials = DefaultAzureCredential()
 
     app = web.Application()
 
     # Initialize real-time middleware with OpenAI for conversation history tracking
-    rtmt = RTMiddleTier(llm_endpoint, llm_deployment, AzureKeyCredential(llm_key) if llm_key else credentials)
+    rtmt = RTMiddleTier(llm_endpoint, llm_deployment, credentials)
     rtmt.system_message = (
         "You are a helpful assistant. Only answer questions based on information you searched in the knowledge base, "
         "accessible with the 'search' tool. "
@@ -32,13 +42,61 @@ if __name__ == "__main__":
         "2. Always use the 'report_grounding' tool to report the source of information from the knowledge base. \n"
         "3. Produce an answer that's as short as possible. If the answer isn't in the knowledge base, say you don't know."
     )
-    
+
+    # Optionally cap concurrent voice sessions per process, queueing the overflow instead of overloading upstream
+    max_active_sessions = os.environ.get("MAX_ACTIVE_SESSIONS")
+    if max_active_sessions:
+        queue_timeout = os.environ.get("SESSION_QUEUE_TIMEOUT_SECONDS")
+        rtmt.scheduler = SessionScheduler(
+            int(max_active_sessions),
+            int(os.environ.get("MAX_QUEUED_SESSIONS", 0)),
+            float(queue_timeout) if queue_timeout else None
+        )
+
     pdf_dir="../../data"
-    # Attach CosmosDB vector search for MongoDB
-    attach_rag_tools(rtmt, mongo_connection_string, database_name, collection_name, pdf_dir)
+    # Attach CosmosDB vector search for MongoDB, the index is built in the background (or by indexer.py) so the
+    # server starts right away whatever the size of the corpus
+    index_status = attach_rag_tools(rtmt, mongo_connection_string, database_name, collection_name, pdf_dir,
+                                    os.environ.get("INDEX_ON_STARTUP", "background"), primary)
 
     rtmt.attach_to_app(app, "/realtime")
+    app.add_routes([web.get('/index/status', lambda _: web.json_response(index_status.to_dict()))])
+    app.add_routes([web.get('/metrics', metrics_handler)])
+    # Readiness probe, 503 until connections, clients and the token are warmed up, see RTMiddleTier.warmup
+    app.add_routes([web.get('/ready', rtmt.ready_handler)])
 
     app.add_routes([web.get('/', lambda _: web.FileResponse('./static/index.html'))])
     app.router.add_static('/', path='./static', name='static')
-    web.run_app(app, host='localhost', port=8765)
+    return app
+
+def run_worker(index: int, heartbeat):
+    load_dotenv()
+    app = create_app(primary=index == 0)
+    attach_heartbeat(app, heartbeat)
+    # Every worker binds the same port, the kernel spreads new connections across them
+    web.run_app(app, host=HOST, port=PORT, reuse_port=True, print=print if index == 0 else None)
+
+if __name__ == "__main__":
+    load_dotenv()
+    workers = int(os.environ.get("WEB_WORKERS", 1))
+    if workers > 1 and not MULTI_WORKER_SUPPORTED:
+        print("WEB_WORKERS needs SO_REUSEPORT load balancing, which only Linux has, running a single process")
+        workers = 1
+
+    if workers == 1:
+        web.run_app(create_app(), host=HOST, port=PORT)
+    else:
+        # One copy of the query embedding and search result caches for all workers, in SQLite files they share
+        cache_dir = tempfile.mkdtemp(prefix="rag-audio-cache-")
+        for name, filename in (("EMBEDDING_CACHE_PATH", "embeddings.sqlite"), ("SEARCH_CACHE_PATH", "search.sqlite")):
+            if not os.environ.get(name):
+                os.environ[name] = os.path.join(cache_dir, filename)
+        try:
+            WorkerSupervisor(
+                run_worker,
+                workers,
+                heartbeat_timeout=float(os.environ.get("WORKER_HEARTBEAT_TIMEOUT_SECONDS", 30)),
+                stop_timeout=float(os.environ.get("SESSION_DRAIN_SECONDS", 30)) + 30
+            ).run()
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
@@ -0,0 +1 @@
+# Offline benchmarks and load tests for the backend, run from app/backend with `python -m benchmarks.<name>`
@@ -0,0 +1,64 @@
+"""Compares chunkers on a synthetic corpus with a header and page footer on every page.
+
+Reports how many chunks and tokens each chunker sends to the embeddings endpoint, how many tokens a search result
+carries into the realtime session, and recall: the share of sentences sampled from the corpus for which a search
+with that sentence returns a chunk containing it whole, using the offline hashed embedder.
+
+    python -m benchmarks.chunking_quality --files 20 --pages 12 --queries 200
+"""
+import argparse
+import os
+import random
+import tempfile
+import numpy as np
+from chunking import Chunker, count_tokens
+from ingestion import iter_pdf_pages
+from benchmarks.fakes import FakeEmbeddings, write_synthetic_pdf
+
+def evaluate(label: str, chunker: Chunker, documents: dict[str, list[str]], queries: list[str], k: int,
+             embeddings: FakeEmbeddings):
+    chunks = [chunk.text for pages in documents.values() for chunk in chunker.split(pages)]
+    tokens = [count_tokens(chunk) for chunk in chunks]
+    matrix = np.array(embeddings.embed_documents(chunks), dtype=np.float32)
+    hits = 0
+    result_tokens = []
+    for query in queries:
+        scores = matrix @ np.array(embeddings.embed_query(query), dtype=np.float32)
+        top = np.argsort(-scores)[:k]
+        hits += any(query in chunks[i] for i in top)
+        result_tokens.append(sum(tokens[i] for i in top))
+    print(f"{label:34} {len(chunks):6} chunks {sum(tokens):8} tokens embedded {np.mean(tokens):6.1f} tokens/chunk "
+          f"{np.mean(result_tokens):7.1f} tokens/search  recall@{k} {hits / len(queries):.3f}")
+
+def main(args):
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as pdf_dir:
+        for i in range(args.files):
+            write_synthetic_pdf(os.path.join(pdf_dir, f"doc_{i:05}.pdf"), args.pages, seed=i,
+                                header=f"Contoso Electronics Handbook - Confidential - Revision {i % 3 + 1}")
+        documents = dict(iter_pdf_pages(pdf_dir))
+
+    sentences = [line for pages in documents.values() for page in pages for line in page.splitlines()
+                 if line.endswith(".")]
+    queries = rng.sample(sentences, min(args.queries, len(sentences)))
+    embeddings = FakeEmbeddings(dimensions=args.dimensions)
+    print(f"corpus: {args.files} PDFs, {args.files * args.pages} pages, {len(queries)} queries")
+
+    evaluate("chars 1000 (original)", Chunker("chars", chunk_size=1000), documents, queries, args.k, embeddings)
+    for max_tokens in (int(t) for t in args.max_tokens.split(",")):
+        for overlap in (0, args.overlap):
+            chunker = Chunker("tokens", max_tokens=max_tokens, overlap_tokens=overlap)
+            evaluate(f"tokens {max_tokens} overlap {chunker.overlap_tokens}", chunker, documents, queries, args.k,
+                     embeddings)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare chunking strategies on embedding volume and recall")
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=12)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4, help="results per search, as in vector_search")
+    parser.add_argument("--max-tokens", default="128,200,400", help="comma separated chunk sizes to try")
+    parser.add_argument("--overlap", type=int, default=32)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
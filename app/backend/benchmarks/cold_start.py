@@ -0,0 +1,158 @@
+"""Cold start cost of the server: module import times, and time to listening and to ready for a fresh process.
+
+Each run starts a new interpreter, as a container start or a scale-out does. The first part times importing each
+server module on its own (median of `--runs`); the second starts the real app (app.create_app) on a free port and
+times the process from launch until it listens and until /ready answers 200, then reports how long each warmup
+step took and which of the heavy modules only some code paths need were loaded by creating the app.
+
+The embeddings endpoint is a local fake, so the embeddings step includes importing and building the real client
+and one round trip to it. With the default `--mongo-uri` nothing listens and the Mongo step fails after the URI's
+serverSelectionTimeoutMS, which readiness doesn't wait past; pass a real connection string to time the connection.
+The API key is a fake one, so there is no bearer token step.
+
+    python -m benchmarks.cold_start --runs 5
+    python -m benchmarks.cold_start --mongo-uri "mongodb://localhost:27017"
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import aiohttp
+from aiohttp import web
+from benchmarks.util import format_ms
+
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only needed on some code paths, none of them should load while the server starts
+_DEFERRED_MODULES = ("langchain_openai", "langchain_community.vectorstores.azure_cosmos_db", "pdfplumber",
+                     "azure.identity")
+
+_IMPORT_SCRIPT = """
+import sys, time
+started = time.perf_counter()
+import {module}
+print(time.perf_counter() - started)
+"""
+
+_SERVER_SCRIPT = """
+import asyncio, json, os, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app()
+created = time.perf_counter()
+loaded = [m for m in json.loads(os.environ["DEFERRED_MODULES"]) if m in sys.modules]
+
+async def serve():
+    from aiohttp import web
+    runner = web.AppRunner(application)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    print(json.dumps({"port": runner.addresses[0][1], "import": imported - started, "create_app": created - imported,
+                      "loaded": loaded}), flush=True)
+    await asyncio.Event().wait()
+
+asyncio.run(serve())
+"""
+
+def time_import(module: str) -> float:
+    output = subprocess.run([sys.executable, "-W", "ignore", "-c", _IMPORT_SCRIPT.format(module=module)],
+                            cwd=_BACKEND_DIR, capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+async def embeddings_handler(request: web.Request) -> web.Response:
+    # Just enough of the Azure OpenAI embeddings API for the client's warmup call
+    body = await request.json()
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    data = [{"object": "embedding", "index": i, "embedding": [0.0] * 8} for i in range(len(inputs))]
+    return web.json_response({"object": "list", "data": data, "model": "fake",
+                              "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)}})
+
+async def start_server(env: dict, static_dir: str, poll_interval: float) -> dict:
+    launched = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-W", "ignore", "-c", _SERVER_SCRIPT, cwd=static_dir, env=env,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+    )
+    try:
+        line = await process.stdout.readline()
+        if not line:
+            raise RuntimeError("The server exited before listening, run it with the same environment to see why")
+        result = json.loads(line)
+        result["listening"] = time.perf_counter() - launched
+        async with aiohttp.ClientSession() as session:
+            while True:
+                async with session.get(f"http://127.0.0.1:{result['port']}/ready") as response:
+                    if response.status == 200:
+                        result["ready"] = time.perf_counter() - launched
+                        result["warmup"] = (await response.json())["warmup"]
+                        return result
+                await asyncio.sleep(poll_interval)
+    finally:
+        process.kill()
+        await process.wait()
+
+async def measure_startup(args) -> list[dict]:
+    fake = web.Application()
+    fake.router.add_post("/openai/deployments/{deployment}/embeddings", embeddings_handler)
+    runner = web.AppRunner(fake)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    env = {**os.environ,
+           "PYTHONPATH": os.pathsep.join(filter(None, [_BACKEND_DIR, os.environ.get("PYTHONPATH")])),
+           "DEFERRED_MODULES": json.dumps(_DEFERRED_MODULES),
+           "AZURE_OPENAI_ENDPOINT": f"http://127.0.0.1:{runner.addresses[0][1]}",
+           "AZURE_OPENAI_DEPLOYMENT": "fake-realtime",
+           "AZURE_OPENAI_API_KEY": "fake-key",
+           "AZURE_OPENAI_EMBEDDINGS_MODEL_NAME": "text-embedding-3-small",
+           "AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT_NAME": "fake-embeddings",
+           "OPENAI_API_VERSION": "2024-06-01",
+           "MONGO_CONNECTION_STRING": args.mongo_uri,
+           "MONGO_DB_NAME": "cold_start",
+           "MONGO_COLLECTION_NAME": "chunks",
+           "INDEX_ON_STARTUP": "off",
+           "VECTOR_STORE": "cosmos",
+           "EMBEDDING_CACHE_PATH": "",
+           "SEARCH_CACHE_PATH": ""}
+    try:
+        with tempfile.TemporaryDirectory() as static_dir:
+            # create_app serves ./static, the server runs from here instead of the source tree
+            os.mkdir(os.path.join(static_dir, "static"))
+            return [await start_server(env, static_dir, args.poll_ms / 1000) for _ in range(args.runs)]
+    finally:
+        await runner.cleanup()
+
+def main(args):
+    print(f"Module import time in a fresh interpreter, median of {args.runs}")
+    for module in args.modules.split(","):
+        print(f"  {module:12} {format_ms(statistics.median(time_import(module) for _ in range(args.runs)))}")
+
+    runs = asyncio.run(measure_startup(args))
+    print(f"Server start, median of {args.runs}")
+    for label, key in (("import app", "import"), ("create_app", "create_app"), ("listening", "listening"),
+                       ("ready", "ready")):
+        print(f"  {label:12} {format_ms(statistics.median(run[key] for run in runs))}")
+    print("Warmup steps, median")
+    for step in runs[0]["warmup"]:
+        results = [run["warmup"][step] for run in runs]
+        failed = [result["error"] for result in results if not result["ok"]]
+        outcome = f"failed {len(failed)}/{len(results)}: {failed[0][:100]}" if failed else "ok"
+        print(f"  {step:12} {format_ms(statistics.median(result['seconds'] for result in results))}  {outcome}")
+    loaded = sorted({module for run in runs for module in run["loaded"]})
+    print(f"Deferred modules loaded by create_app: {', '.join(loaded) or 'none'}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure import, listening and readiness time of a cold server")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--modules", default="rtmt,ingestion,ragtools,app", help="comma separated modules to time")
+    parser.add_argument("--mongo-uri", default="mongodb://127.0.0.1:9/?serverSelectionTimeoutMS=200",
+                        help="Mongo connection string for the warmup ping, the default has nothing listening")
+    parser.add_argument("--poll-ms", type=float, default=5, help="how often /ready is polled")
+    main(parser.parse_args())
@@ -0,0 +1,222 @@
+"""End-to-end load benchmark: how many concurrent voice sessions one backend process handles, without Azure.
+
+The middle tier runs in a child process, like a deployed server, with the real search and grounding tools over the
+fake embedder, an in-memory collection and the local vector index. Its upstream is a scripted fake of the realtime
+endpoint that streams audio and transcript deltas and asks for a search and a grounding call every turn. Simulated
+clients in this process stream microphone audio at real-time pace. For each concurrency level it reports
+throughput, the latency the middle tier adds to relayed events (sent by the fake to received by a client, same
+clock), turn latency, and the child's CPU and memory per session.
+
+    python -m benchmarks.end_to_end --sessions 10,50,100 --turns 3
+    python -m benchmarks.end_to_end --sessions 50 --max-added-p95-ms 20   # exits non-zero above the threshold
+"""
+import argparse
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+import aiohttp
+from aiohttp import web
+from azure.core.credentials import AzureKeyCredential
+from benchmarks.fake_realtime import FakeRealtimeConfig, FakeRealtimeServer
+from benchmarks.fakes import FakeEmbeddings, InMemoryCollection, synthetic_page_text
+from benchmarks.util import current_rss_mb, format_ms, percentile
+
+# 100ms of 24kHz pcm16 silence, what a browser client sends per frame
+_FRAME_AUDIO = base64.b64encode(bytes(4800)).decode("ascii")
+
+def make_corpus(chunks: int, embeddings: FakeEmbeddings) -> InMemoryCollection:
+    rng = random.Random(0)
+    collection = InMemoryCollection()
+    documents = [{"_id": f"chunk_{i}", "textContent": " ".join(synthetic_page_text(rng, 8)),
+                  "metadata": {"title": f"chunk_{i}"}} for i in range(chunks)]
+    for doc, vector in zip(documents, embeddings.embed_documents([doc["textContent"] for doc in documents])):
+        doc["vectorContent"] = vector
+    collection.insert_many(documents)
+    collection.replace_one({"_id": "manifest:synthetic"}, {"manifest": True, "source": "synthetic", "sha256": str(chunks),
+                                                          "chunk_ids": []})
+    return collection
+
+def serve_middle_tier(endpoint: str, options: dict, ready):
+    # Child process entry point, the tools print a line per call
+    if not options["verbose"]:
+        sys.stdout = open(os.devnull, "w")
+    asyncio.run(_serve_middle_tier(endpoint, options, ready))
+
+async def _serve_middle_tier(endpoint: str, options: dict, ready):
+    from lexical_index import BM25Index
+    from ragtools import TracedEmbeddings, register_rag_tools
+    from rtmt import RTMiddleTier
+    from vector_index import LocalVectorIndex
+
+    embeddings = FakeEmbeddings(dimensions=256, latency=options["embedding_latency"])
+    collection = make_corpus(options["chunks"], embeddings)
+    search_store = LocalVectorIndex(TracedEmbeddings(embeddings))
+    search_store.sync(collection)
+    lexical_index = None
+    if options["lexical"]:
+        lexical_index = BM25Index()
+        lexical_index.sync(collection)
+
+    rtmt = RTMiddleTier(endpoint, "fake-deployment", AzureKeyCredential("fake-key"))
+    rtmt.speculative_tools = options["speculative"]
+    register_rag_tools(rtmt, collection, search_store, lexical_index)
+
+    async def usage(request: web.Request) -> web.Response:
+        return web.json_response({"cpu_seconds": time.process_time(), "rss_mb": current_rss_mb()})
+
+    app = web.Application()
+    rtmt.attach_to_app(app, "/realtime")
+    app.router.add_get("/benchmark/usage", usage)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    ready.put(site._server.sockets[0].getsockname()[1])
+    await asyncio.Event().wait()
+
+class SessionResult:
+    def __init__(self):
+        self.turn_latencies: list[float] = []
+        self.first_audio_latencies: list[float] = []
+        self.added_latencies: list[float] = []
+        self.events = 0
+
+async def run_client(url: str, fake: FakeRealtimeServer, args, start_delay: float, result: SessionResult):
+    await asyncio.sleep(start_delay)
+    async with aiohttp.ClientSession() as http:
+        async with http.ws_connect(url, max_msg_size=0) as ws:
+
+            async def receive():
+                msg = await ws.receive()
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    raise ConnectionError(f"connection closed ({ws.close_code})")
+                received = time.perf_counter()
+                message = json.loads(msg.data)
+                sent = fake.send_times.pop(message.get("event_id"), None)
+                if sent is not None:
+                    result.added_latencies.append(received - sent)
+                result.events += 1
+                return message
+
+            while (await receive())["type"] != "session.created":
+                pass
+            await ws.send_json({"type": "session.update", "session": {"turn_detection": {"type": "server_vad"}}})
+            while (await receive())["type"] != "session.updated":
+                pass
+
+            for _ in range(args.turns):
+                for frame in range(args.frames_per_turn):
+                    if frame:
+                        await asyncio.sleep(args.frame_interval)
+                    # The fake answers on the last frame, so nothing arrives while this client is pacing its audio
+                    await ws.send_json({"type": "input_audio_buffer.append", "audio": _FRAME_AUDIO})
+                turn_start = time.perf_counter()
+                first_audio = None
+                while True:
+                    message = await receive()
+                    if message["type"] == "response.audio.delta" and first_audio is None:
+                        first_audio = time.perf_counter()
+                        result.first_audio_latencies.append(first_audio - turn_start)
+                    elif message["type"] == "response.done" and first_audio is not None:
+                        result.turn_latencies.append(time.perf_counter() - turn_start)
+                        break
+
+async def usage(http: aiohttp.ClientSession, url: str) -> dict:
+    async with http.get(url) as response:
+        return await response.json()
+
+async def run_level(sessions: int, url: str, usage_url: str, fake: FakeRealtimeServer, args) -> float:
+    results = [SessionResult() for _ in range(sessions)]
+    async with aiohttp.ClientSession() as http:
+        before = await usage(http, usage_url)
+        peak_rss = before["rss_mb"]
+        driver_cpu = time.process_time()
+        started = time.perf_counter()
+        clients = asyncio.gather(*[run_client(url, fake, args, args.ramp * i / sessions, result)
+                                   for i, result in enumerate(results)], return_exceptions=True)
+        while True:
+            done, _ = await asyncio.wait([clients], timeout=0.25)
+            peak_rss = max(peak_rss, (await usage(http, usage_url))["rss_mb"])
+            if done:
+                break
+        elapsed = time.perf_counter() - started
+        driver_cpu = time.process_time() - driver_cpu
+        after = await usage(http, usage_url)
+
+    failures = [r for r in clients.result() if isinstance(r, Exception)]
+    turns = [latency for r in results for latency in r.turn_latencies]
+    first_audio = [latency for r in results for latency in r.first_audio_latencies]
+    added = [latency for r in results for latency in r.added_latencies]
+    events = sum(r.events for r in results)
+    cpu = after["cpu_seconds"] - before["cpu_seconds"]
+    print(f"\n{sessions} sessions, {len(turns)}/{sessions * args.turns} turns in {elapsed:.1f}s, "
+          f"{len(failures)} failed sessions")
+    print(f"  throughput      {len(turns) / elapsed:.1f} turns/s, {events / elapsed:.0f} events/s to clients")
+    print(f"  added latency   p50 {format_ms(percentile(added, 50))} p95 {format_ms(percentile(added, 95))} "
+          f"p99 {format_ms(percentile(added, 99))} over {len(added)} relayed events")
+    print(f"  first audio     p50 {format_ms(percentile(first_audio, 50))} p95 {format_ms(percentile(first_audio, 95))}")
+    print(f"  turn            p50 {format_ms(percentile(turns, 50))} p95 {format_ms(percentile(turns, 95))}")
+    print(f"  backend cpu     {cpu / elapsed:.0%} of a core, {cpu * 1000 / max(sessions, 1):.1f}ms per session, "
+          f"{cpu * 1000 / max(len(turns), 1):.1f}ms per turn")
+    print(f"  backend memory  {after['rss_mb']:.0f}MB resident, {(peak_rss - before['rss_mb']) * 1024 / sessions:.0f}KB "
+          f"per session at peak")
+    if driver_cpu / elapsed > 0.9:
+        print(f"  warning: the load generator used {driver_cpu / elapsed:.0%} of a core, latencies include its own "
+              f"queueing")
+    for failure in failures[:3]:
+        print("  error:", repr(failure))
+    return percentile(added, 95)
+
+async def main(args):
+    fake = FakeRealtimeServer(FakeRealtimeConfig(
+        frames_per_turn=args.frames_per_turn, audio_deltas=args.audio_deltas, function_call_delay=args.model_delay,
+        first_delta_delay=args.model_delay, delta_interval=args.delta_interval, grounding_call=True,
+        record_send_times=True))
+    await fake.start()
+
+    options = {"chunks": args.chunks, "embedding_latency": args.embedding_latency, "lexical": args.lexical,
+               "speculative": args.speculative, "verbose": args.verbose}
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    backend = context.Process(target=serve_middle_tier, args=(fake.endpoint, options, ready), daemon=True)
+    backend.start()
+    try:
+        port = await asyncio.get_running_loop().run_in_executor(None, ready.get, True, 120)
+        url, usage_url = f"http://127.0.0.1:{port}/realtime", f"http://127.0.0.1:{port}/benchmark/usage"
+        print(f"backend pid {backend.pid}, {args.chunks} chunks, {args.turns} turns per session, "
+              f"{args.frames_per_turn} audio frames per turn")
+        worst = 0.0
+        for sessions in [int(n) for n in args.sessions.split(",")]:
+            worst = max(worst, await run_level(sessions, url, usage_url, fake, args))
+    finally:
+        backend.terminate()
+        backend.join()
+        await fake.stop()
+
+    if fake.stats.foreign_tool_outputs:
+        raise SystemExit("Tool calls leaked across sessions")
+    if args.max_added_p95_ms is not None and worst * 1000 > args.max_added_p95_ms:
+        raise SystemExit(f"Added latency p95 {format_ms(worst)} is over {args.max_added_p95_ms}ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent voice sessions through one backend process, offline")
+    parser.add_argument("--sessions", default="10,50,100", help="comma separated concurrency levels")
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--frames-per-turn", type=int, default=10)
+    parser.add_argument("--frame-interval", type=float, default=0.1, help="seconds between audio frames of a client")
+    parser.add_argument("--ramp", type=float, default=1.0, help="seconds over which sessions start")
+    parser.add_argument("--audio-deltas", type=int, default=30)
+    parser.add_argument("--delta-interval", type=float, default=0.02, help="seconds between audio deltas of the fake")
+    parser.add_argument("--model-delay", type=float, default=0.2, help="fake model time before calls and audio")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--embedding-latency", type=float, default=0.03, help="seconds per embeddings request")
+    parser.add_argument("--lexical", action="store_true", help="fuse a BM25 index into searches")
+    parser.add_argument("--speculative", action="store_true", help="start searches on the input transcript")
+    parser.add_argument("--max-added-p95-ms", type=float, default=None, help="fail above this added latency p95")
+    parser.add_argument("--verbose", action="store_true", help="keep the backend's log output")
+    asyncio.run(main(parser.parse_args()))
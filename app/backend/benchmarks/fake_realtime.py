@@ -0,0 +1,184 @@
+import asyncio
+import base64
+import json
+import os
+import time
+import uuid
+from typing import Optional
+from aiohttp import web
+
+class FakeRealtimeConfig:
+    frames_per_turn: int = 5
+    function_call: bool = True
+    tool_name: str = "search"
+    tool_arguments: str = '{"query": "what are the opening hours"}'
+    grounding_call: bool = False  # Follow the tool output with a report_grounding call citing doc_0
+    input_transcript: Optional[str] = "What are the opening hours of the Contoso store?"  # None to not transcribe
+    function_call_delay: float = 0.0  # Model time between the end of speech and the function call
+    audio_deltas: int = 20
+    audio_delta_bytes: int = 4800  # 100ms of 24kHz pcm16
+    first_delta_delay: float = 0.0
+    delta_interval: float = 0.0
+    throttled_handshakes: int = 0  # Answer this many connection attempts with 429 before accepting any
+    retry_after: Optional[float] = None
+    record_send_times: bool = False  # Keep perf_counter() send times by event_id in FakeRealtimeServer.send_times
+
+    def __init__(self, **kwargs):
+        for name, value in kwargs.items():
+            if not hasattr(self, name):
+                raise ValueError(f"Unknown fake realtime setting '{name}'")
+            setattr(self, name, value)
+
+class FakeRealtimeStats:
+    connections: int = 0
+    throttled: int = 0
+    turns: int = 0
+    tool_outputs: int = 0
+    foreign_tool_outputs: int = 0  # function_call_output for a call_id this connection never issued
+
+    def __init__(self):
+        self.connections = 0
+        self.throttled = 0
+        self.turns = 0
+        self.tool_outputs = 0
+        self.foreign_tool_outputs = 0
+
+class FakeRealtimeServer:
+    """Scripted stand-in for the Azure OpenAI /openai/realtime websocket.
+
+    Every `frames_per_turn` appended audio frames count as one user turn. A turn optionally starts with a function
+    call response, waits for the middle tier to post the tool output and ask for a new response, then streams audio
+    and transcript deltas the way the real service does.
+    """
+
+    def __init__(self, config: Optional[FakeRealtimeConfig] = None):
+        self.config = config or FakeRealtimeConfig()
+        self.stats = FakeRealtimeStats()
+        self.port: Optional[int] = None
+        self._runner: Optional[web.AppRunner] = None
+        self.send_times: dict[str, float] = {}
+        self._audio = base64.b64encode(os.urandom(self.config.audio_delta_bytes)).decode("ascii")
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/openai/realtime", self._handler)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _handler(self, request: web.Request):
+        if self.stats.throttled < self.config.throttled_handshakes:
+            self.stats.throttled += 1
+            headers = {"Retry-After": str(self.config.retry_after)} if self.config.retry_after is not None else None
+            return web.Response(status=429, headers=headers)
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        self.stats.connections += 1
+        issued_calls: set[str] = set()
+        frames = 0
+        turn: Optional[asyncio.Task] = None
+        tool_output_ready = asyncio.Event()
+
+        await self._send(ws, "session.created", session={
+            "id": f"sess_{uuid.uuid4().hex}", "instructions": "", "tools": [], "tool_choice": "auto",
+            "max_response_output_tokens": "inf"
+        })
+        async for msg in ws:
+            message = json.loads(msg.data)
+            match message["type"]:
+                case "session.update":
+                    await self._send(ws, "session.updated", session=message["session"])
+                case "input_audio_buffer.append":
+                    frames += 1
+                    if frames % self.config.frames_per_turn == 0 and (turn is None or turn.done()):
+                        tool_output_ready.clear()
+                        turn = asyncio.create_task(self._run_turn(ws, issued_calls, tool_output_ready))
+                case "conversation.item.create":
+                    item = message["item"]
+                    if item["type"] == "function_call_output":
+                        self.stats.tool_outputs += 1
+                        if item["call_id"] not in issued_calls:
+                            self.stats.foreign_tool_outputs += 1
+                case "response.create":
+                    tool_output_ready.set()
+        if turn is not None:
+            turn.cancel()
+        return ws
+
+    async def _run_turn(self, ws: web.WebSocketResponse, issued_calls: set[str], tool_output_ready: asyncio.Event):
+        self.stats.turns += 1
+        user_item = f"item_{uuid.uuid4().hex}"
+        await self._send(ws, "input_audio_buffer.speech_stopped", audio_end_ms=1000, item_id=user_item)
+        await self._send(ws, "input_audio_buffer.committed", previous_item_id=None, item_id=user_item)
+        if self.config.input_transcript is not None:
+            await self._send(ws, "conversation.item.input_audio_transcription.completed", item_id=user_item,
+                             content_index=0, transcript=self.config.input_transcript)
+        if self.config.function_call_delay:
+            await asyncio.sleep(self.config.function_call_delay)
+        if self.config.function_call:
+            call_id = f"call_{uuid.uuid4().hex}"
+            issued_calls.add(call_id)
+            await self._function_call_response(ws, user_item, call_id, self.config.tool_name, self.config.tool_arguments)
+            await tool_output_ready.wait()
+            if self.config.grounding_call:
+                tool_output_ready.clear()
+                call_id = f"call_{uuid.uuid4().hex}"
+                issued_calls.add(call_id)
+                await self._function_call_response(ws, user_item, call_id, "report_grounding", '{"sources": ["doc_0"]}')
+                await tool_output_ready.wait()
+        await self._audio_response(ws)
+
+    async def _function_call_response(self, ws: web.WebSocketResponse, previous_item: str, call_id: str, name: str,
+                                      arguments: str):
+        response_id = f"resp_{uuid.uuid4().hex}"
+        item = {
+            "id": f"item_{uuid.uuid4().hex}", "type": "function_call", "status": "completed",
+            "name": name, "call_id": call_id, "arguments": arguments
+        }
+        await self._send(ws, "response.created", response={"id": response_id, "status": "in_progress", "output": []})
+        await self._send(ws, "response.output_item.added", response_id=response_id, output_index=0,
+                         item={**item, "status": "in_progress", "arguments": ""})
+        await self._send(ws, "conversation.item.created", previous_item_id=previous_item,
+                         item={**item, "status": "in_progress", "arguments": ""})
+        await self._send(ws, "response.function_call_arguments.delta", response_id=response_id, item_id=item["id"],
+                         output_index=0, call_id=call_id, delta=arguments)
+        await self._send(ws, "response.function_call_arguments.done", response_id=response_id, item_id=item["id"],
+                         output_index=0, call_id=call_id, arguments=arguments)
+        await self._send(ws, "response.output_item.done", response_id=response_id, output_index=0, item=item)
+        await self._send(ws, "response.done", response={"id": response_id, "status": "completed", "output": [item]})
+
+    async def _audio_response(self, ws: web.WebSocketResponse):
+        response_id = f"resp_{uuid.uuid4().hex}"
+        item_id = f"item_{uuid.uuid4().hex}"
+        ids = {"response_id": response_id, "item_id": item_id, "output_index": 0, "content_index": 0}
+        await self._send(ws, "response.created", response={"id": response_id, "status": "in_progress", "output": []})
+        await self._send(ws, "response.output_item.added", response_id=response_id, output_index=0,
+                         item={"id": item_id, "type": "message", "role": "assistant", "content": []})
+        if self.config.first_delta_delay:
+            await asyncio.sleep(self.config.first_delta_delay)
+        for _ in range(self.config.audio_deltas):
+            await self._send(ws, "response.audio.delta", **ids, delta=self._audio)
+            await self._send(ws, "response.audio_transcript.delta", **ids, delta="word ")
+            if self.config.delta_interval:
+                await asyncio.sleep(self.config.delta_interval)
+        await self._send(ws, "response.audio.done", **ids)
+        await self._send(ws, "response.audio_transcript.done", **ids, transcript="word " * self.config.audio_deltas)
+        output = [{"id": item_id, "type": "message", "content": [{"type": "audio", "transcript": "word"}]}]
+        await self._send(ws, "response.done", response={"id": response_id, "status": "completed", "output": output})
+
+    async def _send(self, ws: web.WebSocketResponse, event_type: str, **fields):
+        # Keep "type" first, like the real service does
+        event_id = f"event_{uuid.uuid4().hex}"
+        if self.config.record_send_times:
+            self.send_times[event_id] = time.perf_counter()
+        await ws.send_str(json.dumps({"type": event_type, "event_id": event_id, **fields}))
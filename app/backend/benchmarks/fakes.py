@@ -0,0 +1,200 @@
+import hashlib
+import random
+import re
+import time
+from typing import Any, Iterable, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from pymongo import DeleteMany, ReplaceOne
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic offline embedder: hashed bag of words, L2 normalized.
+
+    Texts sharing words get similar vectors, which is enough to exercise retrieval end to end. `latency` seconds
+    are slept per call to stand in for the embeddings endpoint round trip.
+    """
+
+    def __init__(self, dimensions: int = 1536, latency: float = 0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.calls = 0
+        self.texts = 0
+
+    def _embed(self, text: str) -> list[float]:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.calls += 1
+        self.texts += len(texts)
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+def _get_path(doc: dict, path: str) -> Any:
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return None
+        doc = doc[part]
+    return doc
+
+def _matches(doc: dict, query: Optional[dict]) -> bool:
+    for path, condition in (query or {}).items():
+        value = _get_path(doc, path)
+        if isinstance(condition, dict) and "$in" in condition:
+            if value not in condition["$in"]:
+                return False
+        elif isinstance(condition, dict) and "$nin" in condition:
+            if value in condition["$nin"]:
+                return False
+        elif isinstance(condition, dict) and "$exists" in condition:
+            if (value is not None) != condition["$exists"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+def _project(doc: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return dict(doc)
+    result = {"_id": doc["_id"]} if projection.get("_id", 1) else {}
+    for path, include in projection.items():
+        if path == "_id" or not include:
+            continue
+        value = _get_path(doc, path)
+        if value is None:
+            continue
+        target = result
+        parts = path.split(".")
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return result
+
+class _Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+class InMemoryCollection:
+    """Stand-in for the pymongo collection, covering the calls the backend makes."""
+
+    def __init__(self, name: str = "fake", write_latency: float = 0.0):
+        self.name = name
+        self.write_latency = write_latency
+        self.docs: dict[Any, dict] = {}
+        self.indexes: dict[str, Any] = {"_id_": {"key": [("_id", 1)]}}
+        self.write_calls = 0
+
+    def _write(self):
+        self.write_calls += 1
+        if self.write_latency:
+            time.sleep(self.write_latency)
+
+    def insert_many(self, documents: Iterable[dict], ordered: bool = True):
+        self._write()
+        ids = []
+        for doc in documents:
+            doc.setdefault("_id", f"{len(self.docs)}-{random.getrandbits(48):012x}")
+            self.docs[doc["_id"]] = doc
+            ids.append(doc["_id"])
+        return _Result(inserted_ids=ids)
+
+    def bulk_write(self, requests: list, ordered: bool = True):
+        self._write()
+        for request in requests:
+            if isinstance(request, ReplaceOne):
+                self.docs[request._filter["_id"]] = {**request._doc, "_id": request._filter["_id"]}
+            elif isinstance(request, DeleteMany):
+                for key in [key for key, doc in self.docs.items() if _matches(doc, request._filter)]:
+                    del self.docs[key]
+            else:
+                raise NotImplementedError(type(request).__name__)
+        return _Result(upserted_count=len(requests))
+
+    def replace_one(self, query: dict, document: dict, upsert: bool = False):
+        self._write()
+        key = query["_id"]
+        self.docs[key] = {**document, "_id": key}
+        return _Result(modified_count=1)
+
+    def update_one(self, query: dict, update: dict, upsert: bool = False):
+        self._write()
+        for doc in self.docs.values():
+            if _matches(doc, query):
+                doc.update(update.get("$set", {}))
+                return _Result(modified_count=1)
+        return _Result(modified_count=0)
+
+    def delete_many(self, query: dict):
+        self._write()
+        doomed = [key for key, doc in self.docs.items() if _matches(doc, query)]
+        for key in doomed:
+            del self.docs[key]
+        return _Result(deleted_count=len(doomed))
+
+    def find(self, query: Optional[dict] = None, projection: Optional[dict] = None):
+        return [_project(doc, projection) for doc in list(self.docs.values()) if _matches(doc, query)]
+
+    def find_one(self, query: Optional[dict] = None, projection: Optional[dict] = None):
+        return next(iter(self.find(query, projection)), None)
+
+    def count_documents(self, query: dict) -> int:
+        return sum(1 for doc in list(self.docs.values()) if _matches(doc, query))
+
+    def create_index(self, keys, **kwargs) -> str:
+        name = kwargs.get("name") or (keys if isinstance(keys, str) else "_".join(f"{k}_{v}" for k, v in keys))
+        self.indexes[name] = {"key": keys}
+        return name
+
+    def index_information(self) -> dict:
+        return dict(self.indexes)
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+_WORDS = ("contoso store opening hours return policy warranty product model number delivery order customer "
+          "support battery charger headphones laptop monitor keyboard refund exchange receipt price discount "
+          "membership points account shipping address invoice repair service center appointment manual").split()
+
+def synthetic_page_text(rng: random.Random, lines: int, words_per_line: int = 12) -> list[str]:
+    return [" ".join(rng.choice(_WORDS) for _ in range(words_per_line)) + "." for _ in range(lines)]
+
+def write_synthetic_pdf(path: str, pages: int, lines_per_page: int = 40, seed: int = 0, header: Optional[str] = None):
+    """Writes a minimal text-only PDF that pdfplumber can parse, with an optional header repeated on every page."""
+    rng = random.Random(seed)
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page_number in range(pages):
+        lines = synthetic_page_text(rng, lines_per_page)
+        if header:
+            lines = [header] + lines + [f"Page {page_number + 1}"]
+        stream = "BT /F1 9 Tf 11 TL 40 780 Td " + " ".join(f"({_pdf_escape(line)}) Tj T*" for line in lines) + " ET"
+        stream_bytes = stream.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream_bytes), stream_bytes))
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode("ascii")
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(output)
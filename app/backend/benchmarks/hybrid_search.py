@@ -0,0 +1,71 @@
+"""Compares vector-only and hybrid (BM25 + vector, reciprocal-rank fusion) search on a synthetic corpus.
+
+Every chunk mentions one product code. Code queries ask about a code ("warranty for model CX-0042"), text queries
+are a sentence taken from a chunk. Vector search runs on the local index with the offline hashed embedder and a
+simulated embeddings round trip, so latency shows what the lexical fast path saves.
+
+    python -m benchmarks.hybrid_search --chunks 5000 --queries 200 --embedding-latency 0.05
+"""
+import argparse
+import random
+import time
+from lexical_index import BM25Index
+from ragtools import hybrid_search, vector_search
+from vector_index import LocalVectorIndex
+from benchmarks.fakes import FakeEmbeddings, InMemoryCollection, synthetic_page_text
+from benchmarks.util import format_ms, percentile
+
+def make_corpus(chunks: int, rng: random.Random) -> tuple[InMemoryCollection, list[tuple[str, str]]]:
+    embeddings = FakeEmbeddings(dimensions=256)
+    collection = InMemoryCollection()
+    documents, queries = [], []
+    for i in range(chunks):
+        code = f"CX-{i:04}"
+        lines = synthetic_page_text(rng, 8)
+        lines.insert(rng.randrange(len(lines)), f"The {code} comes with a two year warranty.")
+        documents.append({"_id": f"chunk_{i}", "textContent": " ".join(lines), "metadata": {"title": f"chunk_{i}"}})
+        queries.append(("code", f"what is the warranty for model {code}", f"chunk_{i}"))
+        queries.append(("text", rng.choice([line for line in lines if code not in line]), f"chunk_{i}"))
+    for doc, vector in zip(documents, embeddings.embed_documents([doc["textContent"] for doc in documents])):
+        doc["vectorContent"] = vector
+    collection.insert_many(documents)
+    collection.replace_one({"_id": "manifest:synthetic"}, {"manifest": True, "source": "synthetic", "sha256": str(chunks),
+                                                          "chunk_ids": []})
+    return collection, queries
+
+def run(label: str, search, queries: list[tuple[str, str, str]]):
+    for kind in ("code", "text"):
+        selected = [q for q in queries if q[0] == kind]
+        latencies, hits = [], 0
+        for _, query, expected in selected:
+            started = time.perf_counter()
+            results = search(query)
+            latencies.append(time.perf_counter() - started)
+            hits += any(doc.metadata["title"] == expected for doc in results)
+        print(f"{label:12} {kind:4} queries: recall@4 {hits / len(selected):.3f} "
+              f"p50 {format_ms(percentile(latencies, 50))} p95 {format_ms(percentile(latencies, 95))}")
+
+def main(args):
+    rng = random.Random(args.seed)
+    collection, queries = make_corpus(args.chunks, rng)
+    queries = rng.sample(queries, min(args.queries, len(queries)))
+
+    vector_store = LocalVectorIndex(FakeEmbeddings(dimensions=256, latency=args.embedding_latency))
+    vector_store.sync(collection)
+    lexical_index = BM25Index()
+    lexical_index.sync(collection)
+    print(f"{args.chunks} chunks, {len(queries)} queries, embedding latency {format_ms(args.embedding_latency)}")
+
+    run("vector only", lambda query: vector_search(query, vector_store), queries)
+    calls_before = vector_store.embeddings.calls
+    run("hybrid", lambda query: hybrid_search(query, vector_store, lexical_index), queries)
+    embedded = vector_store.embeddings.calls - calls_before
+    print(f"hybrid skipped the embeddings call for {1 - embedded / len(queries):.0%} of queries")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare vector-only and hybrid search on recall and latency")
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="seconds per embeddings request")
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
@@ -0,0 +1,86 @@
+"""Benchmark for the PDF ingestion pipeline on a synthetic corpus.
+
+Compares the original single-process ingestion (parse every PDF, keep all chunks in memory, then embed and
+insert) with the streaming pipeline at different worker counts, using a fake embedder with a fixed per-request
+latency and an in-memory collection.
+
+    python -m benchmarks.ingest_throughput --files 200 --pages 10 --workers 1,2,4 --embedding-latency 0.05
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+import pdfplumber
+from langchain_core.documents import Document
+from chunking import Chunker, chunk_text
+from ingestion import batched, ingest_pdfs, list_pdfs
+from benchmarks.fakes import FakeEmbeddings, InMemoryCollection, write_synthetic_pdf
+from benchmarks.util import peak_rss_mb
+
+def baseline_ingest(pdf_dir: str, collection, embeddings) -> int:
+    # The ingestion path before the pipeline: sequential parsing and one big in-memory list of documents
+    documents = []
+    for filename in list_pdfs(pdf_dir):
+        with pdfplumber.open(os.path.join(pdf_dir, filename)) as pdf:
+            full_text = ""
+            for page in pdf.pages:
+                page_text = page.extract_text()
+                if page_text:
+                    full_text += page_text
+            for i, chunk in enumerate(chunk_text(full_text)):
+                documents.append(Document(page_content=chunk, metadata={"title": f"{filename}_chunk_{i}"}))
+    for batch in batched(documents, 1000):
+        vectors = embeddings.embed_documents([doc.page_content for doc in batch])
+        collection.insert_many([{"textContent": d.page_content, "vectorContent": v, "metadata": d.metadata}
+                                for d, v in zip(batch, vectors)])
+    return len(documents)
+
+def _measure(mode: str, pdf_dir: str, args: argparse.Namespace, workers: int, results):
+    # Runs in a fresh process so peak RSS belongs to this configuration alone
+    embeddings = FakeEmbeddings(dimensions=args.dimensions, latency=args.embedding_latency)
+    started = time.perf_counter()
+    if mode == "baseline":
+        chunks = baseline_ingest(pdf_dir, InMemoryCollection(), embeddings)
+    else:
+        chunks = ingest_pdfs(pdf_dir, InMemoryCollection(), embeddings, workers=workers,
+                             pages_per_task=args.pages_per_task, batch_size=args.batch_size,
+                             embedding_concurrency=args.embedding_concurrency,
+                             chunker=Chunker("chars"))  # Same chunks as the baseline, only the pipeline differs
+    results.put((chunks, time.perf_counter() - started, peak_rss_mb()))
+
+def run(label: str, mode: str, pdf_dir: str, args: argparse.Namespace, workers: int = 1):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(mode, pdf_dir, args, workers, results))
+    process.start()
+    chunks, elapsed, peak_rss = results.get()
+    process.join()
+    pages = args.files * args.pages
+    print(f"{label:32} {elapsed:7.2f}s {pages / elapsed:8.1f} pages/s {chunks / elapsed:8.1f} chunks/s "
+          f"peak main-process RSS {peak_rss:7.1f}MB")
+
+def main(args):
+    with tempfile.TemporaryDirectory() as pdf_dir:
+        for i in range(args.files):
+            write_synthetic_pdf(os.path.join(pdf_dir, f"doc_{i:05}.pdf"), args.pages, seed=i)
+        print(f"corpus: {args.files} PDFs, {args.files * args.pages} pages, "
+              f"embedding latency {args.embedding_latency * 1000:.0f}ms/request, {os.cpu_count()} cpus")
+
+        if not args.skip_baseline:
+            run("baseline (sequential)", "baseline", pdf_dir, args)
+        for workers in (int(w) for w in args.workers.split(",")):
+            run(f"pipeline workers={workers} batch={args.batch_size}", "pipeline", pdf_dir, args, workers)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark PDF ingestion throughput on a synthetic corpus")
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--pages", type=int, default=4)
+    parser.add_argument("--workers", default="1,2,4", help="comma separated worker counts to try")
+    parser.add_argument("--pages-per-task", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--embedding-concurrency", type=int, default=4)
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="seconds per embeddings request")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--skip-baseline", action="store_true")
+    main(parser.parse_args())
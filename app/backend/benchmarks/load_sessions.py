@@ -0,0 +1,141 @@
+"""Load test for RTMiddleTier session isolation and scheduling.
+
+Runs many simulated voice sessions through the middle tier against a local fake realtime server, each turn
+triggering a tool call, and checks that no session ever receives or answers another session's tool calls.
+
+    python -m benchmarks.load_sessions --sessions 200 --turns 3 --max-active 50 --max-queued 100
+"""
+import argparse
+import asyncio
+import json
+import time
+import aiohttp
+from aiohttp import web
+from azure.core.credentials import AzureKeyCredential
+from metrics import mark, registry
+from rtmt import RTMiddleTier, Tool, ToolResult, ToolResultDirection
+from scheduler import SessionScheduler
+from benchmarks.fake_realtime import FakeRealtimeConfig, FakeRealtimeServer
+from benchmarks.util import format_ms, percentile
+
+_tool_schema = {
+    "type": "function",
+    "name": "search",
+    "parameters": {"type": "object", "properties": {"query": {"type": "string"}}, "required": ["query"]}
+}
+
+class SessionOutcome:
+    admitted: bool = False
+    rejected: bool = False
+    error: str = ""
+
+    def __init__(self):
+        self.turn_latencies: list[float] = []
+        self.connect_time = 0.0
+
+async def run_client(url: str, turns: int, frames_per_turn: int, outcome: SessionOutcome):
+    start = time.perf_counter()
+    async with aiohttp.ClientSession() as http:
+        async with http.ws_connect(url, max_msg_size=0) as ws:
+            # Wait for the upstream connection, the middle tier reports queueing with extension.middle_tier_status
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    break
+                if json.loads(msg.data)["type"] == "session.created":
+                    await ws.send_json({"type": "session.update", "session": {"turn_detection": {"type": "server_vad"}}})
+                elif json.loads(msg.data)["type"] == "session.updated":
+                    break
+            if ws.closed:
+                outcome.rejected = ws.close_code == aiohttp.WSCloseCode.TRY_AGAIN_LATER
+                return
+            outcome.admitted = True
+            outcome.connect_time = time.perf_counter() - start
+
+            for _ in range(turns):
+                for _ in range(frames_per_turn):
+                    await ws.send_json({"type": "input_audio_buffer.append", "audio": "AAAA"})
+                turn_start = time.perf_counter()
+                async for msg in ws:
+                    if msg.type != aiohttp.WSMsgType.TEXT:
+                        outcome.error = f"connection closed mid-turn ({ws.close_code})"
+                        return
+                    message = json.loads(msg.data)
+                    if message["type"] == "response.done" and message["response"]["output"]:
+                        outcome.turn_latencies.append(time.perf_counter() - turn_start)
+                        break
+
+async def main(args):
+    fake = FakeRealtimeServer(FakeRealtimeConfig(frames_per_turn=args.frames_per_turn, audio_deltas=args.audio_deltas,
+                                                 throttled_handshakes=args.throttled_handshakes,
+                                                 function_call_delay=args.model_delay))
+    await fake.start()
+
+    rtmt = RTMiddleTier(fake.endpoint, "fake-deployment", AzureKeyCredential("fake-key"))
+    if args.max_active:
+        rtmt.scheduler = SessionScheduler(args.max_active, args.max_queued, args.queue_timeout)
+
+    def search(tool_args):
+        # Blocking, like the real embeddings and pymongo calls, split between the two
+        time.sleep(args.tool_latency / 2)
+        mark("embedding_done")
+        time.sleep(args.tool_latency / 2)
+        mark("vector_query_done")
+        return ToolResult(f"[doc_0]: result for {tool_args['query']}\n-----\n", ToolResultDirection.TO_SERVER)
+    rtmt.speculative_tools = args.speculative
+    rtmt.tools["search"] = Tool(target=search, schema=_tool_schema,
+                                speculative_args=lambda transcript: {"query": transcript})
+
+    app = web.Application()
+    rtmt.attach_to_app(app, "/realtime")
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/realtime"
+
+    outcomes = [SessionOutcome() for _ in range(args.sessions)]
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *[run_client(url, args.turns, args.frames_per_turn, outcome) for outcome in outcomes], return_exceptions=True)
+    elapsed = time.perf_counter() - start
+
+    await runner.cleanup()
+    await fake.stop()
+
+    failures = [r for r in results if isinstance(r, Exception)]
+    admitted = [o for o in outcomes if o.admitted]
+    latencies = [latency for o in outcomes for latency in o.turn_latencies]
+    waits = [o.connect_time for o in admitted]
+    print(f"sessions: {args.sessions} admitted: {len(admitted)} "
+          f"rejected: {sum(o.rejected for o in outcomes)} errors: {len(failures) + sum(bool(o.error) for o in outcomes)}")
+    print(f"turns completed: {len(latencies)} in {elapsed:.2f}s ({len(latencies) / elapsed:.1f} turns/s)")
+    print(f"turn latency p50 {format_ms(percentile(latencies, 50))} p95 {format_ms(percentile(latencies, 95))} "
+          f"p99 {format_ms(percentile(latencies, 99))}")
+    print(f"admission wait p50 {format_ms(percentile(waits, 50))} p99 {format_ms(percentile(waits, 99))}")
+    print(f"upstream handshakes throttled: {fake.stats.throttled} "
+          f"connect rate settled at {rtmt.upstream.limiter.rate:.1f}/s")
+    print(f"tool outputs: {fake.stats.tool_outputs} answered for another session: {fake.stats.foreign_tool_outputs}")
+    if args.speculative:
+        print(f"tool calls served from speculative results: {rtmt.speculative_hits}")
+    if args.show_metrics:
+        print(registry.render(), end="")
+    for failure in failures[:5]:
+        print("error:", repr(failure))
+    if fake.stats.foreign_tool_outputs:
+        raise SystemExit("Tool calls leaked across sessions")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test RTMiddleTier against a local fake realtime server")
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--frames-per-turn", type=int, default=5)
+    parser.add_argument("--audio-deltas", type=int, default=20)
+    parser.add_argument("--tool-latency", type=float, default=0.05, help="seconds each blocking tool call takes")
+    parser.add_argument("--max-active", type=int, default=0, help="session cap, 0 for unlimited")
+    parser.add_argument("--max-queued", type=int, default=0)
+    parser.add_argument("--queue-timeout", type=float, default=None)
+    parser.add_argument("--throttled-handshakes", type=int, default=0, help="upstream connections answered with 429")
+    parser.add_argument("--model-delay", type=float, default=0.0, help="seconds from end of speech to the function call")
+    parser.add_argument("--speculative", action="store_true", help="start searches on the input transcript")
+    parser.add_argument("--show-metrics", action="store_true", help="print what /metrics would report at the end")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,75 @@
+"""Latency of the local vector index on precomputed embeddings, exact search vs the HNSW graph.
+
+Fills an in-memory collection with clustered random vectors (uniform noise is the worst case for HNSW, real
+embeddings cluster by topic), mirrors it into LocalVectorIndex and times top-k queries.
+Recall is the share of HNSW results that exact search also returns. No Cosmos DB or embeddings endpoint involved.
+
+    python -m benchmarks.local_search --chunks 1000,10000,100000 --queries 500
+"""
+import argparse
+import tempfile
+import time
+import numpy as np
+from vector_index import LocalVectorIndex, hnswlib
+from benchmarks.fakes import FakeEmbeddings, InMemoryCollection
+from benchmarks.util import format_ms, percentile
+
+def clustered_vectors(count: int, centers: np.ndarray, rng: np.random.Generator, noise: float = 0.5) -> np.ndarray:
+    assignments = rng.integers(0, len(centers), count)
+    return centers[assignments] + noise * rng.standard_normal((count, centers.shape[1]), dtype=np.float32)
+
+def make_collection(vectors: np.ndarray) -> InMemoryCollection:
+    collection = InMemoryCollection()
+    chunks = len(vectors)
+    collection.insert_many([{"_id": f"chunk_{i}", "textContent": f"chunk {i}", "vectorContent": vector,
+                             "metadata": {"title": f"chunk_{i}"}} for i, vector in enumerate(vectors)])
+    collection.replace_one({"_id": "manifest:synthetic"}, {"manifest": True, "source": "synthetic", "sha256": str(chunks),
+                                                          "chunk_ids": []})
+    return collection
+
+def measure(index: LocalVectorIndex, queries: np.ndarray, k: int) -> tuple[list[float], list[set]]:
+    latencies, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        hits = index.search_by_vector(query, k)
+        latencies.append(time.perf_counter() - started)
+        results.append({doc["_id"] for doc, _ in hits})
+    return latencies, results
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    embeddings = FakeEmbeddings(args.dimensions)
+    for chunks in (int(c) for c in args.chunks.split(",")):
+        centers = rng.standard_normal((max(1, chunks // 50), args.dimensions), dtype=np.float32)
+        collection = make_collection(clustered_vectors(chunks, centers, rng))
+        queries = clustered_vectors(args.queries, centers, rng)
+        with tempfile.TemporaryDirectory() as path:
+            exact = LocalVectorIndex(embeddings, path=path, hnsw_threshold=chunks + 1)
+            started = time.perf_counter()
+            exact.sync(collection)
+            print(f"{chunks} chunks x {args.dimensions} dimensions, mirrored in {time.perf_counter() - started:.2f}s")
+            latencies, truth = measure(exact, queries, args.k)
+            print(f"  exact      p50 {format_ms(percentile(latencies, 50))} p99 {format_ms(percentile(latencies, 99))}")
+
+        if hnswlib is None:
+            print("  hnsw       skipped, pip install hnswlib")
+            continue
+        for ef_search in (int(ef) for ef in args.ef_search.split(",")):
+            approximate = LocalVectorIndex(embeddings, hnsw_threshold=0, ef_search=ef_search)
+            started = time.perf_counter()
+            approximate.sync(collection)
+            build = time.perf_counter() - started
+            latencies, results = measure(approximate, queries, args.k)
+            recall = np.mean([len(r & t) / len(t) for r, t in zip(results, truth)])
+            print(f"  hnsw ef={ef_search:<4} p50 {format_ms(percentile(latencies, 50))} "
+                  f"p99 {format_ms(percentile(latencies, 99))} recall@{args.k} {recall:.3f} built in {build:.2f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure local vector index latency and HNSW recall")
+    parser.add_argument("--chunks", default="1000,10000,50000", help="comma separated corpus sizes")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--ef-search", default="32,64,128", help="comma separated HNSW ef values to try")
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
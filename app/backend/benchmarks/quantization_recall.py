@@ -0,0 +1,70 @@
+"""Recall vs size of the local vector index's compact first-stage search, with and without exact re-ranking.
+
+Clustered random vectors stand in for embeddings (see benchmarks.local_search). `--decay` makes later dimensions
+carry less variance, roughly what Matryoshka-trained models like text-embedding-3 produce, which is what makes
+truncating them work; at 0 every dimension matters equally and truncation is the worst case. Recall is the share
+of exact float32 top-k results each configuration also returns. No Cosmos DB or embeddings endpoint involved.
+
+    python -m benchmarks.quantization_recall --chunks 50000 --rerank 4,40,100
+    python -m benchmarks.quantization_recall --configs int8,binary,binary:512,none:256 --decay 0
+"""
+import argparse
+import tempfile
+import time
+import numpy as np
+from vector_index import LocalVectorIndex
+from benchmarks.fakes import FakeEmbeddings
+from benchmarks.local_search import clustered_vectors, make_collection, measure
+from benchmarks.util import format_ms, percentile
+
+def parse_config(config: str) -> tuple[str, int]:
+    method, _, dimensions = config.partition(":")
+    return method, int(dimensions) if dimensions else 0
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    embeddings = FakeEmbeddings(args.dimensions)
+    # Per-dimension spread falling off from the first dimension
+    spread = np.exp(-args.decay * np.arange(args.dimensions) / args.dimensions).astype(np.float32)
+    centers = rng.standard_normal((max(1, args.chunks // 50), args.dimensions), dtype=np.float32) * spread
+    collection = make_collection(clustered_vectors(args.chunks, centers, rng) * spread)
+    queries = clustered_vectors(args.queries, centers, rng) * spread
+    float_mb = args.chunks * args.dimensions * 4 / 2**20
+
+    with tempfile.TemporaryDirectory() as path:
+        exact = LocalVectorIndex(embeddings, path=path, hnsw_threshold=args.chunks + 1)
+        exact.sync(collection)
+        latencies, truth = measure(exact, queries, args.k)
+    print(f"{args.chunks} chunks x {args.dimensions} dimensions, decay {args.decay}")
+    print(f"  {'float32':14} {float_mb:8.1f}MB in memory  recall@{args.k} 1.000  "
+          f"p50 {format_ms(percentile(latencies, 50))}")
+
+    for method, dimensions in (parse_config(config) for config in args.configs.split(",")):
+        label = f"{method}:{dimensions}" if dimensions else method
+        for rerank in (int(r) for r in args.rerank.split(",")):
+            with tempfile.TemporaryDirectory() as path:
+                # Floats stay memory-mapped on disk, only the compact copy is held in memory
+                index = LocalVectorIndex(embeddings, path=path, quantization=method,
+                                         search_dimensions=dimensions or None, rerank_candidates=rerank)
+                started = time.perf_counter()
+                index.sync(collection)
+                encoded = time.perf_counter() - started
+                latencies, results = measure(index, queries, args.k)
+                recall = np.mean([len(r & t) / len(t) for r, t in zip(results, truth)])
+                size_mb = index._compact.nbytes / 2**20
+                print(f"  {label:14} {size_mb:8.1f}MB in memory ({float_mb / size_mb:4.1f}x smaller)  "
+                      f"recall@{args.k} {recall:.3f} re-ranking {rerank:<4} p50 {format_ms(percentile(latencies, 50))} "
+                      f"p99 {format_ms(percentile(latencies, 99))}  mirrored in {encoded:.2f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure recall vs memory of quantized and truncated vector search")
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--configs", default="int8,binary,int8:512,binary:512,none:256",
+                        help="comma separated quantization[:search dimensions] to compare")
+    parser.add_argument("--rerank", default="4,40", help="comma separated re-ranking candidate counts, 4 is none")
+    parser.add_argument("--decay", type=float, default=3.0, help="how fast per-dimension variance falls off")
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
@@ -0,0 +1,76 @@
+"""Micro-benchmark for the per-frame relay work RTMiddleTier does in both directions.
+
+Replays a realistic mix of realtime frames, dominated by base64 audio, through _process_message_to_client and
+_process_message_to_server with the fast path off (every frame decoded) and on (pass-through frames relayed as-is).
+
+    python -m benchmarks.relay_throughput --frames 20000 --audio-bytes 4800
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import time
+import aiohttp
+from azure.core.credentials import AzureKeyCredential
+from rtmt import RTMiddleTier, RTSession
+
+def _frame(event_type: str, **fields) -> aiohttp.WSMessage:
+    return aiohttp.WSMessage(aiohttp.WSMsgType.TEXT, json.dumps({"type": event_type, "event_id": "event_0", **fields}), None)
+
+def client_bound_frames(audio_bytes: int) -> list[aiohttp.WSMessage]:
+    # One spoken answer: audio and transcript deltas interleaved, wrapped in the usual response events
+    audio = base64.b64encode(os.urandom(audio_bytes)).decode("ascii")
+    ids = {"response_id": "resp_0", "item_id": "item_0", "output_index": 0, "content_index": 0}
+    frames = [
+        _frame("input_audio_buffer.speech_stopped", audio_end_ms=1000, item_id="item_u"),
+        _frame("response.created", response={"id": "resp_0", "output": []}),
+        _frame("response.output_item.added", response_id="resp_0", output_index=0,
+               item={"id": "item_0", "type": "message", "content": []}),
+    ]
+    for _ in range(50):
+        frames.append(_frame("response.audio.delta", **ids, delta=audio))
+        frames.append(_frame("response.audio_transcript.delta", **ids, delta="word "))
+    frames.append(_frame("response.audio.done", **ids))
+    frames.append(_frame("response.done", response={"id": "resp_0", "output": [{"id": "item_0", "type": "message"}]}))
+    return frames
+
+def server_bound_frames(audio_bytes: int) -> list[aiohttp.WSMessage]:
+    audio = base64.b64encode(os.urandom(audio_bytes)).decode("ascii")
+    return [_frame("input_audio_buffer.append", audio=audio) for _ in range(100)]
+
+async def measure(rtmt: RTMiddleTier, rt_session: RTSession, frames: list[aiohttp.WSMessage], total: int, to_client: bool):
+    process = rtmt._process_message_to_client if to_client else rtmt._process_message_to_server
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    for i in range(total):
+        await process(frames[i % len(frames)], rt_session)
+    return time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+async def main(args):
+    rtmt = RTMiddleTier("http://localhost", "fake-deployment", AzureKeyCredential("fake-key"))
+    rt_session = RTSession(client_ws=None)
+
+    # A live session exchanges roughly this many frames per second while the model is speaking: 10 appends of
+    # 100ms of microphone audio plus audio and transcript deltas streamed a little faster than real time
+    frames_per_session_second = {"client-bound": 2 * 10 * 1.5, "server-bound": 10}
+    for direction, frames, to_client in [("client-bound", client_bound_frames(args.audio_bytes), True),
+                                         ("server-bound", server_bound_frames(args.audio_bytes), False)]:
+        results = {}
+        for fast_path in (False, True):
+            rtmt.relay_fast_path = fast_path
+            await measure(rtmt, rt_session, frames, len(frames), to_client)  # Warm up
+            results[fast_path] = await measure(rtmt, rt_session, frames, args.frames, to_client)
+
+        for fast_path, (wall, cpu) in results.items():
+            cpu_per_frame = cpu / args.frames
+            session_cpu = cpu_per_frame * frames_per_session_second[direction] * 100
+            print(f"{direction:13} fast path {'on ' if fast_path else 'off'}: {args.frames / wall:10.0f} frames/s "
+                  f"{cpu_per_frame * 1e6:8.2f}us cpu/frame {session_cpu:6.3f}% of a core per session")
+        speedup = results[False][1] / max(results[True][1], 1e-9)
+        print(f"{direction:13} cpu reduction: {speedup:.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure relay frames/sec and CPU per frame with and without the fast path")
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--audio-bytes", type=int, default=4800, help="raw pcm16 bytes per audio frame")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,95 @@
+"""Size of the search tool's output with and without result packing, and whether the answer survives it.
+
+Chunks of about 200 tokens each hold one answer sentence about a product code, and some are near copies of
+another chunk, the way the same policy repeats across documents. Code queries ask about one code, text queries are
+most words of one of a chunk's other sentences, which is the answer then. Each is searched through the real search
+tool (BM25 fused with the local vector index, on the offline hashed embedder), once sending every result whole and
+once packed to each `--budgets` token budget. Reports tokens sent to the model per search, the share of searches
+whose output still contains the answer sentence (out of those where the unpacked output did) and the search time.
+
+    python -m benchmarks.result_packing --chunks 2000 --queries 200 --budgets 300,600,1000 --k 6
+"""
+import argparse
+import random
+import time
+from chunking import count_tokens
+from lexical_index import BM25Index
+from ragtools import VectorSearchSettings, _search_tool
+from result_packing import ResultPacker
+from vector_index import LocalVectorIndex
+from benchmarks.fakes import FakeEmbeddings, InMemoryCollection, synthetic_page_text
+from benchmarks.util import format_ms, percentile
+
+def make_corpus(chunks: int, duplicates: float, rng: random.Random) -> tuple[InMemoryCollection, list[tuple[str, str, str]]]:
+    embeddings = FakeEmbeddings(dimensions=256)
+    documents, queries = [], []
+    for i in range(chunks):
+        code = f"CX-{i:04}"
+        answer = f"The {code} comes with a {rng.randint(1, 5)} year warranty."
+        if documents and rng.random() < duplicates:
+            # A near copy of an earlier chunk with this chunk's answer in place of one of its sentences
+            lines = rng.choice(documents)["lines"].copy()
+            lines[rng.randrange(len(lines))] = answer
+        else:
+            lines = synthetic_page_text(rng, 14)
+            lines.insert(rng.randrange(len(lines)), answer)
+        documents.append({"_id": f"chunk_{i}", "lines": lines, "textContent": " ".join(lines),
+                          "metadata": {"title": f"chunk_{i}"}})
+        queries.append(("code", f"what is the warranty for model {code}", answer))
+        line = rng.choice([line for line in lines if "CX-" not in line])
+        queries.append(("text", " ".join(rng.sample(line.rstrip(".").split(), 10)), line))
+    for doc, vector in zip(documents, embeddings.embed_documents([doc["textContent"] for doc in documents])):
+        doc["vectorContent"] = vector
+        del doc["lines"]
+    collection = InMemoryCollection()
+    collection.insert_many(documents)
+    collection.replace_one({"_id": "manifest:synthetic"}, {"manifest": True, "source": "synthetic", "sha256": str(chunks),
+                                                          "chunk_ids": []})
+    return collection, queries
+
+def main(args):
+    rng = random.Random(args.seed)
+    collection, queries = make_corpus(args.chunks, args.duplicates, rng)
+    queries = rng.sample(queries, min(args.queries, len(queries)))
+    vector_store = LocalVectorIndex(FakeEmbeddings(dimensions=256))
+    vector_store.sync(collection)
+    lexical_index = BM25Index()
+    lexical_index.sync(collection)
+    settings = VectorSearchSettings(k=args.k)
+    print(f"{args.chunks} chunks ({args.duplicates:.0%} near copies), {len(queries)} queries, k={args.k}")
+
+    def search(query: str, packer):
+        return _search_tool(vector_store, {"query": query}, {}, lexical_index, None, settings, packer).to_text()
+
+    for kind in ("code", "text"):
+        selected = [(query, answer) for query_kind, query, answer in queries if query_kind == kind]
+        unpacked = [search(query, None) for query, _ in selected]
+        answered = [answer in output for (_, answer), output in zip(selected, unpacked)]
+        tokens = [count_tokens(output) for output in unpacked]
+        print(f"{kind} queries, answer in the unpacked output for {sum(answered) / len(answered):.1%}")
+        print(f"  {'unpacked':12} {sum(tokens) / len(tokens):6.0f} tokens/search (p95 {percentile(tokens, 95):.0f})")
+        for budget in (int(b) for b in args.budgets.split(",")):
+            packer = ResultPacker(token_budget=budget, score_gap=args.score_gap,
+                                  duplicate_threshold=args.duplicate_threshold)
+            kept, tokens, latencies = 0, [], []
+            for (query, answer), answered_unpacked in zip(selected, answered):
+                started = time.perf_counter()
+                output = search(query, packer)
+                latencies.append(time.perf_counter() - started)
+                tokens.append(count_tokens(output))
+                kept += answered_unpacked and answer in output
+            print(f"  {f'budget {budget}':12} {sum(tokens) / len(tokens):6.0f} tokens/search "
+                  f"(p95 {percentile(tokens, 95):.0f})  answer kept in {kept / max(1, sum(answered)):.1%}  "
+                  f"search p50 {format_ms(percentile(latencies, 50))}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure search tool output tokens with and without result packing")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=6, help="results per search before packing")
+    parser.add_argument("--budgets", default="300,600,1000", help="comma separated token budgets")
+    parser.add_argument("--duplicates", type=float, default=0.3, help="share of chunks that are near copies")
+    parser.add_argument("--score-gap", type=float, default=0.1)
+    parser.add_argument("--duplicate-threshold", type=float, default=0.8)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
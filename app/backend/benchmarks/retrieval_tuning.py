@@ -0,0 +1,169 @@
+"""Sweeps the vector index and search parameters over labelled queries and reports recall, latency and tokens.
+
+Each query is labelled with the chunk titles that answer it. For every k, exact search gives the best recall the
+embeddings allow, then every HNSW combination of m, ef_construction and ef_search is timed against it, along with
+the tokens the results would add to the model's context. The fastest combination within `--tolerance` of exact
+recall is printed as settings to use. The search runs on the local index's HNSW graph (hnswlib), which takes the
+same m and ef parameters as Cosmos DB's HNSW index, so recall carries over while latencies are in-process ones.
+
+By default the corpus is synthetic: clustered random vectors as in benchmarks.local_search, but varying in only a
+few dimensions, each labelled query a noisy copy of its answer's vector. To tune for real content, record a fixture once from the collection and a JSON
+Lines file of labelled queries ({"query": "...", "answers": ["file.pdf_3", ...]}), which embeds the queries with
+the configured model, then sweep it offline as often as needed:
+
+    python -m benchmarks.retrieval_tuning --chunks 20000 --k 3,4,6
+    python -m benchmarks.retrieval_tuning --record fixture.npz --labels queries.jsonl
+    python -m benchmarks.retrieval_tuning --fixture fixture.npz --m 8,16,32 --ef-search 16,40,100
+"""
+import argparse
+import json
+import os
+import random
+import time
+import numpy as np
+from chunking import count_tokens
+from vector_index import LocalVectorIndex, hnswlib
+from benchmarks.fakes import FakeEmbeddings, InMemoryCollection, synthetic_page_text
+from benchmarks.local_search import clustered_vectors
+from benchmarks.util import format_ms, percentile
+
+class Corpus:
+    collection: InMemoryCollection
+    query_vectors: np.ndarray
+    answers: list[set[str]]
+    tokens: dict[str, int]  # Tokens per chunk title
+
+    def __init__(self, chunks: list[dict], query_vectors: np.ndarray, answers: list[set[str]]):
+        self.collection = InMemoryCollection()
+        self.collection.insert_many(chunks)
+        self.collection.replace_one({"_id": "manifest:corpus"}, {"manifest": True, "source": "corpus",
+                                                                 "sha256": str(len(chunks)), "chunk_ids": []})
+        self.query_vectors = query_vectors
+        self.answers = answers
+        self.tokens = {chunk["metadata"]["title"]: count_tokens(chunk["textContent"]) for chunk in chunks}
+
+def synthetic_corpus(chunks: int, queries: int, dimensions: int, intrinsic: int, noise: float, seed: int) -> Corpus:
+    # Vectors cluster by topic in a space of few `intrinsic` dimensions projected up to `dimensions`, as real
+    # embeddings do, each query is its answer moved by `noise`, the way a spoken question is near but not on the chunk
+    # that answers it. The text only sets the tokens returned.
+    rng = np.random.default_rng(seed)
+    text_rng = random.Random(seed)
+    centers = rng.standard_normal((max(1, chunks // 50), intrinsic), dtype=np.float32)
+    latent = clustered_vectors(chunks, centers, rng)
+    projection = rng.standard_normal((intrinsic, dimensions), dtype=np.float32)
+    documents = [{"_id": f"chunk_{i}", "textContent": " ".join(synthetic_page_text(text_rng, text_rng.randint(4, 12))),
+                  "vectorContent": vector, "metadata": {"title": f"chunk_{i}"}}
+                 for i, vector in enumerate(latent @ projection)]
+    answers = rng.choice(chunks, min(queries, chunks), replace=False)
+    query_latent = latent[answers] + noise * rng.standard_normal((len(answers), intrinsic), dtype=np.float32)
+    return Corpus(documents, query_latent @ projection, [{f"chunk_{i}"} for i in answers])
+
+def load_fixture(path: str) -> Corpus:
+    with np.load(path) as fixture:
+        chunks = json.loads(str(fixture["chunks"]))
+        for chunk, vector in zip(chunks, fixture["vectors"]):
+            chunk["vectorContent"] = vector
+        queries = json.loads(str(fixture["queries"]))
+        return Corpus(chunks, fixture["query_vectors"], [set(query["answers"]) for query in queries])
+
+def record_fixture(path: str, labels: str):
+    # Needs the same environment as the server: the collection to copy and the embeddings model to embed queries with
+    from dotenv import load_dotenv
+    from ragtools import create_embeddings, init_mongo_client
+    load_dotenv()
+    collection = init_mongo_client(os.environ.get("MONGO_CONNECTION_STRING"))[
+        os.environ.get("MONGO_DB_NAME")][os.environ.get("MONGO_COLLECTION_NAME")]
+    with open(labels, encoding="utf-8") as f:
+        queries = [json.loads(line) for line in f if line.strip()]
+    chunks, vectors = [], []
+    for doc in collection.find({"manifest": {"$exists": False}}, {"textContent": 1, "vectorContent": 1, "metadata": 1}):
+        chunks.append({"_id": str(doc["_id"]), "textContent": doc["textContent"],
+                       "metadata": {"title": doc.get("metadata", {}).get("title", str(doc["_id"]))}})
+        vectors.append(doc["vectorContent"])
+    query_vectors = create_embeddings().embed_documents([query["query"] for query in queries])
+    np.savez_compressed(path, vectors=np.asarray(vectors, dtype=np.float32), chunks=json.dumps(chunks),
+                        query_vectors=np.asarray(query_vectors, dtype=np.float32), queries=json.dumps(queries))
+    print(f"Recorded {len(chunks)} chunks and {len(queries)} labelled queries to {path}")
+
+def measure(index: LocalVectorIndex, corpus: Corpus, k: int) -> tuple[float, list[float], float]:
+    latencies, hits, tokens = [], 0.0, 0
+    for vector, answers in zip(corpus.query_vectors, corpus.answers):
+        started = time.perf_counter()
+        results = index.search_by_vector(vector, k)
+        latencies.append(time.perf_counter() - started)
+        titles = {doc["metadata"]["title"] for doc, _ in results}
+        hits += len(titles & answers) / min(len(answers), k)
+        tokens += sum(corpus.tokens[title] for title in titles)
+    queries = len(corpus.answers)
+    return hits / queries, latencies, tokens / queries
+
+def report(label: str, k: int, recall: float, latencies: list[float], tokens: float):
+    print(f"  {label:32} k={k:<3} recall@k {recall:.3f}  p50 {format_ms(percentile(latencies, 50))} "
+          f"p99 {format_ms(percentile(latencies, 99))}  {tokens:6.0f} tokens returned")
+
+def main(args):
+    if args.record:
+        record_fixture(args.record, args.labels)
+        return
+    corpus = load_fixture(args.fixture) if args.fixture else \
+        synthetic_corpus(args.chunks, args.queries, args.dimensions, args.intrinsic_dimensions, args.noise,
+                         args.seed)
+    chunks = len(corpus.tokens)
+    ks = [int(k) for k in args.k.split(",")]
+    print(f"{chunks} chunks, {len(corpus.answers)} labelled queries")
+
+    exact = LocalVectorIndex(FakeEmbeddings(), hnsw_threshold=chunks + 1)
+    exact.sync(corpus.collection)
+    best_recall = {}
+    for k in ks:
+        best_recall[k], latencies, tokens = measure(exact, corpus, k)
+        report("exact", k, best_recall[k], latencies, tokens)
+    if hnswlib is None:
+        print("HNSW sweep skipped, pip install hnswlib")
+        return
+
+    rows = []
+    for m in (int(m) for m in args.m.split(",")):
+        for ef_construction in (int(ef) for ef in args.ef_construction.split(",")):
+            index = LocalVectorIndex(FakeEmbeddings(), hnsw_threshold=0, hnsw_m=m, hnsw_ef_construction=ef_construction)
+            started = time.perf_counter()
+            index.sync(corpus.collection)
+            print(f"HNSW m={m} ef_construction={ef_construction}, built in {time.perf_counter() - started:.1f}s")
+            for ef_search in (int(ef) for ef in args.ef_search.split(",")):
+                for k in ks:
+                    # hnswlib needs at least k candidates, as does Cosmos DB
+                    index._hnsw.set_ef(max(ef_search, k))
+                    recall, latencies, tokens = measure(index, corpus, k)
+                    report(f"m={m} ef_construction={ef_construction} ef={ef_search}", k, recall, latencies, tokens)
+                    rows.append((k, m, ef_construction, ef_search, recall, percentile(latencies, 99)))
+
+    print(f"Fastest settings within {args.tolerance} of exact recall:")
+    for k in ks:
+        candidates = [row for row in rows if row[0] == k and row[4] >= best_recall[k] - args.tolerance]
+        if not candidates:
+            print(f"  k={k}: none, try larger m or ef values")
+            continue
+        _, m, ef_construction, ef_search, recall, p99 = min(candidates, key=lambda row: row[5])
+        print(f"  k={k}: SEARCH_TOP_K={k} VECTOR_INDEX_M={m} VECTOR_INDEX_EF_CONSTRUCTION={ef_construction} "
+              f"SEARCH_EF_SEARCH={ef_search}  (recall@k {recall:.3f}, p99 {format_ms(p99)})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep vector index parameters and top-k over labelled queries")
+    parser.add_argument("--fixture", help="corpus recorded with --record, instead of the synthetic one")
+    parser.add_argument("--record", help="copy the collection and embed --labels into this fixture file, then exit")
+    parser.add_argument("--labels", help="JSON Lines of {\"query\", \"answers\": [chunk titles]} to record")
+    parser.add_argument("--chunks", type=int, default=10000, help="synthetic corpus size")
+    parser.add_argument("--queries", type=int, default=300, help="synthetic labelled queries")
+    parser.add_argument("--dimensions", type=int, default=1536, help="synthetic embedding size")
+    parser.add_argument("--intrinsic-dimensions", type=int, default=24, help="synthetic dimensions that vary")
+    parser.add_argument("--noise", type=float, default=0.8, help="distance of synthetic queries from their answers")
+    parser.add_argument("--k", default="2,4,8", help="comma separated result counts")
+    parser.add_argument("--m", default="8,16,32", help="comma separated HNSW graph degrees")
+    parser.add_argument("--ef-construction", default="64,200", help="comma separated HNSW build candidate lists")
+    parser.add_argument("--ef-search", default="16,40,100", help="comma separated HNSW search candidate lists")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="recall below exact search still accepted")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.record and not args.labels:
+        parser.error("--record needs --labels")
+    main(args)
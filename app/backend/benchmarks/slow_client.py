@@ -0,0 +1,127 @@
+"""Relays spoken answers to clients that read slower than the realtime service streams, the way phones on poor
+networks do, and reports what the middle tier's outbound queues do about it.
+
+Each client reads at `--client-kbps` with small socket buffers, so the middle tier sees backpressure within a frame
+or two instead of after megabytes of kernel buffering. Runs once with delta coalescing off and once with it on and
+reports frames and bytes written to clients, the peak bytes queued per session, overflows, and how long the
+answers took to arrive.
+
+    python -m benchmarks.slow_client --sessions 20 --client-kbps 96 --audio-deltas 100
+    python -m benchmarks.slow_client --client-kbps 16 --high-water 262144 --policy drop_audio
+"""
+import argparse
+import asyncio
+import json
+import socket
+import time
+import aiohttp
+from aiohttp import web
+from azure.core.credentials import AzureKeyCredential
+from rtmt import RTMiddleTier
+from benchmarks.fake_realtime import FakeRealtimeConfig, FakeRealtimeServer
+from benchmarks.util import format_ms, percentile
+
+_SOCKET_BUFFER = 16384
+
+def _shrink_buffers(transport: asyncio.BaseTransport, option: int):
+    sock = transport.get_extra_info("socket") if transport is not None else None
+    if sock is not None:
+        sock.setsockopt(socket.SOL_SOCKET, option, _SOCKET_BUFFER)
+
+class ClientResult:
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.answer_seconds: list[float] = []
+        self.closed_early = False
+        self.audio_dropped = 0
+
+async def run_client(url: str, args, result: ClientResult):
+    async with aiohttp.ClientSession() as http:
+        async with http.ws_connect(url, max_msg_size=0) as ws:
+            _shrink_buffers(ws._response.connection.transport if ws._response.connection else None, socket.SO_RCVBUF)
+            while json.loads((await ws.receive()).data)["type"] != "session.created":
+                pass
+            await ws.send_json({"type": "session.update", "session": {"turn_detection": {"type": "server_vad"}}})
+            for _ in range(args.turns):
+                for _ in range(5):
+                    await ws.send_json({"type": "input_audio_buffer.append", "audio": "AAAA"})
+                started = time.perf_counter()
+                while True:
+                    msg = await ws.receive()
+                    if msg.type != aiohttp.WSMsgType.TEXT:
+                        result.closed_early = True
+                        return
+                    result.frames += 1
+                    result.bytes += len(msg.data)
+                    # Reading at the client's bandwidth
+                    await asyncio.sleep(len(msg.data) * 8 / (args.client_kbps * 1000))
+                    message = json.loads(msg.data)
+                    if message["type"] == "extension.middle_tier_status" and message["status"] == "audio_dropped":
+                        result.audio_dropped += message["bytes"]
+                    if message["type"] == "response.done" and message["response"]["output"]:
+                        result.answer_seconds.append(time.perf_counter() - started)
+                        break
+
+async def run(label: str, args, coalesce_max_bytes: int):
+    fake = FakeRealtimeServer(FakeRealtimeConfig(function_call=False, audio_deltas=args.audio_deltas,
+                                                 input_transcript=None))
+    await fake.start()
+    rtmt = RTMiddleTier(fake.endpoint, "fake-deployment", AzureKeyCredential("fake-key"))
+    rtmt.client_coalesce_max_bytes = coalesce_max_bytes
+    rtmt.client_high_water = args.high_water
+    rtmt.client_overflow_policy = args.policy
+
+    async def handler(request: web.Request):
+        _shrink_buffers(request.transport, socket.SO_SNDBUF)
+        return await rtmt._websocket_handler(request)
+
+    app = web.Application()
+    rtmt.attach_to_app(app, "/unused")
+    app.router.add_get("/realtime", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/realtime"
+
+    peak_queued = 0
+    async def sample():
+        nonlocal peak_queued
+        while True:
+            for rt_session in list(rtmt.sessions.values()):
+                peak_queued = max(peak_queued, rt_session.outbound.queued_bytes)
+            await asyncio.sleep(0.005)
+    sampler = asyncio.create_task(sample())
+
+    results = [ClientResult() for _ in range(args.sessions)]
+    cpu_started = time.process_time()
+    await asyncio.gather(*[run_client(url, args, result) for result in results])
+    cpu = time.process_time() - cpu_started
+    sampler.cancel()
+    await runner.cleanup()
+    await fake.stop()
+
+    answers = [seconds for r in results for seconds in r.answer_seconds]
+    frames = sum(r.frames for r in results)
+    print(f"{label:16} {frames / args.sessions:7.0f} frames/session {sum(r.bytes for r in results) / args.sessions / 1024:7.0f}KB/session "
+          f"peak queued {peak_queued / 1024:6.0f}KB  answer p50 {format_ms(percentile(answers, 50))} "
+          f"p95 {format_ms(percentile(answers, 95))}  closed {sum(r.closed_early for r in results)} "
+          f"audio dropped {sum(r.audio_dropped for r in results) / 1024:.0f}KB  cpu {cpu:.2f}s")
+
+async def main(args):
+    print(f"{args.sessions} sessions reading at {args.client_kbps}kbps, {args.audio_deltas} audio deltas per answer, "
+          f"queue limit {args.high_water // 1024}KB ({args.policy})")
+    await run("coalescing off", args, 0)
+    await run("coalescing on", args, args.coalesce_max_bytes)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Outbound queues and delta coalescing for clients that read slowly")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=2)
+    parser.add_argument("--audio-deltas", type=int, default=100, help="audio deltas of 100ms per answer")
+    parser.add_argument("--client-kbps", type=float, default=96, help="bandwidth each client reads at")
+    parser.add_argument("--coalesce-max-bytes", type=int, default=1 << 18)
+    parser.add_argument("--high-water", type=int, default=1 << 20, help="bytes queued per session before the policy")
+    parser.add_argument("--policy", choices=("close", "drop_audio"), default="close")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,32 @@
+import math
+import os
+import sys
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+def percentile(values: list[float], p: float) -> float:
+    # Nearest-rank percentile, good enough for benchmark reports
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def format_ms(seconds: float) -> str:
+    return f"{seconds * 1000:.1f}ms"
+
+def peak_rss_mb() -> float:
+    if resource is None:
+        return float("nan")
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2**20 if sys.platform == "darwin" else max_rss / 1024  # bytes on macOS, kilobytes elsewhere
+
+def current_rss_mb() -> float:
+    # Resident memory right now where /proc is available, the peak elsewhere
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_mb()
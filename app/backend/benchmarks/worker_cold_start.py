@@ -0,0 +1,112 @@
+"""Cold deploy of a multi-worker server on an empty collection: how soon each worker starts answering searches.
+
+Only the primary worker builds the index. The others find the collection empty at startup and answer that the
+knowledge base is still being indexed until they notice the primary's chunks. Workers run as threads over one
+in-memory collection (the fake can't be shared across processes the way Cosmos DB is), each with its own build
+status and the real search tool on a fake vector store, and each is asked to search every `--interval` seconds.
+For each `--recheck-seconds` value it reports when the primary's build finished and when every worker first
+answered with results. `inf` never checks again, which is how every non-primary worker behaved before the re-check.
+
+    python -m benchmarks.worker_cold_start --workers 4 --files 10 --recheck-seconds inf,2,10
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+from azure.core.credentials import AzureKeyCredential
+from langchain_core.documents import Document
+from ragtools import _STILL_INDEXING, _INDEX_NAME, IndexBuildStatus, _prepare_index, register_rag_tools
+from rtmt import RTMiddleTier
+from benchmarks.fakes import FakeEmbeddings, InMemoryCollection, write_synthetic_pdf
+
+class FakeCosmosStore:
+    # The calls the build and the search tool make on the Cosmos DB vector store
+    def __init__(self, collection: InMemoryCollection):
+        self._collection = collection
+
+    def create_index(self, *args):
+        self._collection.create_index([("vectorContent", "cosmosSearch")], name=_INDEX_NAME)
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> list[tuple[Document, float]]:
+        chunks = self._collection.find({"manifest": {"$exists": False}}, {"textContent": 1, "metadata": 1})[:k]
+        return [(Document(page_content=doc["textContent"], metadata=doc["metadata"]), 1.0) for doc in chunks]
+
+def run(pdf_dir: str, args, recheck_seconds: float):
+    collection = InMemoryCollection()
+    store = FakeCosmosStore(collection)
+    embeddings = FakeEmbeddings(dimensions=64, latency=args.embedding_latency)
+    statuses, first_answer, still_indexing_after_build = [], {}, {}
+    built_at = None
+    stop = threading.Event()
+
+    def client(worker: int, search):
+        nonlocal built_at
+        while not stop.is_set():
+            answered = search({"query": "warranty"}, {}).to_text() != _STILL_INDEXING
+            now = time.perf_counter() - started
+            if statuses[0].state == "ready" and built_at is None:
+                built_at = now
+            if answered:
+                first_answer.setdefault(worker, now)
+            elif built_at is not None:
+                still_indexing_after_build[worker] = still_indexing_after_build.get(worker, 0) + 1
+            time.sleep(args.interval)
+
+    threads = []
+    for worker in range(args.workers):
+        status = IndexBuildStatus()
+        status.recheck_seconds = recheck_seconds
+        statuses.append(status)
+        primary = worker == 0
+        if not primary:
+            status.state = "off"
+        # Same startup path as attach_rag_tools, without mirrors
+        threads.append(threading.Thread(target=_prepare_index, daemon=True,
+                                        args=(collection, store, embeddings, pdf_dir, status, primary, [], 0)))
+        rtmt = RTMiddleTier("http://unused", "fake-deployment", AzureKeyCredential("fake-key"))
+        register_rag_tools(rtmt, collection, store, searchable=lambda status=status: status.recheck(collection))
+        threads.append(threading.Thread(target=client, args=(worker, rtmt.tools["search"].target), daemon=True))
+    with contextlib.redirect_stdout(io.StringIO()):  # The build's progress lines
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        while built_at is None and time.perf_counter() - started < args.timeout:
+            time.sleep(0.05)
+        deadline = time.perf_counter() + args.timeout
+        while built_at is not None and time.perf_counter() < deadline and len(first_answer) < args.workers:
+            time.sleep(0.05)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    label = "never" if recheck_seconds == float("inf") else f"{recheck_seconds:g}s"
+    print(f"re-check {label}: build finished at {built_at:.1f}s" if built_at is not None else
+          f"re-check {label}: build didn't finish in {args.timeout:.0f}s")
+    for worker in range(args.workers):
+        answer = f"first answer at {first_answer[worker]:.1f}s" if worker in first_answer else \
+                 f"no answer {args.timeout:.0f}s after the build"
+        print(f"  worker {worker}{' (primary)' if worker == 0 else '':10} {answer}, "
+              f"{still_indexing_after_build.get(worker, 0)} \"still indexing\" answers after the build finished")
+
+def main(args):
+    with tempfile.TemporaryDirectory() as pdf_dir:
+        for i in range(args.files):
+            write_synthetic_pdf(os.path.join(pdf_dir, f"doc_{i:04}.pdf"), args.pages, seed=i)
+        print(f"{args.workers} workers, {args.files} PDFs of {args.pages} pages, searches every {args.interval}s")
+        for recheck_seconds in (float(value) for value in args.recheck_seconds.split(",")):
+            run(pdf_dir, args, recheck_seconds)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time until every worker of a cold multi-worker server can search")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--embedding-latency", type=float, default=0.02, help="seconds per embeddings request")
+    parser.add_argument("--interval", type=float, default=0.2, help="seconds between each worker's searches")
+    parser.add_argument("--recheck-seconds", default="inf,2,10", help="comma separated re-check intervals to compare")
+    parser.add_argument("--timeout", type=float, default=20,
+                        help="seconds to wait for the build, then for every worker to answer after it")
+    main(parser.parse_args())
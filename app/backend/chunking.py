@@ -0,0 +1,177 @@
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Callable
+
+def chunk_text(text, chunk_size=1000):
+    # Split text into chunks of the given size
+    return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+@lru_cache(maxsize=1)
+def _tiktoken_encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")  # The encoding of the text-embedding-3 and ada-002 models
+    except Exception:  # Not installed, or the encoding can't be downloaded
+        return None
+
+_APPROXIMATE_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+def count_tokens(text: str) -> int:
+    encoding = _tiktoken_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # Close enough for sizing chunks: one token per word or punctuation mark
+    return len(_APPROXIMATE_TOKEN.findall(text))
+
+class Chunk:
+    text: str
+    page: int  # First and last page the chunk was taken from, starting at 1
+    page_end: int
+
+    def __init__(self, text: str, page: int, page_end: int):
+        self.text = text
+        self.page = page
+        self.page_end = page_end
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_HYPHENATED_LINE_BREAK = re.compile(r"(\w)-\n(\w)")
+
+# Page numbers are the only part of a header or footer that changes from page to page ("Page 3 of 12", "- 3 -"),
+# other numbers (product codes, prices, weights) are part of the line
+_PAGE_NUMBER = re.compile(r"\bpage\s+\d+(?:\s*(?:of|/)\s*\d+)?\b|\b\d+\s*(?:of|/)\s*\d+\b|^[\W_]*\d+[\W_]*$")
+
+def _boilerplate_key(line: str) -> str:
+    return _PAGE_NUMBER.sub("#", " ".join(line.lower().split()))
+
+_EDGE_LINES = 2
+
+def _edge_lines(lines: list[str], edge_lines: int = _EDGE_LINES) -> list[int]:
+    # Indexes of the first and last few non-blank lines of a page, where headers and footers sit
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    return sorted(set(filled[:edge_lines] + filled[-edge_lines:]))
+
+def find_boilerplate(pages: list[str], min_pages: int = 3, min_ratio: float = 0.5,
+                     edge_lines: int = _EDGE_LINES) -> set[str]:
+    """Returns the keys of page edge lines repeated on at least `min_ratio` of the pages, headers and footers."""
+    if len(pages) < min_pages:
+        return set()
+    counts = Counter()
+    for page in pages:
+        lines = page.splitlines()
+        counts.update({_boilerplate_key(lines[i]) for i in _edge_lines(lines, edge_lines)})
+    threshold = max(min_pages, min_ratio * len(pages))
+    return {key for key, count in counts.items() if count >= threshold}
+
+# Splits pages into chunks of up to `max_tokens` embedding tokens at sentence ends, closing early at paragraph and page
+# boundaries, and drops headers, footers and repeated chunks; "chars" keeps the original fixed-size slices
+class Chunker:
+    def __init__(self, strategy: str = "tokens", max_tokens: int = 200, overlap_tokens: int = 0,
+                 chunk_size: int = 1000, dedupe: bool = True, token_counter: Callable[[str], int] = count_tokens):
+        if strategy not in ("tokens", "chars"):
+            raise ValueError(f"Unknown chunking strategy '{strategy}'")
+        self.strategy = strategy
+        self.max_tokens = max_tokens
+        self.overlap_tokens = min(overlap_tokens, max_tokens // 2)
+        self.chunk_size = chunk_size
+        self.dedupe = dedupe
+        self.count_tokens = token_counter
+
+    @property
+    def signature(self) -> str:
+        # Recorded in each file's manifest, a different configuration re-indexes the file
+        if self.strategy == "chars":
+            return f"chars:{self.chunk_size}"
+        return f"tokens:{self.max_tokens}:{self.overlap_tokens}:{'dedupe-edges' if self.dedupe else 'all'}"
+
+    def split(self, pages: list[str]) -> list[Chunk]:
+        if self.strategy == "chars":
+            # Page numbers aren't tracked when slicing across page boundaries
+            return [Chunk(text, 1, len(pages)) for text in chunk_text("".join(pages), self.chunk_size)]
+
+        chunks = self._pack(self._sentences(pages))
+        if not self.dedupe:
+            return chunks
+        unique, seen = [], set()
+        for chunk in chunks:
+            # Exact text up to spacing and case: chunks differing only in numbers (product codes, prices) both stay
+            key = " ".join(chunk.text.split()).casefold()
+            if key not in seen:
+                seen.add(key)
+                unique.append(chunk)
+        return unique
+
+    def _sentences(self, pages: list[str]) -> list[tuple[str, int, int, bool]]:
+        # (sentence, page, tokens, starts a new paragraph or page)
+        boilerplate = find_boilerplate(pages) if self.dedupe else set()
+        sentences = []
+        for page_number, page in enumerate(pages, start=1):
+            lines = page.splitlines()
+            if boilerplate:
+                dropped = {i for i in _edge_lines(lines) if _boilerplate_key(lines[i]) in boilerplate}
+                lines = [line for i, line in enumerate(lines) if i not in dropped]
+            text = _HYPHENATED_LINE_BREAK.sub(r"\1\2", "\n".join(lines))
+            for paragraph in _PARAGRAPH_BREAK.split(text):
+                new_paragraph = True
+                for sentence in _SENTENCE_END.split(" ".join(paragraph.split())):
+                    if not sentence:
+                        continue
+                    for piece in self._split_long(sentence):
+                        sentences.append((piece, page_number, self.count_tokens(piece), new_paragraph))
+                        new_paragraph = False
+        return sentences
+
+    def _split_long(self, sentence: str) -> list[str]:
+        # Sentences longer than a chunk (tables, lists without punctuation) are cut between words
+        if self.count_tokens(sentence) <= self.max_tokens:
+            return [sentence]
+        pieces, words = [], []
+        for word in sentence.split(" "):
+            if words and self.count_tokens(" ".join(words + [word])) > self.max_tokens:
+                pieces.append(" ".join(words))
+                words = []
+            words.append(word)
+        if words:
+            pieces.append(" ".join(words))
+        return pieces
+
+    def _pack(self, sentences: list[tuple[str, int, int, bool]]) -> list[Chunk]:
+        chunks: list[Chunk] = []
+        current: list[tuple[str, int, int, bool]] = []
+        current_tokens = 0
+
+        def emit():
+            chunks.append(Chunk(" ".join(s[0] for s in current), current[0][1], current[-1][1]))
+
+        for sentence in sentences:
+            _, _, tokens, new_paragraph = sentence
+            boundary = new_paragraph and current_tokens >= self.max_tokens // 2
+            if current and (boundary or current_tokens + tokens > self.max_tokens):
+                emit()
+                overlap = []
+                if not new_paragraph:
+                    # Carry trailing sentences over so a thought cut mid-paragraph survives in one of the chunks
+                    overlap_tokens = 0
+                    for previous in reversed(current):
+                        overlap_tokens += previous[2]
+                        if overlap_tokens > self.overlap_tokens or overlap_tokens + tokens > self.max_tokens:
+                            break
+                        overlap.insert(0, previous)
+                current = overlap
+                current_tokens = sum(s[2] for s in current)
+            current.append(sentence)
+            current_tokens += tokens
+        if current:
+            emit()
+        return chunks
+
+def chunker_from_env() -> Chunker:
+    return Chunker(
+        strategy=os.getenv("CHUNK_STRATEGY", "tokens"),
+        max_tokens=int(os.getenv("CHUNK_MAX_TOKENS", 200)),
+        overlap_tokens=int(os.getenv("CHUNK_OVERLAP_TOKENS", 0)),
+        chunk_size=int(os.getenv("CHUNK_SIZE_CHARS", 1000)),
+        dedupe=os.getenv("CHUNK_DEDUPE", "true").lower() in ("1", "true", "yes")
+    )
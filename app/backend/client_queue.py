@@ -0,0 +1,158 @@
+import aiohttp
+import asyncio
+import base64
+import json
+import re
+from collections import deque
+from typing import Optional
+from aiohttp import web
+from metrics import registry
+
+_client_frames_coalesced = registry.counter("rtmt_client_frames_coalesced_total",
+                                            "Delta frames merged into others for clients that fell behind")
+_client_overflows = registry.counter("rtmt_client_queue_overflows_total",
+                                     "Times a client fell past the outbound queue limit, by overflow policy")
+
+# Realtime events are serialized with "type" as their first key, so the type of the large, frequent audio frames 
+# can be read off the start of the frame without decoding the base64 payload behind it
+_EVENT_TYPE_PREFIX = re.compile(r'\s*\{\s*"type"\s*:\s*"([^"\\]*)"')
+
+def peek_event_type(data: str) -> Optional[str]:
+    # JSON parsers keep the last of duplicate keys, so the first "type" is only the event's type when no other key
+    # can decode to "type": neither a second literal one nor one spelled with escapes. Base64 audio has neither.
+    if "\\" in data or data.count('"type"') != 1:
+        return None
+    match = _EVENT_TYPE_PREFIX.match(data)
+    return match.group(1) if match else None
+
+# Deltas a slow client can take merged: audio is one continuous stream and transcripts are plain text
+_COALESCED_EVENTS = frozenset({"response.audio.delta", "response.audio_transcript.delta"})
+
+def _concat_base64(chunks: list[str]) -> str:
+    # Unpadded base64 chunks concatenate as they are, only padded ones need a decode and re-encode
+    if all(len(chunk) % 4 == 0 and not chunk.endswith("=") for chunk in chunks[:-1]):
+        return "".join(chunks)
+    return base64.b64encode(b"".join(base64.b64decode(chunk) for chunk in chunks)).decode("ascii")
+
+# Frames on their way to one client, written straight through while it keeps up and queued for a writer task once
+# it falls behind, where deltas get merged; past `high_water` bytes `policy` closes the session or drops audio
+class ClientSendQueue:
+    def __init__(self, ws: web.WebSocketResponse, transport: Optional[asyncio.Transport] = None,
+                 high_water: int = 1 << 20, coalesce_max_bytes: int = 1 << 18, policy: str = "close"):
+        self.ws = ws
+        self.transport = transport
+        self.high_water = high_water
+        self.coalesce_max_bytes = coalesce_max_bytes
+        self.policy = policy
+        self.queued_bytes = 0
+        self.frames_sent = 0
+        self.frames_coalesced = 0
+        self.audio_bytes_dropped = 0
+        self.overflowed = False
+        self._frames: deque[tuple[Optional[str], str]] = deque()  # (event type, frame)
+        self._ready = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._writer: Optional[asyncio.Task] = None
+        self._closer: Optional[asyncio.Task] = None
+
+    def _fits(self, frame: str) -> bool:
+        # Whether writing the frame now keeps the transport under its high-water mark, so sending won't block
+        if self.transport is None or self.transport.is_closing():
+            return False
+        return self.transport.get_write_buffer_size() + len(frame) < self.transport.get_write_buffer_limits()[1]
+
+    async def send(self, frame: str, event_type: Optional[str] = None):
+        if self.overflowed:
+            return
+        if not self._frames and self._idle.is_set() and self._fits(frame):
+            await self.ws.send_str(frame)
+            self.frames_sent += 1
+            return
+        self._frames.append((event_type or peek_event_type(frame), frame))
+        self.queued_bytes += len(frame)
+        if self.queued_bytes > self.high_water:
+            self._overflow()
+            if self.overflowed:
+                return
+        self._idle.clear()
+        self._ready.set()
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write())
+
+    def _overflow(self):
+        _client_overflows.inc(policy=self.policy)
+        if self.policy == "drop_audio":
+            kept = deque(entry for entry in self._frames if entry[0] != "response.audio.delta")
+            dropped = self.queued_bytes - sum(len(frame) for _, frame in kept)
+            self._frames, self.queued_bytes = kept, self.queued_bytes - dropped
+            self.audio_bytes_dropped += dropped
+            notice = json.dumps({"type": "extension.middle_tier_status", "status": "audio_dropped", "bytes": dropped})
+            self._frames.append(("extension.middle_tier_status", notice))
+            self.queued_bytes += len(notice)
+            if self.queued_bytes <= self.high_water:
+                return
+        # Too far behind to catch up, let the client reconnect rather than hold ever more memory for it
+        print(f"Client fell {self.queued_bytes} bytes behind, closing the session")
+        self.overflowed = True
+        self._frames.clear()
+        self.queued_bytes = 0
+        if self._writer is not None:
+            self._writer.cancel()
+        self._idle.set()
+        self._closer = asyncio.create_task(
+            self.ws.close(code=aiohttp.WSCloseCode.TRY_AGAIN_LATER, message=b"Client too slow, try again"))
+
+    def _take(self) -> list[str]:
+        event_type, frame = self._frames.popleft()
+        self.queued_bytes -= len(frame)
+        if event_type not in _COALESCED_EVENTS or not self._frames or self._frames[0][0] not in _COALESCED_EVENTS \
+                or not self.coalesce_max_bytes:
+            return [frame]
+
+        # Merge the run of deltas of the same item at the head of the queue, keeping each type's order
+        first = json.loads(frame)
+        item = (first.get("item_id"), first.get("content_index"))
+        runs: dict[str, list[dict]] = {event_type: [first]}
+        size = len(frame)
+        while self._frames and self._frames[0][0] in _COALESCED_EVENTS and size < self.coalesce_max_bytes:
+            message = json.loads(self._frames[0][1])
+            if (message.get("item_id"), message.get("content_index")) != item:
+                break
+            next_type, next_frame = self._frames.popleft()
+            self.queued_bytes -= len(next_frame)
+            size += len(next_frame)
+            runs.setdefault(next_type, []).append(message)
+        merged = []
+        for run_type, messages in runs.items():
+            deltas = [message["delta"] for message in messages]
+            delta = _concat_base64(deltas) if run_type == "response.audio.delta" else "".join(deltas)
+            merged.append(json.dumps({**messages[0], "delta": delta}))
+            self.frames_coalesced += len(messages) - 1
+            _client_frames_coalesced.inc(len(messages) - 1)
+        return merged
+
+    async def _write(self):
+        while True:
+            if not self._frames:
+                self._idle.set()
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            for frame in self._take():
+                await self.ws.send_str(frame)
+                self.frames_sent += 1
+
+    async def flush(self, timeout: float = 5):
+        # Lets the last frames of a session out before the socket is closed
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def close(self):
+        for task in (self._writer, self._closer):
+            if task is not None and not task.done():
+                task.cancel()
+        await asyncio.gather(*[task for task in (self._writer, self._closer) if task is not None],
+                             return_exceptions=True)
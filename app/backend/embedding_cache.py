@@ -0,0 +1,140 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Optional
+from langchain_core.embeddings import Embeddings
+from metrics import registry
+
+_lookups = registry.counter("rag_embedding_cache_lookups_total",
+                            "Query embedding cache lookups by result: hit, disk_hit or miss")
+
+def normalize_query(text: str) -> str:
+    # Spoken queries differ mostly in case, spacing and trailing punctuation, none of which changes the answer
+    return re.sub(r"[\s.?!]+$", "", " ".join(text.lower().split()))
+
+# Query embeddings keyed on normalized query text and namespaced by model, in an LRU and optionally a SQLite file
+# at `path` that survives restarts, entries found there are promoted to memory
+class QueryEmbeddingCache:
+    _TRIM_EVERY = 64  # Puts between trims of the SQLite table, expired rows and those past max_entries are deleted
+
+    def __init__(self, namespace: str, max_entries: int = 1024, ttl: Optional[float] = 86400, path: Optional[str] = None):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, list[float]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS query_embeddings (key TEXT PRIMARY KEY, vector BLOB, created REAL)")
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\0{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, text: str) -> Optional[list[float]]:
+        key = self._key(text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry[0], now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                _lookups.inc(result="hit")
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT vector, created FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None and not self._expired(row[1], now):
+                    vector = array("f", row[0]).tolist()
+                    self._put_memory(key, row[1], vector)
+                    self.disk_hits += 1
+                    _lookups.inc(result="disk_hit")
+                    return vector
+
+            self.misses += 1
+            _lookups.inc(result="miss")
+            return None
+
+    def put(self, text: str, vector: list[float]):
+        key = self._key(text)
+        now = time.time()
+        with self._lock:
+            self._put_memory(key, now, vector)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO query_embeddings (key, vector, created) VALUES (?, ?, ?)",
+                                 (key, array("f", vector).tobytes(), now))
+                self._puts += 1
+                if self._puts % self._TRIM_EVERY == 0:
+                    self._trim_disk(now)
+
+    def _trim_disk(self, now: float):
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM query_embeddings WHERE created < ?", (now - self.ttl,))
+        self._db.execute("DELETE FROM query_embeddings WHERE key NOT IN "
+                         "(SELECT key FROM query_embeddings ORDER BY created DESC LIMIT ?)", (self.max_entries,))
+
+    def _put_memory(self, key: str, created: float, vector: list[float]):
+        self._entries[key] = (created, vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else 0.0
+        }
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that serves repeated queries from a QueryEmbeddingCache.
+
+    Only `embed_query` is cached, document embeddings at ingestion time go straight to the wrapped model.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: QueryEmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        vector = self.cache.get(text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put(text, vector)
+        return vector
+
+def cached_embeddings_from_env(embeddings: Embeddings, model: Optional[str], deployment: Optional[str],
+                               dimensions: Optional[int] = None) -> Embeddings:
+    max_entries = int(os.getenv("EMBEDDING_CACHE_SIZE", 1024))
+    if max_entries <= 0:
+        return embeddings
+    ttl = os.getenv("EMBEDDING_CACHE_TTL_SECONDS", "86400")
+    cache = QueryEmbeddingCache(
+        namespace=f"{model}:{deployment}" + (f":{dimensions}" if dimensions else ""),
+        max_entries=max_entries,
+        ttl=float(ttl) if ttl else None,
+        path=os.getenv("EMBEDDING_CACHE_PATH") or None
+    )
+    return CachedEmbeddings(embeddings, cache)
@@ -0,0 +1,39 @@
+"""Builds or syncs the knowledge base index outside the server.
+
+    python indexer.py --pdf-dir ../../data
+    python indexer.py --full   # re-embed every file, e.g. after switching embedding models
+"""
+import argparse
+import os
+import time
+from dotenv import load_dotenv
+from ingestion import ingest_options_from_env
+from ragtools import (build_index, create_embeddings, init_mongo_client, lexical_index_from_env,
+                      local_index_from_env, open_vector_store)
+
+if __name__ == "__main__":
+    load_dotenv()
+    defaults = ingest_options_from_env()
+    parser = argparse.ArgumentParser(description="Extract, embed and index the PDFs for the RAG tools")
+    parser.add_argument("--pdf-dir", default="../../data")
+    parser.add_argument("--full", action="store_true", help="re-index every file instead of only changed ones")
+    parser.add_argument("--workers", type=int, default=defaults["workers"], help="PDF parsing processes")
+    parser.add_argument("--pages-per-task", type=int, default=defaults["pages_per_task"])
+    parser.add_argument("--batch-size", type=int, default=defaults["batch_size"])
+    parser.add_argument("--embedding-concurrency", type=int, default=defaults["embedding_concurrency"])
+    args = parser.parse_args()
+
+    mongo_client = init_mongo_client(os.environ.get("MONGO_CONNECTION_STRING"))
+    collection = mongo_client[os.environ.get("MONGO_DB_NAME")][os.environ.get("MONGO_COLLECTION_NAME")]
+    embeddings = create_embeddings()
+    vector_store = open_vector_store(collection, embeddings)
+
+    started = time.perf_counter()
+    result = build_index(collection, vector_store, embeddings, args.pdf_dir, full=args.full,
+                         workers=args.workers, pages_per_task=args.pages_per_task, batch_size=args.batch_size,
+                         embedding_concurrency=args.embedding_concurrency)
+    # Also write the on-disk indexes the server would otherwise build on startup
+    for mirror in (local_index_from_env(embeddings), lexical_index_from_env()):
+        if mirror is not None and mirror.path:
+            mirror.sync(collection)
+    print(f"Done in {time.perf_counter() - started:.1f}s: {result}")
@@ -0,0 +1,252 @@
+import hashlib
+import multiprocessing
+import os
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Optional
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from pymongo import DeleteMany, ReplaceOne
+from chunking import Chunker, chunker_from_env
+
+# Every source file gets a manifest document in the collection next to its chunks, recording what was indexed so a
+# re-sync only touches files that were added, changed or removed
+MANIFEST_ID_PREFIX = "manifest:"
+
+def list_pdfs(pdf_dir: str) -> list[str]:
+    return sorted(filename for filename in os.listdir(pdf_dir) if filename.endswith(".pdf"))
+
+def _extract_pages(filepath: str, start: int, count: int) -> tuple[list[str], int]:
+    # Runs in a worker process, returns the text of pages [start, start + count) and the document's page count.
+    # pdfplumber is imported here, only ingestion needs it and serving shouldn't pay for loading it.
+    import pdfplumber  # Library to extract text from PDF
+    with pdfplumber.open(filepath) as pdf:
+        pages = pdf.pages[start:start + count]
+        return [page.extract_text() or "" for page in pages], len(pdf.pages)
+
+def iter_pdf_pages(pdf_dir: str, filenames: Optional[Iterable[str]] = None, workers: Optional[int] = None,
+                   pages_per_task: int = 16) -> Iterator[tuple[str, list[str]]]:
+    """Yields (filename, page texts) for every PDF, parsed in page ranges across a process pool.
+
+    The first range of each file also reports its page count, the remaining ranges are scheduled once it's known.
+    At most a couple of tasks per worker are in flight, so memory is bounded by the files currently being parsed
+    rather than by the size of the corpus. Files are yielded as they complete, not in directory order.
+    """
+    pending_files = deque(filenames if filenames is not None else list_pdfs(pdf_dir))
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * 2
+    in_flight: dict[Future, tuple[str, int]] = {}
+    parts: dict[str, dict[int, list[str]]] = {}
+    remaining: dict[str, int] = {}
+
+    # Spawned rather than forked workers, ingestion may run on a background thread of the server
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        def submit(filename: str, start: int):
+            future = pool.submit(_extract_pages, os.path.join(pdf_dir, filename), start, pages_per_task)
+            in_flight[future] = (filename, start)
+
+        while pending_files or in_flight:
+            while pending_files and len(in_flight) < max_in_flight:
+                filename = pending_files.popleft()
+                print("Processing File:", filename)
+                parts[filename] = {}
+                remaining[filename] = 1
+                submit(filename, 0)
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                filename, start = in_flight.pop(future)
+                texts, page_count = future.result()
+                parts[filename][start] = texts
+                remaining[filename] -= 1
+                if start == 0:
+                    for next_start in range(pages_per_task, page_count, pages_per_task):
+                        remaining[filename] += 1
+                        submit(filename, next_start)
+                if remaining[filename] == 0:
+                    ranges = parts.pop(filename)
+                    del remaining[filename]
+                    yield filename, [text for range_start in sorted(ranges) for text in ranges[range_start]]
+
+def chunk_id(filename: str, index: int) -> str:
+    # Chunk ids are stable per file and position, so re-indexing a file overwrites its chunks in place
+    return f"{filename}_chunk_{index}"
+
+def iter_documents(pdf_dir: str, chunker: Optional[Chunker] = None, filenames: Optional[Iterable[str]] = None,
+                   workers: Optional[int] = None, pages_per_task: int = 16) -> Iterator[Document]:
+    chunker = chunker or chunker_from_env()
+    for filename, pages in iter_pdf_pages(pdf_dir, filenames, workers, pages_per_task):
+        # Chunk the pages into smaller parts, creating a Document object for each chunk
+        for i, chunk in enumerate(chunker.split(pages)):
+            yield Document(id=chunk_id(filename, i), page_content=chunk.text,
+                           metadata={"title": chunk_id(filename, i), "source": filename,
+                                     "page": chunk.page, "page_end": chunk.page_end})
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+def _embed_and_insert(batch: list[Document], collection, embeddings: Embeddings) -> int:
+    # Same document shape AzureCosmosDBVectorSearch writes, so the vector store can query these directly
+    vectors = embeddings.embed_documents([doc.page_content for doc in batch])
+    records = [
+        {"textContent": doc.page_content, "vectorContent": vector, "metadata": doc.metadata}
+        for doc, vector in zip(batch, vectors)
+    ]
+    if all(doc.id for doc in batch):
+        # Upsert by id so re-indexing, or resuming an interrupted run, never duplicates chunks
+        collection.bulk_write([ReplaceOne({"_id": doc.id}, record, upsert=True) for doc, record in zip(batch, records)],
+                              ordered=False)
+    else:
+        collection.insert_many(records, ordered=False)
+    return len(batch)
+
+def ingest_documents(documents: Iterable[Document], collection, embeddings: Embeddings, batch_size: int = 64,
+                     embedding_concurrency: int = 4, progress: Optional[Callable[[int], None]] = None) -> int:
+    """Embeds documents in batches and inserts each batch as soon as it's ready.
+
+    Up to `embedding_concurrency` batches are embedded and written at once, pulling more documents from the
+    iterator only as batches complete, so a streaming source is never materialized in memory.
+    """
+    count = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=embedding_concurrency, thread_name_prefix="ingest") as pool:
+        in_flight: set[Future] = set()
+        for batch in batched(documents, batch_size):
+            if len(in_flight) >= embedding_concurrency:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                count += sum(future.result() for future in done)
+                print(f"Indexed {count} chunks ({count / (time.perf_counter() - started):.1f}/s)")
+                if progress is not None:
+                    progress(count)
+            in_flight.add(pool.submit(_embed_and_insert, batch, collection, embeddings))
+        count += sum(future.result() for future in in_flight)
+    if progress is not None:
+        progress(count)
+    return count
+
+def ingest_pdfs(pdf_dir: str, collection, embeddings: Embeddings, workers: Optional[int] = None,
+                pages_per_task: int = 16, batch_size: int = 64, embedding_concurrency: int = 4,
+                chunker: Optional[Chunker] = None) -> int:
+    documents = iter_documents(pdf_dir, chunker, workers=workers, pages_per_task=pages_per_task)
+    return ingest_documents(documents, collection, embeddings, batch_size, embedding_concurrency)
+
+def ingest_options_from_env() -> dict:
+    workers = os.getenv("INGEST_WORKERS")
+    return {
+        "workers": int(workers) if workers else None,
+        "pages_per_task": int(os.getenv("INGEST_PAGES_PER_TASK", 16)),
+        "batch_size": int(os.getenv("INGEST_BATCH_SIZE", 64)),
+        "embedding_concurrency": int(os.getenv("INGEST_EMBEDDING_CONCURRENCY", 4))
+    }
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifests(collection) -> dict[str, dict]:
+    return {manifest["source"]: manifest for manifest in collection.find({"manifest": True})}
+
+class SyncProgress:
+    files_total: int = 0
+    files_parsed: int = 0
+    chunks_indexed: int = 0
+
+class SyncResult:
+    added: list[str]
+    updated: list[str]
+    removed: list[str]
+    unchanged: int = 0
+    chunks: int = 0
+
+    def __init__(self):
+        self.added = []
+        self.updated = []
+        self.removed = []
+
+    def __str__(self) -> str:
+        return (f"{len(self.added)} added, {len(self.updated)} updated, {len(self.removed)} removed, "
+                f"{self.unchanged} unchanged, {self.chunks} chunks embedded")
+
+def sync_pdf_dir(pdf_dir: str, collection, embeddings: Embeddings, workers: Optional[int] = None,
+                 pages_per_task: int = 16, batch_size: int = 64, embedding_concurrency: int = 4,
+                 chunker: Optional[Chunker] = None, full: bool = False, progress: Optional[SyncProgress] = None) -> SyncResult:
+    """Brings the collection in line with the PDFs in `pdf_dir`, embedding only what changed.
+
+    Files whose size and mtime match their manifest are skipped without being read, files that were touched but
+    hash the same only get their manifest refreshed. New and changed files are re-chunked and upserted, chunks a
+    changed file no longer produces are deleted, and removed files lose their chunks and manifest. A different
+    chunking configuration counts as a change. `full` re-indexes every file regardless. `progress` is kept up to
+    date as files are parsed and chunks are indexed.
+    """
+    result = SyncResult()
+    chunker = chunker or chunker_from_env()
+    manifests = load_manifests(collection)
+    on_disk = list_pdfs(pdf_dir)
+
+    changed: dict[str, dict] = {}
+    for filename in on_disk:
+        path = os.path.join(pdf_dir, filename)
+        stat = os.stat(path)
+        manifest = manifests.get(filename)
+        if not full and manifest is not None and manifest.get("chunker") == chunker.signature \
+                and manifest["size"] == stat.st_size and manifest["mtime"] == stat.st_mtime:
+            result.unchanged += 1
+            continue
+        sha256 = file_sha256(path)
+        if not full and manifest is not None and manifest.get("chunker") == chunker.signature and manifest["sha256"] == sha256:
+            collection.update_one({"_id": manifest["_id"]}, {"$set": {"mtime": stat.st_mtime, "size": stat.st_size}})
+            result.unchanged += 1
+            continue
+        changed[filename] = {"sha256": sha256, "mtime": stat.st_mtime, "size": stat.st_size}
+        (result.updated if manifest is not None else result.added).append(filename)
+
+    if progress is not None:
+        progress.files_total = len(changed)
+    if changed:
+        chunk_counts: dict[str, int] = defaultdict(int)
+
+        def tracked_documents() -> Iterator[Document]:
+            for doc in iter_documents(pdf_dir, chunker, changed, workers, pages_per_task):
+                if progress is not None and doc.metadata["source"] not in chunk_counts:
+                    progress.files_parsed += 1
+                chunk_counts[doc.metadata["source"]] += 1
+                yield doc
+
+        def on_chunks(count: int):
+            if progress is not None:
+                progress.chunks_indexed = count
+
+        result.chunks = ingest_documents(tracked_documents(), collection, embeddings, batch_size,
+                                         embedding_concurrency, on_chunks)
+
+        # Manifests are only written once a file's chunks are all in, an interrupted sync simply redoes the file
+        for filename, file_info in changed.items():
+            chunk_ids = [chunk_id(filename, i) for i in range(chunk_counts[filename])]
+            # Also catches chunks with the same titles written before manifests existed
+            collection.delete_many({"metadata.title": {"$in": _stale_titles(manifests.get(filename), chunk_ids)},
+                                    "_id": {"$nin": chunk_ids}})
+            collection.replace_one({"_id": MANIFEST_ID_PREFIX + filename}, {
+                "manifest": True, "source": filename, "chunker": chunker.signature, "chunk_ids": chunk_ids, **file_info
+            }, upsert=True)
+
+    for filename in sorted(set(manifests) - set(on_disk)):
+        manifest = manifests[filename]
+        collection.bulk_write([
+            DeleteMany({"_id": {"$in": manifest["chunk_ids"]}}),
+            DeleteMany({"_id": manifest["_id"]})
+        ], ordered=True)
+        result.removed.append(filename)
+
+    print(f"Index sync: {result}")
+    return result
+
+def _stale_titles(manifest: Optional[dict], chunk_ids: list[str]) -> list[str]:
+    previous = manifest["chunk_ids"] if manifest is not None else []
+    return list(dict.fromkeys(previous + chunk_ids))
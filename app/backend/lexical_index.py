@@ -0,0 +1,150 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Optional
+import numpy as np
+from langchain_core.documents import Document
+from vector_index import collection_fingerprint
+
+_POSTINGS_FILE = "postings.npz"
+_DOCUMENTS_FILE = "documents.json"
+
+_TOKEN = re.compile(r"\w+(?:[-./]\w+)*")
+
+def tokenize(text: str) -> list[str]:
+    # Product codes and numbers ("XR-200", "4.5") are kept whole and also split, so "xr-200", "xr 200" and "200"
+    # all match them
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[-./]", token) if part)
+    return tokens
+
+def identifier_terms(query: str) -> list[str]:
+    # Terms a vector search tends to miss: anything with a digit in it, like model numbers, SKUs and prices
+    return [token for token in _TOKEN.findall(query.lower()) if any(c.isdigit() for c in token) and len(token) >= 3]
+
+# BM25 inverted index over the chunks for exact terms embeddings handle badly, postings are flat NumPy arrays saved
+# to `path` with the same `sync` and `save` contract as LocalVectorIndex
+class BM25Index:
+    def __init__(self, path: Optional[str] = None, k1: float = 1.2, b: float = 0.75, save: bool = True):
+        self.path = path
+        self.save = save
+        self.k1 = k1
+        self.b = b
+        self.fingerprint: Optional[str] = None
+        self._state: Optional[tuple] = None  # (vocabulary, offsets, doc_numbers, term_frequencies, doc_lengths, documents)
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._state is not None
+
+    def __len__(self) -> int:
+        return len(self._state[5]) if self._state is not None else 0
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def sync(self, collection) -> bool:
+        fingerprint = collection_fingerprint(collection)
+        if fingerprint == self.fingerprint:
+            return False
+        if self.path and self._open(fingerprint):
+            return True
+        started = time.perf_counter()
+        documents = [
+            {"_id": str(doc["_id"]), "text": doc["textContent"], "metadata": doc.get("metadata", {})}
+            for doc in collection.find({"manifest": {"$exists": False}}, {"textContent": 1, "metadata": 1})
+        ]
+        state = self._build(documents)
+        if self.path and self.save:
+            self._save(state, fingerprint)
+        with self._lock:
+            self._state, self.fingerprint = state, fingerprint
+        print(f"Lexical index: indexed {len(documents)} chunks, {len(state[0])} terms "
+              f"in {time.perf_counter() - started:.1f}s")
+        return True
+
+    def _build(self, documents: list[dict]) -> tuple:
+        postings: dict[str, list[tuple[int, int]]] = {}
+        doc_lengths = np.zeros(len(documents), dtype=np.int32)
+        for number, doc in enumerate(documents):
+            tokens = tokenize(doc["text"])
+            doc_lengths[number] = len(tokens)
+            for term, frequency in Counter(tokens).items():
+                postings.setdefault(term, []).append((number, frequency))
+
+        vocabulary = {term: i for i, term in enumerate(sorted(postings))}
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        for term, i in vocabulary.items():
+            offsets[i + 1] = len(postings[term])
+        offsets = np.cumsum(offsets)
+        doc_numbers = np.empty(offsets[-1], dtype=np.int32)
+        term_frequencies = np.empty(offsets[-1], dtype=np.uint16)
+        for term, i in vocabulary.items():
+            entries = np.array(postings[term], dtype=np.int64)
+            doc_numbers[offsets[i]:offsets[i + 1]] = entries[:, 0]
+            term_frequencies[offsets[i]:offsets[i + 1]] = np.minimum(entries[:, 1], np.iinfo(np.uint16).max)
+        return vocabulary, offsets, doc_numbers, term_frequencies, doc_lengths, documents
+
+    def _save(self, state: tuple, fingerprint: str):
+        vocabulary, offsets, doc_numbers, term_frequencies, doc_lengths, documents = state
+        os.makedirs(self.path, exist_ok=True)
+        # Postings first, then the documents file that names the fingerprint, same as the vector mirror
+        with open(self._file(_POSTINGS_FILE + ".tmp"), "wb") as f:
+            np.savez_compressed(f, offsets=offsets, doc_numbers=doc_numbers, term_frequencies=term_frequencies,
+                                doc_lengths=doc_lengths)
+        os.replace(self._file(_POSTINGS_FILE + ".tmp"), self._file(_POSTINGS_FILE))
+        with open(self._file(_DOCUMENTS_FILE + ".tmp"), "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": fingerprint, "terms": list(vocabulary), "documents": documents}, f)
+        os.replace(self._file(_DOCUMENTS_FILE + ".tmp"), self._file(_DOCUMENTS_FILE))
+
+    def _open(self, fingerprint: str) -> bool:
+        try:
+            with open(self._file(_DOCUMENTS_FILE), encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved["fingerprint"] != fingerprint:
+                return False
+            with np.load(self._file(_POSTINGS_FILE)) as arrays:
+                offsets, doc_numbers = arrays["offsets"], arrays["doc_numbers"]
+                term_frequencies, doc_lengths = arrays["term_frequencies"], arrays["doc_lengths"]
+        except (OSError, ValueError, KeyError):
+            return False
+        if len(doc_lengths) != len(saved["documents"]) or len(offsets) != len(saved["terms"]) + 1:
+            return False
+        vocabulary = {term: i for i, term in enumerate(saved["terms"])}
+        with self._lock:
+            self._state = (vocabulary, offsets, doc_numbers, term_frequencies, doc_lengths, saved["documents"])
+            self.fingerprint = fingerprint
+        print(f"Lexical index: opened {len(doc_lengths)} chunks from {self.path}")
+        return True
+
+    def search(self, query: str, k: int = 4) -> list[tuple[Document, float]]:
+        with self._lock:
+            state = self._state
+        if state is None or not state[5]:
+            return []
+        vocabulary, offsets, doc_numbers, term_frequencies, doc_lengths, documents = state
+        scores = np.zeros(len(documents), dtype=np.float32)
+        length_norm = self.k1 * (1 - self.b + self.b * doc_lengths / max(doc_lengths.mean(), 1))
+        for term in set(tokenize(query)):
+            i = vocabulary.get(term)
+            if i is None:
+                continue
+            docs = doc_numbers[offsets[i]:offsets[i + 1]]
+            tf = term_frequencies[offsets[i]:offsets[i + 1]].astype(np.float32)
+            idf = math.log(1 + (len(documents) - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + length_norm[docs])
+
+        matched = np.flatnonzero(scores)
+        if len(matched) == 0:
+            return []
+        top = matched[np.argsort(-scores[matched])[:k]]
+        return [(Document(page_content=documents[n]["text"], metadata={**documents[n]["metadata"], "_id": documents[n]["_id"]}),
+                 float(scores[n])) for n in top]
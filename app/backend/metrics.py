@@ -0,0 +1,180 @@
+import contextvars
+import json
+import math
+import threading
+import time
+from typing import Callable, Optional
+from aiohttp import web
+
+# Seconds, from a fast local tool call to a slow end-to-end voice turn
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(labels: tuple[tuple[str, str], ...], extra: Optional[tuple[str, str]] = None) -> str:
+    pairs = labels + ((extra,) if extra else ())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+def _format_value(value: float) -> str:
+    return "+Inf" if value == math.inf else repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Histogram:
+    """Cumulative bucket histogram in the Prometheus text format, one series per set of label values.
+
+    Observed from the event loop and from tool executor threads alike, so updates take a lock.
+    """
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._series: dict[tuple[tuple[str, str], ...], list] = {}  # labels -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for key, (counts, total, count) in series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: dict[tuple[tuple[str, str], ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        lines.extend(f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in values.items())
+        return lines
+
+class Gauge:
+    # Read when scraped, so queue depths and session counts are never stale
+    def __init__(self, name: str, help: str, read: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {_format_value(self.read())}"]
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, Histogram | Counter | Gauge] = {}
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None and type(existing) is type(metric) and not isinstance(metric, Gauge):
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, buckets))
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._register(Counter(name, help))
+
+    def gauge(self, name: str, help: str, read: Callable[[], float]) -> Gauge:
+        return self._register(Gauge(name, help, read))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            try:
+                lines.extend(metric.render())
+            except Exception as e:  # A broken gauge shouldn't take the whole endpoint down
+                print(f"Error rendering metric '{metric.name}': {e}")
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+# Phases of a voice turn, each the time between two marks of its TurnTrace
+TURN_PHASES = (
+    ("model_to_tool_call", "speech_stopped", "function_call_args_done"),
+    ("embedding", "function_call_args_done", "embedding_done"),
+    ("vector_query", "embedding_done", "vector_query_done"),
+    ("tool", "function_call_args_done", "tool_output_sent"),
+    ("model_after_tool", "tool_output_sent", "first_audio_delta"),
+    ("time_to_first_audio", "speech_stopped", "first_audio_delta"),
+    ("turn", "speech_stopped", "response_done")
+)
+
+turn_phase_seconds = registry.histogram("rtmt_turn_phase_seconds", "Duration of each phase of a voice turn")
+
+class TurnTrace:
+    """Timestamps of one voice turn, from the user going quiet to the end of the answer.
+
+    Marks are set from the relay loop and, through `mark`, from tool code running on executor threads. Only the
+    first occurrence of each mark counts, a turn with several tool calls is timed to its first one.
+    """
+
+    def __init__(self, session_id: str, turn: int):
+        self.session_id = session_id
+        self.turn = turn
+        self.started = time.perf_counter()
+        self.marks: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def mark(self, name: str, at: Optional[float] = None):
+        with self._lock:
+            self.marks.setdefault(name, at if at is not None else time.perf_counter())
+
+    def has(self, name: str) -> bool:
+        return name in self.marks
+
+    def phases(self) -> dict[str, float]:
+        # A phase that finished before it started (retrieval done speculatively before the model asked for it)
+        # cost the turn nothing
+        return {phase: max(0.0, self.marks[end] - self.marks[start]) for phase, start, end in TURN_PHASES
+                if start in self.marks and end in self.marks}
+
+    def finish(self, log: bool = False):
+        for phase, seconds in self.phases().items():
+            turn_phase_seconds.observe(seconds, phase=phase)
+        if log:
+            print(json.dumps({
+                "event": "turn_trace",
+                "session": self.session_id,
+                "turn": self.turn,
+                "marks_ms": {name: round((at - self.started) * 1000, 1) for name, at in self.marks.items()}
+            }))
+
+# The turn a tool call belongs to, carried into executor threads so retrieval code can mark its own phases
+current_trace: contextvars.ContextVar[Optional[TurnTrace]] = contextvars.ContextVar("current_trace", default=None)
+
+def mark(name: str):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.mark(name)
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
@@ -0,0 +1,114 @@
+import os
+from typing import Optional
+import numpy as np
+
+QUANTIZATIONS = ("none", "int8", "binary")
+
+_BLOCK_ROWS = 8192  # Rows encoded at a time, so a memory-mapped matrix is never read into memory whole
+_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+def truncate(vectors: np.ndarray, dimensions: Optional[int]) -> np.ndarray:
+    # Matryoshka embeddings (e.g. text-embedding-3) front-load their information, a prefix renormalized is a smaller
+    # embedding of the same text; other models lose more recall this way
+    if not dimensions or dimensions >= vectors.shape[-1]:
+        return vectors
+    prefix = np.asarray(vectors[..., :dimensions], dtype=np.float32)
+    norms = np.linalg.norm(prefix, axis=-1, keepdims=True)
+    return prefix / np.where(norms == 0, 1, norms)
+
+def _popcount_rows(bits: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):  # numpy 2
+        return np.bitwise_count(bits).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT[bits.view(np.uint8)].sum(axis=1, dtype=np.int32)
+
+# A small copy of normalized embeddings for a first-stage search whose scores only rank candidates for re-ranking:
+# int8 (4x smaller than float32), binary signs compared by Hamming distance (32x), or float32 truncated to `dimensions`
+class CompactVectors:
+    method: str
+    dimensions: int
+    codes: np.ndarray
+    scales: Optional[np.ndarray]
+
+    def __init__(self, method: str, dimensions: int, codes: np.ndarray, scales: Optional[np.ndarray] = None):
+        self.method = method
+        self.dimensions = dimensions
+        self.codes = codes
+        self.scales = scales
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    @classmethod
+    def encode(cls, vectors: np.ndarray, method: str, dimensions: Optional[int] = None) -> "CompactVectors":
+        if method not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {method!r}, expected one of {', '.join(QUANTIZATIONS)}")
+        dimensions = min(dimensions or vectors.shape[1], vectors.shape[1])
+        blocks, scales = [], []
+        for start in range(0, len(vectors), _BLOCK_ROWS):
+            block = truncate(np.asarray(vectors[start:start + _BLOCK_ROWS], dtype=np.float32), dimensions)
+            codes, block_scales = cls._encode_block(block, method)
+            blocks.append(codes)
+            scales.append(block_scales)
+        if not blocks:
+            empty = cls._encode_block(np.zeros((0, dimensions), dtype=np.float32), method)
+            blocks, scales = [empty[0]], [empty[1]]
+        return cls(method, dimensions, np.concatenate(blocks),
+                   np.concatenate(scales) if method == "int8" else None)
+
+    @staticmethod
+    def _encode_block(block: np.ndarray, method: str) -> tuple[np.ndarray, Optional[np.ndarray]]:
+        match method:
+            case "int8":
+                # Symmetric per-vector scale, the largest component maps to 127
+                scales = np.abs(block).max(axis=1) / 127
+                scales[scales == 0] = 1
+                return np.round(block / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+            case "binary":
+                bits = np.packbits(block > 0, axis=1)
+                # Padded to whole 64-bit words, Hamming distance then runs over 8 bytes at a time
+                padding = -bits.shape[1] % 8
+                bits = np.pad(bits, ((0, 0), (0, padding)))
+                return np.ascontiguousarray(bits).view(np.uint64), None
+            case _:
+                return np.ascontiguousarray(block, dtype=np.float32), None
+
+    def score(self, query: np.ndarray) -> np.ndarray:
+        """Scores every vector against a normalized float query, higher is closer."""
+        query = truncate(query, self.dimensions)
+        match self.method:
+            case "int8":
+                scale = np.abs(query).max() / 127 or 1
+                codes = np.round(query / scale).astype(np.int8)
+                # Accumulates in int32 without an int32 copy of the matrix
+                return np.einsum("ij,j->i", self.codes, codes, dtype=np.int32, casting="unsafe") * self.scales
+            case "binary":
+                bits = self._encode_block(query[None, :], "binary")[0]
+                return -_popcount_rows(self.codes ^ bits)
+            case _:
+                return self.codes @ query
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            arrays = {"codes": self.codes}
+            if self.scales is not None:
+                arrays["scales"] = self.scales
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path: str, method: str, dimensions: int) -> "CompactVectors":
+        with np.load(path) as saved:
+            return cls(method, dimensions, saved["codes"], saved["scales"] if "scales" in saved else None)
+
+    @staticmethod
+    def filename(method: str, dimensions: int) -> str:
+        return f"compact-{method}-{dimensions}.npz"
+
+    @staticmethod
+    def remove_files(path: str):
+        for name in os.listdir(path):
+            if name.startswith("compact-") and name.endswith(".npz"):
+                os.remove(os.path.join(path, name))
@@ -1,16 +1,21 @@
-from langchain.schema import Document
 import re
 import os
+import threading
+import time
+from typing import Any, Callable, Optional
 from dotenv import load_dotenv
 from rtmt import Tool, ToolResult, ToolResultDirection
+from embedding_cache import cached_embeddings_from_env
+from ingestion import SyncProgress, ingest_options_from_env, sync_pdf_dir
+from vector_index import LocalVectorIndex
+from lexical_index import BM25Index, identifier_terms, tokenize
+from search_cache import search_cache_from_env
+from result_packing import ResultPacker, result_packer_from_env
+from metrics import mark, registry
+from chunking import count_tokens
 from pymongo import MongoClient
-from langchain_openai import AzureOpenAIEmbeddings
-from langchain_community.vectorstores.azure_cosmos_db import (
-    AzureCosmosDBVectorSearch,
-    CosmosDBSimilarityType,
-    CosmosDBVectorSearchType
-)
-import pdfplumber  # Library to extract text from PDF
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 
 # Load environment variables
 load_dotenv()
@@ -56,85 +61,204 @@ _grounding_tool_schema = {
     }
 }
 
-def chunk_text(text, chunk_size=1000):
-    # Split text into chunks of the given size
-    return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
-
-# Update function to extract text from PDF files and chunk them
-def extract_text_from_pdfs(pdf_dir, chunk_size=1000):
-    documents = []
-    for filename in os.listdir(pdf_dir):
-        if filename.endswith(".pdf"):
-            print("Processing File:", filename)
-            filepath = os.path.join(pdf_dir, filename)
-            with pdfplumber.open(filepath) as pdf:
-                full_text = ""
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        full_text += page_text
-                
-                # Chunk the full text into smaller parts
-                chunks = chunk_text(full_text, chunk_size)
-                
-                # Create a Document object for each chunk
-                for i, chunk in enumerate(chunks):
-                    documents.append(Document(
-                        page_content=chunk,
-                        metadata={"title": f"{filename}_chunk_{i}"}
-                    ))
-    return documents
+_embedding_seconds = registry.histogram("rag_query_embedding_seconds", "Query embedding time, cache hits included")
+_search_seconds = registry.histogram("rag_search_seconds", "Retrieval time of the search tool, embedding included")
+
+class TracedEmbeddings(Embeddings):
+    # Times query embeddings and marks the end of the embedding phase of the current turn
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        started = time.perf_counter()
+        vector = self.embeddings.embed_query(text)
+        _embedding_seconds.observe(time.perf_counter() - started)
+        mark("embedding_done")
+        return vector
+
+class Deferred:
+    """Builds a client on first use, for clients whose imports alone take seconds (langchain_openai,
+    langchain_community). Attributes are looked up on the built client, `load` builds it ahead of time.
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def load(self) -> Any:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.load(), name)
 
 # Initialize MongoDB client
 def init_mongo_client(mongo_connection_string):
     return MongoClient(mongo_connection_string)
 
+# Vector index and search parameters, see `vector_search_settings_from_env`; `ef_construction` and `ef_search` left as
+# None use each store's default, `num_lists` only applies to IVF indexes and `m` and the `ef` values to HNSW
+class VectorSearchSettings:
+    def __init__(self, kind: str = "vector-hnsw", similarity: str = "COS", dimensions: int = 1536,
+                 num_lists: int = 100, m: int = 16, ef_construction: Optional[int] = None, k: int = 4,
+                 ef_search: Optional[int] = None):
+        self.kind = kind
+        self.similarity = similarity
+        self.dimensions = dimensions
+        self.num_lists = num_lists
+        self.m = m
+        self.ef_construction = ef_construction
+        self.k = k
+        self.ef_search = ef_search
+
+# Checked here rather than with the LangChain enums, which would import langchain_community at startup
+_VECTOR_INDEX_KINDS = ("hnsw", "ivf", "diskann")
+_VECTOR_INDEX_SIMILARITIES = ("COS", "IP", "L2")
+
+def vector_search_settings_from_env() -> VectorSearchSettings:
+    def optional_int(name: str) -> Optional[int]:
+        value = os.getenv(name)
+        return int(value) if value else None
+
+    kind = os.getenv("VECTOR_INDEX_KIND", "hnsw").lower()
+    if kind not in _VECTOR_INDEX_KINDS:
+        raise ValueError(f"Unknown VECTOR_INDEX_KIND {kind!r}, expected one of {', '.join(_VECTOR_INDEX_KINDS)}")
+    similarity = os.getenv("VECTOR_INDEX_SIMILARITY", "COS").upper()
+    if similarity not in _VECTOR_INDEX_SIMILARITIES:
+        raise ValueError(f"Unknown VECTOR_INDEX_SIMILARITY {similarity!r}, "
+                         f"expected one of {', '.join(_VECTOR_INDEX_SIMILARITIES)}")
+    return VectorSearchSettings(
+        kind=f"vector-{kind}",
+        similarity=similarity,
+        dimensions=embedding_dimensions(),
+        num_lists=int(os.getenv("VECTOR_INDEX_NUM_LISTS", 100)),
+        m=int(os.getenv("VECTOR_INDEX_M", 16)),
+        ef_construction=optional_int("VECTOR_INDEX_EF_CONSTRUCTION"),
+        k=int(os.getenv("SEARCH_TOP_K", 4)),
+        ef_search=optional_int("SEARCH_EF_SEARCH")
+    )
+
+def _scored(results):
+    # Each result carries its score in its metadata, through the search cache to result packing
+    return [Document(page_content=doc.page_content, metadata={**doc.metadata, "score": float(score)})
+            for doc, score in results]
+
 # Vector search using CosmosDB Vector Store
-def vector_search(query, vector_store):
-    # Perform similarity search on the query
-    docs = vector_store.similarity_search(query)
-    return docs
+def vector_search(query, vector_store, settings: Optional[VectorSearchSettings] = None):
+    settings = settings or VectorSearchSettings()
+    if isinstance(vector_store, LocalVectorIndex):
+        return _scored(vector_store.similarity_search_with_score(query, k=settings.k))
+    # LangChain searches Cosmos DB as IVF unless told otherwise, whatever kind of index the collection has
+    ef_search = max(settings.ef_search or 40, settings.k)
+    return _scored(vector_store.similarity_search_with_score(query, k=settings.k, kind=settings.kind,
+                                                             ef_search=ef_search))
+
+def reciprocal_rank_fusion(result_lists, k=4, rrf_k=60):
+    # Merges ranked lists by summing 1 / (rrf_k + rank), which needs no calibration between BM25 and cosine scores
+    scores, docs = {}, {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            title = doc.metadata["title"]
+            docs.setdefault(title, doc)
+            scores[title] = scores.get(title, 0) + 1 / (rrf_k + rank)
+    # Without scores: fused ones halve wherever only one of the lists has a result, which says little about relevance
+    return [Document(page_content=docs[title].page_content,
+                     metadata={key: value for key, value in docs[title].metadata.items() if key != "score"})
+            for title in sorted(scores, key=scores.get, reverse=True)[:k]]
+
+def hybrid_search(query, vector_store, lexical_index, settings: Optional[VectorSearchSettings] = None, rrf_k=60):
+    settings = settings or VectorSearchSettings()
+    k = settings.k
+    lexical = _scored(lexical_index.search(query, k))
+    identifiers = identifier_terms(query)
+    if identifiers and lexical and set(identifiers) <= set(tokenize(lexical[0].page_content)):
+        # The best lexical hit contains every code and number in the query, answer without an embeddings round trip
+        return lexical
+    return reciprocal_rank_fusion([vector_search(query, vector_store, settings), lexical], k, rrf_k)
 
-def _search_tool(mongo_client, vector_store, args):
+# Chunks returned by searches earlier in the session, keyed by title and by their [doc_i] label in the latest result,
+# so grounding can resolve cited sources without another round trip
+_SEARCH_SOURCES_KEY = "search_sources"
+_SEARCH_LABELS_KEY = "search_labels"
+_MAX_SESSION_SOURCES = 100
+
+def _remember_sources(tool_state, results):
+    sources = tool_state.setdefault(_SEARCH_SOURCES_KEY, {})
+    labels = {}
+    for i, doc in enumerate(results):
+        title = doc.metadata["title"]
+        sources.pop(title, None)  # Re-insert so the most recent results are evicted last
+        sources[title] = {"_id": doc.metadata.get("_id"), "title": title, "content": doc.page_content}
+        labels[f"doc_{i}"] = title
+    while len(sources) > _MAX_SESSION_SOURCES:
+        del sources[next(iter(sources))]
+    tool_state[_SEARCH_LABELS_KEY] = labels
+
+def _search_tool(vector_store, args, tool_state, lexical_index=None, search_cache=None,
+                 settings: Optional[VectorSearchSettings] = None, packer: Optional[ResultPacker] = None):
+    settings = settings or VectorSearchSettings()
     query = args['query']
     print(f"Searching for '{query}' in the knowledge base.")
 
-    # Perform vector search using CosmosDB vector store
-    results = vector_search(query, vector_store)
+    # Perform vector search using CosmosDB vector store, fused with the lexical index when there is one
+    started = time.perf_counter()
+    hybrid = lexical_index is not None and lexical_index.ready
+    variant = f"{'hybrid' if hybrid else 'vector'}:{settings.k}"
+    results = search_cache.get(query, variant) if search_cache is not None else None
+    if results is None:
+        if hybrid:
+            results = hybrid_search(query, vector_store, lexical_index, settings)
+        else:
+            results = vector_search(query, vector_store, settings)
+        if search_cache is not None and results:
+            search_cache.put(query, results, variant)
+    _search_seconds.observe(time.perf_counter() - started)
+    mark("vector_query_done")
+    # Only what fits the token budget goes to the model, grounding still resolves the full chunks
+    packed = packer.pack(query, results) if packer is not None else [(doc, doc.page_content) for doc in results]
+    _remember_sources(tool_state, [doc for doc, _ in packed])
     
     # Format results to be sent as a system message to the LLM
     result_str = ""
-    for i, doc in enumerate(results):
-        truncated_content = doc.page_content[:2000] if len(doc.page_content) > 2000 else doc.page_content
+    for i, (doc, content) in enumerate(packed):
+        truncated_content = content[:2000] if len(content) > 2000 else content
         result_str += f"[doc_{i}]: {doc.metadata['title']}\nContent: {truncated_content}\n-----\n"
     if not result_str or result_str.isspace():
         result_str = "1"
     
     return ToolResult(result_str, ToolResultDirection.TO_SERVER)
 
-def _report_grounding_tool(mongo_client, vector_store, args):
+def _report_grounding_tool(collection, args, tool_state):
     sources = args["sources"]
-    valid_sources = [s for s in sources if re.match(r'^[a-zA-Z0-9_=\-]+$', s)]
+    valid_sources = [s for s in sources if isinstance(s, str) and re.match(r'^[\w.=\- ]+$', s)]
     list_of_sources = " OR ".join(valid_sources)
     print(f"Grounding source: {list_of_sources}")
 
-    # Fetch documents from the vector store using the search functionality
-    search_results = []
+    # Resolve cited sources by exact key: first from what this session's searches returned, then with a single
+    # batched lookup on the indexed title field for anything cited from elsewhere
+    known_sources = tool_state.get(_SEARCH_SOURCES_KEY, {})
+    labels = tool_state.get(_SEARCH_LABELS_KEY, {})
+    titles = list(dict.fromkeys(labels.get(source, source) for source in valid_sources))
+    found = {title: known_sources[title] for title in titles if title in known_sources}
 
-    for source in valid_sources:
-        # Perform a vector search using the title as the query
-        docs = vector_store.similarity_search(source)
-        for doc in docs:
-            search_results.append({
-                "chunk_id": doc.metadata.get("title", "Unknown Title"),
-                "content": doc.page_content,
-                "metadata": doc.metadata
-            })
+    missing = [title for title in titles if title not in found]
+    if missing:
+        for doc in collection.find({"metadata.title": {"$in": missing}}, {"textContent": 1, "metadata.title": 1}):
+            title = doc["metadata"]["title"]
+            found[title] = {"_id": doc["_id"], "title": title, "content": doc["textContent"]}
 
     # Format the results
     result_str = ""
-    for result in search_results:
-        result_str += f"[{result['chunk_id']}]: {result['content'][:200]}...\n-----\n"
+    for title in titles:
+        if title in found:
+            result_str += f"[{title}]: {found[title]['content'][:200]}...\n-----\n"
     
     if not result_str or result_str.isspace():
         result_str = "1"
@@ -145,81 +269,264 @@ def check_index_exists(collection, index_name):
     indexes = collection.index_information()
     return index_name in indexes
 
+def _index_searchable(collection) -> bool:
+    return check_index_exists(collection, _INDEX_NAME) and \
+        collection.count_documents({"manifest": {"$exists": False}}) > 0
+
 def check_vector_store_empty(vector_store):
-    return vector_store._collection.count_documents({}) == 0
+    # Per-file manifests live in the same collection, only chunks count
+    return vector_store._collection.count_documents({"manifest": {"$exists": False}}) == 0
 
-def attach_rag_tools(rtmt, mongo_connection_string, database_name, collection_name, pdf_dir):
-    mongo_client = init_mongo_client(mongo_connection_string)
+def create_embeddings():
+    embeddings_model = os.getenv("AZURE_OPENAI_EMBEDDINGS_MODEL_NAME")
+    embeddings_deployment = os.getenv("AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT_NAME")
+    # Shorter Matryoshka embeddings, only text-embedding-3 models accept this
+    dimensions = embedding_dimensions() if os.getenv("EMBEDDING_DIMENSIONS") else None
 
-    openai_embeddings = AzureOpenAIEmbeddings(
-        model=os.getenv("AZURE_OPENAI_EMBEDDINGS_MODEL_NAME"),
-        azure_deployment=os.getenv("AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT_NAME"),
-        api_key=os.getenv("AZURE_OPENAI_API_KEY")
-    )
+    def openai_embeddings():
+        from langchain_openai import AzureOpenAIEmbeddings
+        return AzureOpenAIEmbeddings(
+            model=embeddings_model,
+            azure_deployment=embeddings_deployment,
+            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            dimensions=dimensions
+        )
 
-    collection = mongo_client[database_name][collection_name]
-    index_name = "ContosoIndex"
-
-    vector_store = None
-    create_new_index = not check_index_exists(collection, index_name)
-
-    # Create HNSW index on the collection
-    num_lists = 100
-    dimensions = 1536  # Size of the embeddings
-    similarity_algorithm = CosmosDBSimilarityType.COS
-    kind = CosmosDBVectorSearchType.VECTOR_HNSW
-    m = 16
-    ef_construction = 64
-    
-    # If the index doesn't exist or the vector store is empty, create and index the vector store
-    if create_new_index:
-        print("Creating vector store and indexing documents...")
+    # Voice users repeat the same questions, serve their query embeddings from cache instead of a round trip
+    return TracedEmbeddings(cached_embeddings_from_env(Deferred(openai_embeddings), embeddings_model,
+                                                       embeddings_deployment, dimensions))
 
-        documents = extract_text_from_pdfs(pdf_dir)
-        print("Documents", len(documents))
+def embedding_dimensions() -> int:
+    # Changing this needs a new vector index and `python indexer.py --full`
+    return int(os.getenv("EMBEDDING_DIMENSIONS") or 1536)
 
-        vector_store = AzureCosmosDBVectorSearch.from_documents(
-            documents,
-            openai_embeddings,
+_INDEX_NAME = "ContosoIndex"
+
+def open_vector_store(collection, embeddings):
+    def cosmos_vector_store():
+        from langchain_community.vectorstores.azure_cosmos_db import AzureCosmosDBVectorSearch
+        return AzureCosmosDBVectorSearch(
             collection=collection,
-            index_name=index_name,
+            embedding=embeddings,
+            index_name=_INDEX_NAME,
         )
+    return Deferred(cosmos_vector_store)
 
-        vector_store.create_index(
-            num_lists, dimensions, similarity_algorithm, kind, m, ef_construction
-        )
+def local_index_from_env(embeddings, settings: Optional[VectorSearchSettings] = None) -> Optional[LocalVectorIndex]:
+    # VECTOR_STORE=local answers searches from an in-process mirror of the collection, Cosmos DB stays the source
+    # of truth and keeps receiving every write
+    if os.getenv("VECTOR_STORE", "cosmos") != "local":
+        return None
+    settings = settings or vector_search_settings_from_env()
+    return LocalVectorIndex(
+        embeddings,
+        path=os.getenv("LOCAL_INDEX_PATH") or None,
+        hnsw_threshold=int(os.getenv("LOCAL_INDEX_HNSW_THRESHOLD", 50000)),
+        hnsw_m=settings.m,
+        hnsw_ef_construction=settings.ef_construction or 200,
+        ef_search=max(settings.ef_search or 64, settings.k),
+        quantization=os.getenv("LOCAL_INDEX_QUANTIZATION", "none"),
+        search_dimensions=int(os.getenv("LOCAL_INDEX_SEARCH_DIMENSIONS") or 0) or None,
+        rerank_candidates=int(os.getenv("LOCAL_INDEX_RERANK_CANDIDATES", 40))
+    )
+
+def lexical_index_from_env() -> Optional[BM25Index]:
+    if os.getenv("LEXICAL_INDEX", "false").lower() not in ("1", "true", "yes"):
+        return None
+    return BM25Index(path=os.getenv("LEXICAL_INDEX_PATH") or None)
+
+def create_vector_index(vector_store, settings: Optional[VectorSearchSettings] = None):
+    # Create the vector index on the collection, HNSW unless VECTOR_INDEX_KIND says otherwise
+    settings = settings or vector_search_settings_from_env()
+    vector_store.create_index(
+        settings.num_lists, settings.dimensions, settings.similarity, settings.kind, settings.m,
+        settings.ef_construction or 64
+    )
+
+class IndexBuildStatus(SyncProgress):
+    """Progress of the index build, read by the tools and the status endpoint while a build runs."""
+    state: str = "idle"  # idle, building, ready, failed or off
+    searchable: bool = False
+    error: Optional[str] = None
+    recheck_seconds: float = 10
+    _checked_at: float = 0.0
+
+    def recheck(self, collection) -> bool:
+        # While the index isn't searchable, look at the collection again at most every `recheck_seconds`: the
+        # indexer command, the primary worker's build or Mongo coming back can all change that behind our back
+        now = time.monotonic()
+        if not self.searchable and now - self._checked_at >= self.recheck_seconds:
+            self._checked_at = now
+            try:
+                self.searchable = _index_searchable(collection)
+            except Exception as e:
+                print(f"Index searchability check failed: {e}")
+        return self.searchable
+
+    def to_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "searchable": self.searchable,
+            "files_total": self.files_total,
+            "files_parsed": self.files_parsed,
+            "chunks_indexed": self.chunks_indexed,
+            "error": self.error
+        }
+
+def build_index(collection, vector_store, embeddings, pdf_dir, status: Optional[IndexBuildStatus] = None,
+                full: bool = False, **ingest_options):
+    """Creates or syncs the index for the PDFs in `pdf_dir`, shared by the indexer command and background builds."""
+    status = status or IndexBuildStatus()
+    create_new_index = not check_index_exists(collection, _INDEX_NAME)
+
+    # If the index doesn't exist or the vector store is empty, create and index the vector store, otherwise sync it
+    # with the PDFs on disk, which only costs anything for files that were added, changed or removed
+    vector_store_empty = create_new_index or check_vector_store_empty(vector_store)
+    status.searchable = not vector_store_empty
+    if create_new_index:
+        print("Creating vector store and indexing documents...")
+    elif vector_store_empty:
+        print("Vector store is empty, extracting and indexing documents...")
     else:
-        print("Vector store already exists, reusing it for querying.")
-        vector_store = AzureCosmosDBVectorSearch(
-            collection=collection,
-            embedding=openai_embeddings,
-            index_name=index_name,
-        )
+        print("Vector store already exists, syncing it with the documents on disk...")
+
+    status.state = "building"
+    result = sync_pdf_dir(pdf_dir, collection, embeddings, full=full or vector_store_empty, progress=status,
+                          **ingest_options)
+
+    if create_new_index:
+        create_vector_index(vector_store)
 
-        # Check if the vector store is empty and needs re-indexing
-        if check_vector_store_empty(vector_store):
-            print("Vector store is empty, extracting and indexing documents...")
-            documents = extract_text_from_pdfs(pdf_dir)
-            print("Documents", len(documents))
-
-            vector_store = AzureCosmosDBVectorSearch.from_documents(
-                documents,
-                openai_embeddings,
-                collection=collection,
-                index_name=index_name,
-            )
-
-            # Recreate the index if necessary
-            vector_store.create_index(
-                num_lists, dimensions, similarity_algorithm, kind, m, ef_construction
-            )
-
-    # Attach search and grounding tools
+    # Grounding looks chunks up by title, make sure that's an indexed lookup
+    collection.create_index("metadata.title")
+    status.state = "ready"
+    status.searchable = True
+    return result
+
+def _prepare_index(collection, vector_store, embeddings, pdf_dir, status: IndexBuildStatus, build: bool,
+                   mirrors: list, refresh_interval: float, search_cache=None):
+    # `mirrors` are the in-process indexes (local vectors, lexical) that copy the collection
+    def sync_mirror(mirror):
+        previous = mirror.fingerprint
+        mirror.sync(collection)
+        if search_cache is not None and previous is not None and mirror.fingerprint != previous:
+            search_cache.clear()
+
+    try:
+        for mirror in mirrors:
+            # Serve what's already indexed from the mirrors while a build or sync runs
+            sync_mirror(mirror)
+        if build:
+            result = build_index(collection, vector_store, embeddings, pdf_dir, status, **ingest_options_from_env())
+            if search_cache is not None and (result.added or result.updated or result.removed):
+                search_cache.clear()
+        else:
+            status.searchable = _index_searchable(collection)
+        for mirror in mirrors:
+            sync_mirror(mirror)
+    except Exception as e:
+        print(f"Index build failed: {e}")
+        status.state = "failed"
+        status.error = str(e)
+
+    # Picks up what the indexer command or another server instance wrote, a no-op while the collection is unchanged
+    while mirrors and refresh_interval > 0:
+        time.sleep(refresh_interval)
+        for mirror in mirrors:
+            try:
+                sync_mirror(mirror)
+                status.searchable = status.searchable or len(mirror) > 0
+            except Exception as e:
+                print(f"{type(mirror).__name__} refresh failed: {e}")
+
+_STILL_INDEXING = "The knowledge base is still being indexed and can't be searched yet. " + \
+                  "Tell the user to try again in a minute."
+
+def register_rag_tools(rtmt, collection, search_store, lexical_index=None, searchable=lambda: True,
+                       search_cache=None, settings: Optional[VectorSearchSettings] = None,
+                       packer: Optional[ResultPacker] = None):
+    """Registers the search and grounding tools on `rtmt` over an already opened collection and search store.
+
+    `searchable` is checked on every call, searches made while it returns False answer that the knowledge base is
+    still being indexed.
+    """
+    def search(args, tool_state):
+        if not searchable():
+            return ToolResult(_STILL_INDEXING, ToolResultDirection.TO_SERVER)
+        return _search_tool(search_store, args, tool_state, lexical_index, search_cache, settings, packer)
+
+    def report_grounding(args, tool_state):
+        if not searchable():
+            return ToolResult("1", ToolResultDirection.TO_SERVER)
+        return _report_grounding_tool(collection, args, tool_state)
+
+    # Attach search and grounding tools, both make blocking network calls so they run on the middle tier's
+    # executor with a cap on concurrent calls per tool and a timeout so a slow backend can't hold a turn forever
+    tool_max_concurrency = int(os.getenv("TOOL_MAX_CONCURRENCY", 8))
+    tool_timeout = float(os.getenv("TOOL_TIMEOUT_SECONDS", 20))
     rtmt.tools["search"] = Tool(
         schema=_search_tool_schema,
-        target=lambda args: _search_tool(mongo_client, vector_store, args)
+        target=search,
+        max_concurrency=tool_max_concurrency,
+        timeout=tool_timeout,
+        with_session_state=True,
+        # With SPECULATIVE_RETRIEVAL on, the middle tier searches for what the user said while the model is still
+        # working out its query
+        speculative_args=lambda transcript: {"query": transcript}
     )
     rtmt.tools["report_grounding"] = Tool(
         schema=_grounding_tool_schema,
-        target=lambda args: _report_grounding_tool(mongo_client, vector_store, args)
+        target=report_grounding,
+        max_concurrency=tool_max_concurrency,
+        timeout=tool_timeout,
+        with_session_state=True
     )
+
+def attach_rag_tools(rtmt, mongo_connection_string, database_name, collection_name, pdf_dir=None,
+                     index_on_startup="background", primary=True) -> IndexBuildStatus:
+    """Attaches the search and grounding tools without waiting on ingestion.
+
+    With `index_on_startup` set to "background" and a `pdf_dir`, the index is built or synced on a background
+    thread while the server already takes sessions, searches answer that the knowledge base is still being indexed
+    until it holds chunks. With "off" the index is left to the indexer command. Of the workers of a multi-worker
+    server only the `primary` one builds the index and writes the mirror files, the others read them. Returns the
+    build status.
+    """
+    mongo_client = init_mongo_client(mongo_connection_string)
+    openai_embeddings = create_embeddings()
+    collection = mongo_client[database_name][collection_name]
+    vector_store = open_vector_store(collection, openai_embeddings)
+    settings = vector_search_settings_from_env()
+    local_index = local_index_from_env(openai_embeddings, settings)
+    search_store = local_index if local_index is not None else vector_store
+    lexical_index = lexical_index_from_env()
+    mirrors = [mirror for mirror in (local_index, lexical_index) if mirror is not None]
+    for mirror in mirrors:
+        mirror.save = primary
+    search_cache = search_cache_from_env()
+
+    status = IndexBuildStatus()
+    build = primary and index_on_startup == "background" and bool(pdf_dir)
+    if not build:
+        status.state = "off"
+    refresh_interval = float(os.getenv("INDEX_REFRESH_SECONDS", 300))
+    # Nothing here blocks startup, even checking the collection is a network round trip
+    threading.Thread(
+        target=_prepare_index,
+        args=(collection, vector_store, openai_embeddings, pdf_dir, status, build, mirrors, refresh_interval,
+              search_cache),
+        name="index-build",
+        daemon=True
+    ).start()
+
+    register_rag_tools(rtmt, collection, search_store, lexical_index,
+                       searchable=lambda: status.recheck(collection) and (local_index is None or local_index.ready),
+                       search_cache=search_cache, settings=settings, packer=result_packer_from_env())
+
+    # Run by rtmt.warmup before the server reports ready, so the first turns don't pay for opening connections,
+    # importing the clients and loading the tokenizer. Document embeddings skip the query cache and its metrics.
+    rtmt.warmup_steps["mongo"] = lambda: mongo_client.admin.command("ping")
+    rtmt.warmup_steps["vector_store"] = vector_store.load
+    rtmt.warmup_steps["embeddings"] = lambda: openai_embeddings.embed_documents(["warmup"])
+    rtmt.warmup_steps["tokenizer"] = lambda: count_tokens("warmup")
+    return status
@@ -0,0 +1,117 @@
+import math
+import os
+import re
+from typing import Callable
+from langchain_core.documents import Document
+from chunking import count_tokens
+from lexical_index import tokenize
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+def _sentences(text: str) -> list[str]:
+    return [sentence for sentence in _SENTENCE_END.split(" ".join(text.split())) if sentence]
+
+def _shingles(text: str) -> set[tuple[str, str]]:
+    # Word pairs rather than words, texts on the same topic share most words but few pairs unless one copies the other
+    words = tokenize(text)
+    return set(zip(words, words[1:])) or {(word, "") for word in words}
+
+def _jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+# Fits search results into `token_budget` tokens before they go to the model, which pays for them on every turn.
+# A `token_budget` of 0 turns trimming off and a `score_gap` of 0 turns the cut-off at a score gap off
+class ResultPacker:
+    def __init__(self, token_budget: int = 600, score_gap: float = 0.1, duplicate_threshold: float = 0.8,
+                 min_passage_tokens: int = 40, label_tokens: int = 20,
+                 token_counter: Callable[[str], int] = count_tokens):
+        self.token_budget = token_budget
+        self.score_gap = score_gap
+        self.duplicate_threshold = duplicate_threshold
+        self.min_passage_tokens = min_passage_tokens
+        self.label_tokens = label_tokens  # The [doc_i] label, title and separators the tool adds to each result
+        self.count_tokens = token_counter
+
+    def pack(self, query: str, results: list[Document]) -> list[tuple[Document, str]]:
+        """Returns the results to send, each with the text to send for it. Scores are read from `metadata["score"]`."""
+        # Always at least one result, each of the rest gets an equal share of what's left of the budget
+        kept = self._dedupe(self._cut_at_gap(results))
+        if not self.token_budget:
+            return [(doc, doc.page_content) for doc in kept]
+
+        passages = [_sentences(doc.page_content) for doc in kept]
+        weights = self._term_weights(query, passages)
+        packed, remaining = [], self.token_budget
+        for i, (doc, sentences) in enumerate(zip(kept, passages)):
+            remaining -= self.label_tokens
+            if packed and remaining < self.min_passage_tokens:
+                break
+            share = max(self.min_passage_tokens, remaining // (len(kept) - i))
+            text, tokens = self._trim(sentences, weights, min(share, remaining))
+            packed.append((doc, text))
+            remaining -= tokens
+        return packed
+
+    def _cut_at_gap(self, results: list[Document]) -> list[Document]:
+        scores = [doc.metadata.get("score") for doc in results]
+        # Everything from the first drop of more than `score_gap` below the result before is cut off, unscored
+        # results never are
+        if not results or not self.score_gap or any(score is None for score in scores):
+            return results
+        # Relative to the best score, so it works for cosine, BM25 and fused scores alike
+        threshold = self.score_gap * abs(scores[0])
+        for i in range(1, len(results)):
+            if scores[i - 1] - scores[i] > threshold:
+                return results[:i]
+        return results
+
+    def _dedupe(self, results: list[Document]) -> list[Document]:
+        # Results whose word pairs mostly repeat those of a result already kept add nothing
+        kept, kept_shingles = [], []
+        for doc in results:
+            shingles = _shingles(doc.page_content)
+            if any(_jaccard(shingles, other) >= self.duplicate_threshold for other in kept_shingles):
+                continue
+            kept.append(doc)
+            kept_shingles.append(shingles)
+        return kept
+
+    def _term_weights(self, query: str, passages: list[list[str]]) -> dict[str, float]:
+        # Query terms found in few of the results' sentences say more about relevance than ones found in all of them
+        terms = set(tokenize(query))
+        sentences = [set(tokenize(sentence)) & terms for passage in passages for sentence in passage]
+        return {term: math.log(1 + len(sentences) / (1 + sum(term in s for s in sentences))) for term in terms}
+
+    def _trim(self, sentences: list[str], weights: dict[str, float], budget: int) -> tuple[str, int]:
+        # Over budget, keep the sentences that best match the query, in their original order
+        tokens = [self.count_tokens(sentence) for sentence in sentences]
+        if sum(tokens) <= budget:
+            return " ".join(sentences), sum(tokens)
+        relevance = [sum(weights.get(term, 0) for term in set(tokenize(sentence))) for sentence in sentences]
+        chosen, used = [], 0
+        for i in sorted(range(len(sentences)), key=lambda i: (-relevance[i], i)):
+            if chosen and relevance[i] == 0:
+                break  # Spend the budget on what matches the query, not on filler
+            if used + tokens[i] <= budget:
+                chosen.append(i)
+                used += tokens[i]
+        if not chosen:
+            # Even the best sentence is over budget, keep as many of its words as fit
+            best = max(range(len(sentences)), key=lambda i: (relevance[i], -i))
+            words = sentences[best].split()
+            text = " ".join(words[:max(1, len(words) * budget // tokens[best])]) + " ..."
+            return text, self.count_tokens(text)
+        parts, previous = [], None
+        for i in sorted(chosen):
+            if previous is not None and i != previous + 1:
+                parts.append("...")
+            parts.append(sentences[i])
+            previous = i
+        return " ".join(parts), used
+
+def result_packer_from_env() -> ResultPacker:
+    return ResultPacker(
+        token_budget=int(os.getenv("SEARCH_RESULT_TOKEN_BUDGET", 600)),
+        score_gap=float(os.getenv("SEARCH_SCORE_GAP", 0.1)),
+        duplicate_threshold=float(os.getenv("SEARCH_DUPLICATE_THRESHOLD", 0.8))
+    )
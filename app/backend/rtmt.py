@@ -1,13 +1,52 @@
 import aiohttp
 import asyncio
+import contextvars
+import functools
+import inspect
 import json
+import os
+import re
+import time
+import uuid
+from concurrent.futures import Executor, ThreadPoolExecutor
 from enum import Enum
-from typing import Any, Callable, Optional
+from typing import Any, Awaitable, Callable, Mapping, Optional
 from aiohttp import web
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
-from azure.core.credentials import AzureKeyCredential
-import time
-import random
+from azure.core.credentials import AzureKeyCredential, TokenCredential
+from client_queue import ClientSendQueue, peek_event_type
+from scheduler import SessionScheduler
+from upstream import UpstreamConnectionManager, UpstreamUnavailableError
+from metrics import TurnTrace, current_trace, registry
+
+_tool_seconds = registry.histogram("rtmt_tool_seconds", "Tool call duration, including waiting for a concurrency slot")
+_tool_calls = registry.counter("rtmt_tool_calls_total", "Tool calls by tool and outcome")
+_upstream_connect_seconds = registry.histogram("rtmt_upstream_connect_seconds",
+                                               "Time to open the upstream realtime websocket, including rate limiting")
+_turns = registry.counter("rtmt_turns_total", "Voice turns completed")
+_speculative_hits = registry.counter("rtmt_speculative_hits_total", "Tool calls served from speculative results")
+
+# Event types the middle tier rewrites or swallows, everything else is relayed to the other side untouched
+_CLIENT_BOUND_EVENTS = frozenset({
+    "session.created",
+    "response.output_item.added",
+    "conversation.item.created",
+    "response.function_call_arguments.delta",
+    "response.function_call_arguments.done",
+    "response.output_item.done",
+    "response.done",
+    "conversation.item.input_audio_transcription.completed"
+})
+_SERVER_BOUND_EVENTS = frozenset({"session.update"})
+
+_WORD = re.compile(r"\w+")
+
+def containment(query: str, text: str) -> float:
+    # Share of the query's words that also appear in the text, a rephrased question the model derives from what
+    # the user said mostly reuses the user's words
+    query_words = set(_WORD.findall(query.lower()))
+    if not query_words:
+        return 0.0
+    return len(query_words & set(_WORD.findall(text.lower()))) / len(query_words)
 
 class ToolResultDirection(Enum):
     TO_SERVER = 1
@@ -27,12 +66,80 @@ class ToolResult:
         return self.text if type(self.text) == str else json.dumps(self.text)
 
 class Tool:
-    target: Callable[..., ToolResult]
+    target: Callable[..., ToolResult | Awaitable[ToolResult]]
     schema: Any
+    max_concurrency: Optional[int] = None
+    timeout: Optional[float] = None
+    # When set the target is called as target(args, tool_state) with the calling session's tool state, letting
+    # tools in the same session share results (e.g. grounding reusing what search returned)
+    with_session_state: bool = False
+    # Turns the transcript of what the user just said into arguments to run the tool with speculatively, before
+    # the model asks for it, or None to not speculate on that transcript
+    speculative_args: Optional[Callable[[str], Optional[dict[str, Any]]]] = None
 
-    def __init__(self, target: Any, schema: Any):
+    def __init__(self, target: Any, schema: Any, max_concurrency: Optional[int] = None, timeout: Optional[float] = None,
+                 with_session_state: bool = False, speculative_args: Optional[Callable[[str], Optional[dict[str, Any]]]] = None):
         self.target = target
         self.schema = schema
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.with_session_state = with_session_state
+        self.speculative_args = speculative_args
+        self._semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+
+    async def invoke(self, args: Any, executor: Optional[Executor] = None, tool_state: Optional[dict[str, Any]] = None) -> ToolResult:
+        # Async targets run directly on the event loop, sync targets (pymongo, embeddings over HTTP) run on the 
+        # executor so a slow tool never stalls message forwarding for other sessions
+        call_args = (args, tool_state if tool_state is not None else {}) if self.with_session_state else (args,)
+        if self._semaphore is None:
+            return await asyncio.wait_for(self._call(call_args, executor), self.timeout)
+        # The wait for a slot and the call share one deadline, so calls stuck on a tool can't hold up the ones behind
+        # them past their timeout. The slot is given back when the call is over, not when the caller stops waiting: a
+        # sync call that timed out keeps its executor thread until it returns, and counts against max_concurrency
+        loop = asyncio.get_running_loop()
+        acquired = released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self._semaphore.release()
+
+        def release_from_thread(_):
+            try:
+                loop.call_soon_threadsafe(release)
+            except RuntimeError:  # The loop is closed, and the semaphore with it
+                pass
+
+        running = []
+        try:
+            async with asyncio.timeout(self.timeout):
+                await self._semaphore.acquire()
+                acquired = True
+                return await self._call(call_args, executor, running)
+        finally:
+            if acquired and running and not running[0].done():
+                running[0].add_done_callback(release_from_thread)
+            elif acquired:
+                release()
+
+    async def _call(self, call_args: tuple, executor: Optional[Executor], running: Optional[list] = None) -> ToolResult:
+        if inspect.iscoroutinefunction(self.target):
+            return await self.target(*call_args)
+        # Executor threads don't inherit context variables, pass them along so tools can mark the current turn
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, self.target, *call_args)
+        if executor is None:
+            result = await asyncio.get_running_loop().run_in_executor(None, call)
+        else:
+            # The executor's own future, which unlike the asyncio one isn't done until the thread returns
+            future = executor.submit(call)
+            if running is not None:
+                running.append(future)
+            result = await asyncio.wrap_future(future)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
 
 class RTToolCall:
     tool_call_id: str
@@ -42,12 +149,86 @@ class RTToolCall:
         self.tool_call_id = tool_call_id
         self.previous_id = previous_id
 
+class Speculation:
+    tool_name: str
+    args: dict[str, Any]
+    task: asyncio.Task
+    # Speculative calls work on a copy of the session's tool state, adopted only if the result gets used, so a 
+    # discarded guess never changes what later tool calls see
+    tool_state: dict[str, Any]
+
+    def __init__(self, tool_name: str, args: dict[str, Any], task: asyncio.Task, tool_state: dict[str, Any]):
+        self.tool_name = tool_name
+        self.args = args
+        self.task = task
+        self.tool_state = tool_state
+
+    def matches(self, name: str, args: Any, min_containment: float) -> bool:
+        if name != self.tool_name or not isinstance(args, dict) or args.keys() != self.args.keys():
+            return False
+        for key, value in args.items():
+            if isinstance(value, str) and isinstance(self.args[key], str):
+                if containment(value, self.args[key]) < min_containment:
+                    return False
+            elif value != self.args[key]:
+                return False
+        return True
+
+class RTSession:
+    id: str
+    client_ws: web.WebSocketResponse
+    server_ws: Optional[aiohttp.ClientWebSocketResponse] = None
+
+    # Everything tied to a single client connection lives here so concurrent sessions never see each other's 
+    # tool calls
+    tools_pending: dict[str, RTToolCall]
+    tool_tasks: dict[str, asyncio.Task]
+    tool_state: dict[str, Any]
+    waiting: bool = False
+    speculations: list[Speculation]
+    turn: Optional[TurnTrace] = None
+    turns: int = 0
+    outbound: Optional[ClientSendQueue] = None
+
+    def __init__(self, client_ws: web.WebSocketResponse):
+        self.id = str(uuid.uuid4())
+        self.client_ws = client_ws
+        self.tools_pending = {}
+        self.tool_tasks = {}
+        self.tool_state = {}
+        self.speculations = []
+        self._background: set[asyncio.Task] = set()
+
+    def create_task(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    async def send_to_client(self, frame: str):
+        # Through the outbound queue when there is one, so everything sent to the client keeps its order
+        if self.outbound is not None:
+            await self.outbound.send(frame)
+        else:
+            await self.client_ws.send_str(frame)
+
+    async def close(self):
+        for task in list(self._background):
+            task.cancel()
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        if self.outbound is not None:
+            await self.outbound.close()
+
 class RTMiddleTier:
     endpoint: str
     deployment: str
     key: Optional[str] = None
     
-    tools: dict[str, Tool] = {}
+    tools: dict[str, Tool]
+    sessions: dict[str, RTSession]
+    scheduler: Optional[SessionScheduler] = None
+    upstream: UpstreamConnectionManager
 
     model: Optional[str] = None
     system_message: Optional[str] = None
@@ -55,19 +236,77 @@ class RTMiddleTier:
     max_tokens: Optional[int] = None
     disable_audio: Optional[bool] = None
 
-    _tools_pending = {}
+    # Relay frames the middle tier doesn't touch without decoding them, turn off to parse every frame
+    relay_fast_path: bool = True
+
+    # Start tools that opt in on the user's input transcript as soon as it arrives, and serve the model's call
+    # from that result when its arguments are close enough
+    speculative_tools: bool = False
+    speculative_min_containment: float = 0.6
+    speculative_hits: int = 0
+
+    # Print every turn's timing marks as a JSON line, the histograms on /metrics are always kept
+    log_turn_traces: bool = False
+
+    # Outbound queue per client, see ClientSendQueue
+    client_high_water: int = 1 << 20
+    client_coalesce_max_bytes: int = 1 << 18
+    client_overflow_policy: str = "close"
+
+    # Seconds live sessions get to finish on shutdown before they're closed with "going away"
+    drain_timeout: float = 30
+    draining: bool = False
+    tools_in_flight: int = 0
+
+    # Blocking calls run on the tool executor by `warmup` at startup, by name, see attach_rag_tools. Until warmup
+    # is done or `warmup_timeout` seconds have passed `ready` is False, with per-step results in `warmup_results`.
+    warmup_steps: dict[str, Callable[[], Any]]
+    warmup_results: dict[str, dict]
+    warmup_timeout: float = 60
+    warmed_up: bool = False
+
     _token_provider = None
+    _warmup_task: Optional[asyncio.Task] = None
+    _tool_executor: Optional[ThreadPoolExecutor] = None
 
-    def __init__(self, endpoint: str, deployment: str, credentials: AzureKeyCredential | DefaultAzureCredential):
+    def __init__(self, endpoint: str, deployment: str, credentials: AzureKeyCredential | TokenCredential,
+                 tool_max_workers: Optional[int] = None):
         self.endpoint = endpoint
         self.deployment = deployment
+        self.tool_max_workers = tool_max_workers or int(os.environ.get("TOOL_MAX_WORKERS", 16))
+        self.speculative_tools = os.environ.get("SPECULATIVE_RETRIEVAL", "false").lower() in ("1", "true", "yes")
+        self.speculative_min_containment = float(os.environ.get("SPECULATIVE_MIN_CONTAINMENT", 0.6))
+        self.log_turn_traces = os.environ.get("LOG_TURN_TRACES", "false").lower() in ("1", "true", "yes")
+        self.drain_timeout = float(os.environ.get("SESSION_DRAIN_SECONDS", 30))
+        self.client_high_water = int(os.environ.get("CLIENT_QUEUE_HIGH_WATER_BYTES", 1 << 20))
+        self.client_coalesce_max_bytes = int(os.environ.get("CLIENT_COALESCE_MAX_BYTES", 1 << 18))
+        self.client_overflow_policy = os.environ.get("CLIENT_OVERFLOW_POLICY", "close")
+        self.warmup_timeout = float(os.environ.get("WARMUP_TIMEOUT_SECONDS", 60))
+        self.tools = {}
+        self.sessions = {}
+        self.warmup_steps = {}
+        self.warmup_results = {}
+        self.upstream = UpstreamConnectionManager(
+            endpoint,
+            rate=float(os.environ.get("UPSTREAM_CONNECT_RATE", 10)),
+            burst=float(os.environ.get("UPSTREAM_CONNECT_BURST", 20)),
+            max_retries=int(os.environ.get("UPSTREAM_MAX_RETRIES", 8)),
+            max_waiting=int(os.environ.get("UPSTREAM_MAX_WAITING", 100))
+        )
         if isinstance(credentials, AzureKeyCredential):
             self.key = credentials.key
         else:
+            from azure.identity import get_bearer_token_provider  # Only needed without a key
             self._token_provider = get_bearer_token_provider(credentials, "https://cognitiveservices.azure.com/.default")
-            self._token_provider()
+            # Fetched during warmup rather than here, so creating the app never waits on the identity endpoint
+            self.warmup_steps["bearer_token"] = self._token_provider
+
+    async def _process_message_to_client(self, msg: str, rt_session: RTSession) -> Optional[str]:
+        event_type = peek_event_type(msg.data)
+        self._trace_event(rt_session, event_type)
+        if self.relay_fast_path and event_type is not None and event_type not in _CLIENT_BOUND_EVENTS:
+            return msg.data
 
-    async def _process_message_to_client(self, msg: str, client_ws: web.WebSocketResponse, server_ws: web.WebSocketResponse) -> Optional[str]:
         message = json.loads(msg.data)
         updated_message = msg.data
         if message is not None:
@@ -89,68 +328,177 @@ class RTMiddleTier:
                 case "conversation.item.created":
                     if "item" in message and message["item"]["type"] == "function_call":
                         item = message["item"]
-                        if item["call_id"] not in self._tools_pending:
-                            self._tools_pending[item["call_id"]] = RTToolCall(item["call_id"], message["previous_item_id"])
+                        if item["call_id"] not in rt_session.tools_pending:
+                            rt_session.tools_pending[item["call_id"]] = RTToolCall(item["call_id"], message["previous_item_id"])
                         updated_message = None
                     elif "item" in message and message["item"]["type"] == "function_call_output":
                         updated_message = None
 
+                case "conversation.item.input_audio_transcription.completed":
+                    if self.speculative_tools:
+                        self._speculate(rt_session, message.get("transcript") or "")
+
                 case "response.function_call_arguments.delta":
                     updated_message = None
                 
                 case "response.function_call_arguments.done":
+                    if rt_session.turn is not None:
+                        rt_session.turn.mark("function_call_args_done")
                     updated_message = None
 
                 case "response.output_item.done":
                     if "item" in message and message["item"]["type"] == "function_call":
                         item = message["item"]
-                        tool_call = self._tools_pending[message["item"]["call_id"]]
-                        tool = self.tools[item["name"]]
-                        args = item["arguments"]
-                        print("query", args)
-                        try:
-                            result = tool.target(json.loads(args))  # Decoding the JSON
-                        except json.JSONDecodeError as e:
-                            result = ToolResult(
-                                destination=ToolResultDirection.TO_SERVER,
-                            )
-                        await server_ws.send_json({
-                            "type": "conversation.item.create",
-                            "item": {
-                                "type": "function_call_output",
-                                "call_id": item["call_id"],
-                                "output": result.to_text() if result.destination == ToolResultDirection.TO_SERVER else ""
-                            }
-                        })
-                        if result.destination == ToolResultDirection.TO_CLIENT:
-                            # TODO: this will break clients that don't know about this extra message, rewrite 
-                            # this to be a regular text message with a special marker of some sort
-                            await client_ws.send_json({
-                                "type": "extension.middle_tier_tool_response",
-                                "previous_item_id": tool_call.previous_id,
-                                "tool_name": item["name"],
-                                "tool_result": result.to_text()
-                            })
+                        tool_call = rt_session.tools_pending[item["call_id"]]
+                        print("query", item["arguments"])
+                        # Run the tool in the background so the rest of the response keeps streaming to the client
+                        rt_session.tool_tasks[item["call_id"]] = rt_session.create_task(
+                            self._execute_tool_call(rt_session, tool_call, item["name"], item["arguments"]))
                         updated_message = None
 
                 case "response.done":
-                    if len(self._tools_pending) > 0:
-                        self._tools_pending.clear() # Any chance tool calls could be interleaved across different outstanding responses?
-                        await server_ws.send_json({
-                            "type": "response.create"
-                        })
+                    if len(rt_session.tools_pending) > 0:
+                        # The realtime API runs one response at a time per session, so everything pending belongs 
+                        # to the response that just finished
+                        tool_tasks = list(rt_session.tool_tasks.values())
+                        rt_session.tools_pending.clear()
+                        rt_session.tool_tasks.clear()
+                        rt_session.create_task(self._continue_after_tools(rt_session, tool_tasks))
+                    elif rt_session.turn is not None:
+                        self._finish_turn(rt_session)
                     if "response" in message:
-                        replace = False
-                        for i, output in enumerate(reversed(message["response"]["output"])):
-                            if output["type"] == "function_call":
-                                message["response"]["output"].pop(i)
-                                replace = True
-                        if replace:
-                            updated_message = json.dumps(message)                        
+                        outputs = message["response"]["output"]
+                        filtered = [output for output in outputs if output["type"] != "function_call"]
+                        if len(filtered) != len(outputs):
+                            message["response"]["output"] = filtered
+                            updated_message = json.dumps(message)
 
         return updated_message
 
-    async def _process_message_to_server(self, msg: str, ws: web.WebSocketResponse) -> Optional[str]:
+    def _trace_event(self, rt_session: RTSession, event_type: Optional[str]):
+        # Runs for every client-bound frame, so only compares the type read off the start of the frame
+        if event_type == "input_audio_buffer.speech_stopped":
+            rt_session.turns += 1
+            rt_session.turn = TurnTrace(rt_session.id, rt_session.turns)
+            rt_session.turn.mark("speech_stopped")
+        elif event_type == "response.audio.delta" and rt_session.turn is not None:
+            rt_session.turn.mark("first_audio_delta")
+
+    def _finish_turn(self, rt_session: RTSession):
+        rt_session.turn.mark("response_done")
+        rt_session.turn.finish(self.log_turn_traces)
+        rt_session.turn = None
+        _turns.inc()
+
+    def _speculate(self, rt_session: RTSession, transcript: str):
+        # Only the latest utterance is worth guessing on, whatever was started for an earlier one is dropped
+        for speculation in rt_session.speculations:
+            speculation.task.cancel()
+        rt_session.speculations = []
+        for name, tool in self.tools.items():
+            args = tool.speculative_args(transcript) if tool.speculative_args is not None and transcript.strip() else None
+            if args is None:
+                continue
+            tool_state = {key: value.copy() if isinstance(value, (dict, list)) else value
+                          for key, value in rt_session.tool_state.items()}
+            task = rt_session.create_task(self._run_tool(name, tool, json.dumps(args), tool_state=tool_state,
+                                                         trace=rt_session.turn))
+            rt_session.speculations.append(Speculation(name, args, task, tool_state))
+
+    def _take_speculation(self, rt_session: RTSession, name: str, args: str) -> Optional[Speculation]:
+        try:
+            parsed = json.loads(args)
+        except json.JSONDecodeError:
+            return None
+        for speculation in rt_session.speculations:
+            if not speculation.task.cancelled() and speculation.matches(name, parsed, self.speculative_min_containment):
+                rt_session.speculations.remove(speculation)
+                return speculation
+        return None
+
+    async def _execute_tool_call(self, rt_session: RTSession, tool_call: RTToolCall, name: str, args: str):
+        speculation = self._take_speculation(rt_session, name, args) if rt_session.speculations else None
+        if speculation is not None:
+            # Usually finished already, otherwise it's further along than a call started now would be
+            result = await speculation.task
+            rt_session.tool_state.update(speculation.tool_state)
+            self.speculative_hits += 1
+            _speculative_hits.inc(tool=name)
+        else:
+            result = await self._run_tool(name, self.tools[name], args, rt_session, trace=rt_session.turn)
+        await rt_session.server_ws.send_json({
+            "type": "conversation.item.create",
+            "item": {
+                "type": "function_call_output",
+                "call_id": tool_call.tool_call_id,
+                "output": result.to_text() if result.destination == ToolResultDirection.TO_SERVER else ""
+            }
+        })
+        if rt_session.turn is not None:
+            rt_session.turn.mark("tool_output_sent")
+        if result.destination == ToolResultDirection.TO_CLIENT:
+            # TODO: this will break clients that don't know about this extra message, rewrite 
+            # this to be a regular text message with a special marker of some sort
+            await rt_session.send_to_client(json.dumps({
+                "type": "extension.middle_tier_tool_response",
+                "previous_item_id": tool_call.previous_id,
+                "tool_name": name,
+                "tool_result": result.to_text()
+            }))
+
+    async def _continue_after_tools(self, rt_session: RTSession, tool_tasks: list[asyncio.Task]):
+        # All tool outputs have to be in the conversation before asking the model to continue
+        await asyncio.gather(*tool_tasks, return_exceptions=True)
+        await rt_session.server_ws.send_json({
+            "type": "response.create"
+        })
+
+    def _get_tool_executor(self) -> ThreadPoolExecutor:
+        if self._tool_executor is None:
+            self._tool_executor = ThreadPoolExecutor(max_workers=self.tool_max_workers, thread_name_prefix="rtmt-tool")
+        return self._tool_executor
+
+    async def _run_tool(self, name: str, tool: Tool, args: str, rt_session: Optional[RTSession] = None,
+                        tool_state: Optional[dict[str, Any]] = None, trace: Optional[TurnTrace] = None) -> ToolResult:
+        # Always awaited inside its own task, so the trace set here is only seen by this call
+        current_trace.set(trace)
+        started = time.perf_counter()
+        outcome = "ok"
+        self.tools_in_flight += 1
+        try:
+            if tool_state is None and rt_session is not None:
+                tool_state = rt_session.tool_state
+            return await tool.invoke(json.loads(args), self._get_tool_executor(), tool_state)
+        except json.JSONDecodeError:
+            outcome = "invalid_arguments"
+            return ToolResult("Invalid tool arguments, expected a JSON object.", ToolResultDirection.TO_SERVER)
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            print(f"Tool '{name}' timed out after {tool.timeout} seconds.")
+            return ToolResult(f"The '{name}' tool timed out, try again.", ToolResultDirection.TO_SERVER)
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            outcome = "error"
+            print(f"Error running tool '{name}': {e}")
+            return ToolResult(f"The '{name}' tool failed.", ToolResultDirection.TO_SERVER)
+        finally:
+            self.tools_in_flight -= 1
+            _tool_seconds.observe(time.perf_counter() - started, tool=name)
+            _tool_calls.inc(tool=name, outcome=outcome)
+
+    async def _shutdown_tool_executor(self, app: web.Application):
+        if self._tool_executor is not None:
+            self._tool_executor.shutdown(wait=False, cancel_futures=True)
+            self._tool_executor = None
+
+    async def _process_message_to_server(self, msg: str, rt_session: RTSession) -> Optional[str]:
+        if self.relay_fast_path:
+            event_type = peek_event_type(msg.data)
+            if event_type is not None and event_type not in _SERVER_BOUND_EVENTS:
+                return msg.data
+
         message = json.loads(msg.data)
         updated_message = msg.data
         if message is not None:
@@ -165,91 +513,215 @@ class RTMiddleTier:
                         session["max_response_output_tokens"] = self.max_tokens
                     if self.disable_audio is not None:
                         session["disable_audio"] = self.disable_audio
+                    if self.speculative_tools and not session.get("input_audio_transcription"):
+                        # Speculation runs on the input transcript, which the API only sends when asked to
+                        session["input_audio_transcription"] = {"model": "whisper-1"}
                     session["tool_choice"] = "auto" if len(self.tools) > 0 else "none"
                     session["tools"] = [tool.schema for tool in self.tools.values()]
                     updated_message = json.dumps(message)
 
         return updated_message
 
-    async def _forward_messages(self, ws: web.WebSocketResponse):
-        async with aiohttp.ClientSession(base_url=self.endpoint) as session:
-            params = {"api-version": "2024-10-01-preview", "deployment": self.deployment}
-            headers = {}
-            
-            if "x-ms-client-request-id" in ws.headers:
-                headers["x-ms-client-request-id"] = ws.headers["x-ms-client-request-id"]
-            
-            if self.key is not None:
-                headers = {"api-key": self.key}
-            else:
-                headers = {"Authorization": f"Bearer {self._token_provider()}"}
-
-            # Retry logic
-            max_retries = 20  # You can adjust this value based on your needs
-            retry_count = 0
-            backoff_factor = 1  # Exponential backoff factor
-
-            while retry_count < max_retries:
+    async def _forward_messages(self, rt_session: RTSession, client_headers: Mapping[str, str]):
+        ws = rt_session.client_ws
+        params = {"api-version": "2024-10-01-preview", "deployment": self.deployment}
+        headers = {}
+        
+        # From the client's upgrade request, ws.headers are the headers of our own response
+        if "x-ms-client-request-id" in client_headers:
+            headers["x-ms-client-request-id"] = client_headers["x-ms-client-request-id"]
+        
+        if self.key is not None:
+            headers["api-key"] = self.key
+        else:
+            # Token refreshes are blocking HTTP calls, keep them off the event loop
+            token = await asyncio.get_running_loop().run_in_executor(None, self._token_provider)
+            headers["Authorization"] = f"Bearer {token}"
+
+        connect_started = time.perf_counter()
+        try:
+            target_ws = await self.upstream.connect("/openai/realtime", headers, params,
+                                                    on_waiting=lambda status: self._notify_waiting(rt_session, status))
+        except UpstreamUnavailableError as e:
+            print(e)
+            await ws.close(code=aiohttp.WSCloseCode.TRY_AGAIN_LATER, message=b"Service busy, try again later")
+            return
+
+        try:
+            _upstream_connect_seconds.observe(time.perf_counter() - connect_started)
+            rt_session.server_ws = target_ws
+            if rt_session.waiting:
+                await self._notify_status(rt_session, "ready")
+
+            async def from_client_to_server():
                 try:
-                    async with session.ws_connect("/openai/realtime", headers=headers, params=params) as target_ws:
-                        async def from_client_to_server():
-                            try:
-                                async for msg in ws:
-                                    try:
-                                        if msg.type == aiohttp.WSMsgType.TEXT:
-                                            new_msg = await self._process_message_to_server(msg, ws)
-                                            if new_msg is not None:
-                                                await target_ws.send_str(new_msg)
-                                        else:
-                                            print("Error: unexpected message type:", msg.type)
-                                    except Exception as e:
-                                        print(f"Error in client-to-server communication: {e}")
-                                        continue  # Skip to the next message and continue processing
-                            except RuntimeError as e:
-                                if "WebSocket connection is closed" in str(e):
-                                    print("Client WebSocket connection closed.")
-
-                        async def from_server_to_client():
-                            try:
-                                async for msg in target_ws:
-                                    try:
-                                        if msg.type == aiohttp.WSMsgType.TEXT:
-                                            new_msg = await self._process_message_to_client(msg, ws, target_ws)
-                                            if new_msg is not None:
-                                                await ws.send_str(new_msg)
-                                        else:
-                                            print("Error: unexpected message type:", msg.type)
-                                    except Exception as e:
-                                        print(f"Error in server-to-client communication: {e}")
-                                        continue  # Skip to the next message and continue processing
-                            except RuntimeError as e:
-                                if "WebSocket connection is closed" in str(e):
-                                    print("Server WebSocket connection closed.")
+                    async for msg in ws:
+                        try:
+                            if msg.type == aiohttp.WSMsgType.TEXT:
+                                new_msg = await self._process_message_to_server(msg, rt_session)
+                                if new_msg is not None:
+                                    await target_ws.send_str(new_msg)
+                            else:
+                                print("Error: unexpected message type:", msg.type)
+                        except Exception as e:
+                            print(f"Error in client-to-server communication: {e}")
+                            continue  # Skip to the next message and continue processing
+                except RuntimeError as e:
+                    if "WebSocket connection is closed" in str(e):
+                        print("Client WebSocket connection closed.")
+                # Once the client is gone there's nobody to relay to, release the upstream connection
+                await target_ws.close()
 
+            async def from_server_to_client():
+                try:
+                    async for msg in target_ws:
                         try:
-                            await asyncio.gather(from_client_to_server(), from_server_to_client())
-                            break  # Exit the loop if the connection is successful
-                        except ConnectionResetError:
-                            pass  # Ignore the errors resulting from the client disconnecting the socket
-
-                except aiohttp.client_exceptions.WSServerHandshakeError as e:
-                    if e.status == 429:  # Too many requests error
-                        retry_count += 1
-                        # Exponential backoff with jitter
-                        sleep_time = backoff_factor * (retry_count) + random.uniform(0, 1)
-                        print(f"Rate limit exceeded. Retrying in {sleep_time} seconds...")
-                        time.sleep(sleep_time)
-                    else:
-                        raise  # If it's another error, raise it
-
-            if retry_count == max_retries:
-                print("Max retries reached. Unable to connect to the server.")           
+                            if msg.type == aiohttp.WSMsgType.TEXT:
+                                new_msg = await self._process_message_to_client(msg, rt_session)
+                                if new_msg is not None:
+                                    await rt_session.send_to_client(new_msg)
+                            else:
+                                print("Error: unexpected message type:", msg.type)
+                        except Exception as e:
+                            print(f"Error in server-to-client communication: {e}")
+                            continue  # Skip to the next message and continue processing
+                except RuntimeError as e:
+                    if "WebSocket connection is closed" in str(e):
+                        print("Server WebSocket connection closed.")
+                if rt_session.outbound is not None:
+                    await rt_session.outbound.flush()
+                await ws.close()
+
+            try:
+                await asyncio.gather(from_client_to_server(), from_server_to_client())
+            except ConnectionResetError:
+                pass  # Ignore the errors resulting from the client disconnecting the socket
+        finally:
+            await target_ws.close()
+
+    async def _notify_waiting(self, rt_session: RTSession, status: dict[str, Any]):
+        rt_session.waiting = True
+        await self._notify_status(rt_session, "waiting", **status)
+
+    async def _notify_status(self, rt_session: RTSession, status: str, **fields):
+        # Lets clients show "connecting..." instead of looking hung while the session waits for capacity, clients
+        # that don't know this message simply ignore it
+        if not rt_session.client_ws.closed:
+            await rt_session.send_to_client(json.dumps({"type": "extension.middle_tier_status", "status": status, **fields}))
 
     async def _websocket_handler(self, request: web.Request):
         ws = web.WebSocketResponse()
         await ws.prepare(request)
-        await self._forward_messages(ws)
+        if self.draining:
+            await ws.close(code=aiohttp.WSCloseCode.TRY_AGAIN_LATER, message=b"Server restarting, try again")
+            return ws
+        rt_session = RTSession(ws)
+        rt_session.outbound = ClientSendQueue(ws, request.transport, self.client_high_water,
+                                              self.client_coalesce_max_bytes, self.client_overflow_policy)
+        admitted = False
+        try:
+            if self.scheduler is not None:
+                on_queued = lambda position: self._notify_waiting(rt_session, {"reason": "session_queue", "position": position})
+                if not await self.scheduler.acquire(on_queued):
+                    await ws.close(code=aiohttp.WSCloseCode.TRY_AGAIN_LATER, message=b"Server busy, try again later")
+                    return ws
+            admitted = True
+            self.sessions[rt_session.id] = rt_session
+            await self._forward_messages(rt_session, request.headers)
+        finally:
+            # Also on rejection, the waiting notice may have left a writer task on the outbound queue
+            await rt_session.close()
+            if admitted:
+                del self.sessions[rt_session.id]
+                if self.scheduler is not None:
+                    self.scheduler.release()
         return ws
     
+    async def drain(self, app: Optional[web.Application] = None):
+        # Runs on shutdown after the listening socket is closed. Sessions are told the server is going away, which
+        # clients may use to reconnect between turns, and get `drain_timeout` seconds to end on their own before the
+        # rest are closed with "going away". With several workers a reconnect lands on another one.
+        self.draining = True
+        if not self.sessions:
+            return
+        print(f"Draining {len(self.sessions)} sessions")
+        for rt_session in list(self.sessions.values()):
+            try:
+                await self._notify_status(rt_session, "draining", timeout=self.drain_timeout)
+            except ConnectionResetError:
+                pass
+        deadline = time.monotonic() + self.drain_timeout
+        while self.sessions and time.monotonic() < deadline:
+            await asyncio.sleep(0.5)
+        for rt_session in list(self.sessions.values()):
+            await rt_session.client_ws.close(code=aiohttp.WSCloseCode.GOING_AWAY, message=b"Server restarting")
+
+    @property
+    def ready(self) -> bool:
+        return self.warmed_up and not self.draining
+
+    async def warmup(self):
+        """Runs the warmup steps concurrently on the tool executor, then marks the middle tier ready.
+
+        A step that fails or takes longer than `warmup_timeout` is logged and reported in `warmup_results` but
+        doesn't hold readiness back, what it warms up is set up on first use instead, as without warmup.
+        """
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+
+        async def run(name: str, step: Callable[[], Any]):
+            step_started = time.perf_counter()
+            try:
+                await asyncio.wait_for(loop.run_in_executor(self._get_tool_executor(), step), self.warmup_timeout)
+                result = {"ok": True}
+            except asyncio.TimeoutError:
+                result = {"ok": False, "error": f"timed out after {self.warmup_timeout}s"}
+            except Exception as e:
+                result = {"ok": False, "error": str(e) or type(e).__name__}
+            result["seconds"] = round(time.perf_counter() - step_started, 3)
+            self.warmup_results[name] = result
+            if not result["ok"]:
+                print(f"Warmup step {name} failed: {result['error']}")
+
+        await asyncio.gather(*(run(name, step) for name, step in self.warmup_steps.items()))
+        self.warmed_up = True
+        print(f"Warmed up in {time.perf_counter() - started:.2f}s")
+
+    async def _start_warmup(self, app: web.Application):
+        # In the background, the server listens right away and /ready answers 503 until warmup is done
+        self._warmup_task = asyncio.create_task(self.warmup())
+
+    async def _cancel_warmup(self, app: web.Application):
+        if self._warmup_task is not None and not self._warmup_task.done():
+            self._warmup_task.cancel()
+
+    async def ready_handler(self, request: web.Request) -> web.Response:
+        # For load balancer and orchestrator readiness probes: 200 once warmed up, 503 before that and while draining
+        body = {"ready": self.ready, "draining": self.draining, "warmup": self.warmup_results}
+        return web.json_response(body, status=200 if self.ready else 503)
+
+    def _tool_queue_depth(self) -> int:
+        # Tool calls waiting for an executor thread
+        return self._tool_executor._work_queue.qsize() if self._tool_executor is not None else 0
+
+    def register_metrics(self):
+        registry.gauge("rtmt_active_sessions", "Sessions connected to the middle tier", lambda: len(self.sessions))
+        registry.gauge("rtmt_queued_sessions", "Sessions waiting for a slot in the session scheduler",
+                       lambda: self.scheduler.queued if self.scheduler is not None else 0)
+        registry.gauge("rtmt_upstream_waiting", "Sessions waiting on the upstream connection rate limiter",
+                       lambda: self.upstream.limiter.waiting)
+        registry.gauge("rtmt_upstream_connect_rate", "Current upstream connection rate limit per second",
+                       lambda: self.upstream.limiter.rate)
+        registry.gauge("rtmt_tools_in_flight", "Tool calls running or waiting to run", lambda: self.tools_in_flight)
+        registry.gauge("rtmt_tool_queue_depth", "Tool calls waiting for an executor thread", self._tool_queue_depth)
+        registry.gauge("rtmt_client_queued_bytes", "Bytes waiting in the outbound queues of all clients",
+                       lambda: sum(s.outbound.queued_bytes for s in list(self.sessions.values()) if s.outbound is not None))
+
     def attach_to_app(self, app, path):
         app.router.add_get(path, self._websocket_handler)
+        self.register_metrics()
+        app.on_startup.append(self._start_warmup)
+        app.on_shutdown.append(self.drain)
+        app.on_cleanup.append(self._cancel_warmup)
+        app.on_cleanup.append(self._shutdown_tool_executor)
+        app.on_cleanup.append(lambda _: self.upstream.close())
@@ -0,0 +1,52 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+class SessionScheduler:
+    max_active: int
+    max_queued: int
+    queue_timeout: Optional[float]
+    active: int = 0
+
+    def __init__(self, max_active: int, max_queued: int = 0, queue_timeout: Optional[float] = None):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, on_queued: Optional[Callable[[int], Awaitable[None]]] = None) -> bool:
+        # Admit immediately if there's room and nobody is ahead in the queue, otherwise wait in FIFO order for a 
+        # slot to be handed over, rejecting once the queue is full or the wait times out
+        if self.active < self.max_active and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.max_queued:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            if on_queued is not None:
+                await on_queued(len(self._waiters))
+            await asyncio.wait_for(waiter, self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # The slot was handed over just as the client went away
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)  # Hand the slot straight to the next session in line
+                return
+        self.active -= 1
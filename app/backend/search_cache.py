@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from langchain_core.documents import Document
+from embedding_cache import normalize_query
+from metrics import registry
+
+_lookups = registry.counter("rag_search_cache_lookups_total", "Search result cache lookups by result: hit or miss")
+
+# Search results keyed on normalized query text, in an LRU or, with a `path`, a SQLite file the workers share so
+# `clear` invalidates it for all of them; entries older than `ttl` seconds are ignored
+class SearchResultCache:
+    _TRIM_EVERY = 64  # Puts between trims of the SQLite table down to max_entries
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = 300, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS search_results (key TEXT PRIMARY KEY, results TEXT, created REAL)")
+
+    def _key(self, query: str, variant: str) -> str:
+        return hashlib.sha256(f"{variant}\0{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, query: str, variant: str = "") -> Optional[list[Document]]:
+        # `variant` separates results of differently configured searches, e.g. with and without the lexical index
+        key = self._key(query, variant)
+        now = time.time()
+        with self._lock:
+            if self._db is not None:
+                row = self._db.execute("SELECT results, created FROM search_results WHERE key = ?", (key,)).fetchone()
+                entry = (row[1], row[0]) if row is not None else None
+            else:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+            if entry is None or self._expired(entry[0], now):
+                self.misses += 1
+                _lookups.inc(result="miss")
+                return None
+            self.hits += 1
+            _lookups.inc(result="hit")
+        return [Document(page_content=doc["page_content"], metadata=doc["metadata"]) for doc in json.loads(entry[1])]
+
+    def put(self, query: str, results: list[Document], variant: str = ""):
+        key = self._key(query, variant)
+        now = time.time()
+        serialized = json.dumps([{"page_content": doc.page_content, "metadata": doc.metadata} for doc in results],
+                                default=str)
+        with self._lock:
+            if self._db is None:
+                self._entries[key] = (now, serialized)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                return
+            self._db.execute("INSERT OR REPLACE INTO search_results (key, results, created) VALUES (?, ?, ?)",
+                             (key, serialized, now))
+            self._puts += 1
+            if self._puts % self._TRIM_EVERY == 0:
+                self._db.execute("DELETE FROM search_results WHERE key NOT IN "
+                                 "(SELECT key FROM search_results ORDER BY created DESC LIMIT ?)", (self.max_entries,))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM search_results")
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": self.hits / lookups if lookups else 0.0}
+
+def search_cache_from_env() -> Optional[SearchResultCache]:
+    max_entries = int(os.getenv("SEARCH_CACHE_SIZE", 1024))
+    if max_entries <= 0:
+        return None
+    ttl = os.getenv("SEARCH_CACHE_TTL_SECONDS", "300")
+    return SearchResultCache(
+        max_entries=max_entries,
+        ttl=float(ttl) if ttl else None,
+        path=os.getenv("SEARCH_CACHE_PATH") or None
+    )
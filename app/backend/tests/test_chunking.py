@@ -0,0 +1,26 @@
+from chunking import Chunker, find_boilerplate
+
+def catalog_page(number: int, pages: int) -> str:
+    return "\n".join([
+        "Contoso Outdoor Catalog",
+        f"Trail Pack {number}",
+        "Ships within 2 days.",
+        "SKU: 4410-20",
+        "Price: $129.00",
+        "Weight: 1.2 kg",
+        f"A pack for day {number} on the trail.",
+        f"Page {number} of {pages}",
+    ])
+
+def test_repeated_key_value_lines_survive_boilerplate_removal():
+    pages = [catalog_page(number, 6) for number in range(1, 7)]
+    assert find_boilerplate(pages) == {"contoso outdoor catalog", "#"}
+    text = " ".join(chunk.text for chunk in Chunker(max_tokens=1000).split(pages))
+    for line in ("SKU: 4410-20", "Price: $129.00", "Weight: 1.2 kg", "Ships within 2 days."):
+        assert text.count(line) == 6
+    assert "Contoso Outdoor Catalog" not in text
+    assert "Page 3 of 6" not in text
+
+def test_numbers_other_than_page_numbers_keep_lines_apart():
+    pages = [f"Order {number}\nBody text {number}.\nRef 77{number}" for number in range(1, 7)]
+    assert find_boilerplate(pages) == set()
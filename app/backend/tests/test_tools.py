@@ -0,0 +1,27 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from azure.core.credentials import AzureKeyCredential
+from rtmt import RTMiddleTier, Tool, ToolResult, ToolResultDirection
+
+def test_hung_tool_times_out_calls_waiting_for_its_slot():
+    def hung(args):
+        time.sleep(1)
+        return ToolResult("late", ToolResultDirection.TO_SERVER)
+
+    async def run():
+        rtmt = RTMiddleTier("http://unused", "fake-deployment", AzureKeyCredential("fake-key"))
+        tool = Tool(target=hung, schema={}, max_concurrency=1, timeout=0.2)
+        executor = ThreadPoolExecutor(max_workers=2)
+        rtmt._get_tool_executor = lambda: executor
+        timings = []
+        for _ in range(2):
+            started = time.perf_counter()
+            result = await rtmt._run_tool("hung", tool, "{}")
+            timings.append((time.perf_counter() - started, result.to_text()))
+        executor.shutdown(wait=True)
+        return timings
+
+    for seconds, text in asyncio.run(run()):
+        assert seconds < 0.5
+        assert text == "The 'hung' tool timed out, try again."
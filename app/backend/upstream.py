@@ -0,0 +1,119 @@
+import aiohttp
+import asyncio
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+class UpstreamUnavailableError(Exception):
+    pass
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 20.0) -> float:
+    # Exponential backoff with full jitter so sessions throttled together don't retry together
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+# Process-wide FIFO rate limiter for opening upstream connections, a 429 halves the rate and pauses it for
+# everyone and each successful connection grows it back
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, min_rate: float = 0.5):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self.waiting = 0
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self) -> float:
+        # Seconds until a token would be available to a caller at the front of the queue
+        now = time.monotonic()
+        self._refill(now)
+        pause = max(0.0, self._paused_until - now)
+        return max(pause, 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate)
+
+    async def acquire(self):
+        self.waiting += 1
+        try:
+            async with self._lock:
+                while (delay := self.delay()) > 0:
+                    await asyncio.sleep(delay)
+                self._tokens -= 1
+        finally:
+            self.waiting -= 1
+
+    def on_throttled(self, retry_after: Optional[float] = None):
+        now = time.monotonic()
+        # Attempts that were already in flight when the first 429 came back say nothing new about the rate
+        if now >= self._paused_until:
+            self.rate = max(self.min_rate, self.rate / 2)
+        self._tokens = 0
+        pause = retry_after if retry_after is not None else 1 / self.rate
+        self._paused_until = max(self._paused_until, now + pause)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate * 1.5)
+
+# Opens the realtime websockets of every session over one pooled ClientSession and TokenBucket, retrying 429s with
+# jittered backoff and refusing new connections once more than `max_waiting` are queued
+class UpstreamConnectionManager:
+    def __init__(self, endpoint: str, rate: float = 10.0, burst: float = 20.0, max_retries: int = 8,
+                 max_waiting: int = 100, connection_limit: int = 0):
+        self.endpoint = endpoint
+        self.limiter = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.max_waiting = max_waiting
+        self.connection_limit = connection_limit
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            # Realtime websockets hold their connection for the whole conversation, so aiohttp's default limit of
+            # 100 connections would silently cap the number of concurrent sessions
+            connector = aiohttp.TCPConnector(limit=self.connection_limit)
+            self._session = aiohttp.ClientSession(base_url=self.endpoint, connector=connector)
+        return self._session
+
+    async def connect(self, path: str, headers: dict[str, str], params: dict[str, str],
+                      on_waiting: Optional[Callable[[dict[str, Any]], Awaitable[None]]] = None) -> aiohttp.ClientWebSocketResponse:
+        for attempt in range(self.max_retries + 1):
+            delay = self.limiter.delay()
+            if delay > 0 or self.limiter.waiting > 0:
+                if self.limiter.waiting >= self.max_waiting:
+                    raise UpstreamUnavailableError("Too many sessions waiting for an upstream connection")
+                if on_waiting is not None:
+                    await on_waiting({"reason": "rate_limited", "position": self.limiter.waiting + 1,
+                                      "retry_in": round(delay, 1)})
+            await self.limiter.acquire()
+
+            try:
+                ws = await self._get_session().ws_connect(path, headers=headers, params=params)
+                self.limiter.on_success()
+                return ws
+            except aiohttp.WSServerHandshakeError as e:
+                if e.status != 429:  # Too many requests is the only error worth retrying
+                    raise
+                retry_after = _retry_after(e.headers)
+                self.limiter.on_throttled(retry_after)
+                sleep_time = max(retry_after or 0.0, backoff_delay(attempt))
+                print(f"Rate limit exceeded. Retrying in {sleep_time:.1f} seconds...")
+                await asyncio.sleep(sleep_time)
+
+        raise UpstreamUnavailableError("Max retries reached. Unable to connect to the server.")
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+def _retry_after(headers: Optional[Any]) -> Optional[float]:
+    if not headers or "Retry-After" not in headers:
+        return None
+    try:
+        return float(headers["Retry-After"])
+    except ValueError:
+        return None
@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from ingestion import load_manifests
+from quantization import CompactVectors
+try:
+    import hnswlib  # Optional, only needed for approximate search over large corpora
+except ImportError:
+    hnswlib = None
+
+_VECTORS_FILE = "vectors.npy"
+_DOCUMENTS_FILE = "documents.json"
+_HNSW_FILE = "hnsw.bin"
+
+def collection_fingerprint(collection) -> str:
+    # Changes whenever a sync adds, changes or removes a file, manifests are only written once a file is fully indexed
+    manifests = load_manifests(collection)
+    entries = sorted((source, m.get("sha256"), m.get("chunker"), len(m.get("chunk_ids", []))) for source, m in manifests.items())
+    return hashlib.sha256(json.dumps(entries).encode("utf-8")).hexdigest()
+
+# In-process mirror of the Cosmos DB chunks, searched exactly or with HNSW, or over int8/binary/truncated vectors
+# re-ranked on the float32 rows; memory-mapped from `path`, which only a process with `save` on writes
+class LocalVectorIndex:
+    def __init__(self, embeddings: Embeddings, path: Optional[str] = None, hnsw_threshold: int = 50000,
+                 ef_search: int = 64, save: bool = True, quantization: str = "none",
+                 search_dimensions: Optional[int] = None, rerank_candidates: int = 40, hnsw_m: int = 16,
+                 hnsw_ef_construction: int = 200):
+        self.embeddings = embeddings
+        self.path = path
+        self.save = save
+        self.hnsw_threshold = hnsw_threshold
+        self.ef_search = ef_search
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.quantization = quantization
+        self.search_dimensions = search_dimensions
+        self.rerank_candidates = rerank_candidates
+        self.fingerprint: Optional[str] = None
+        self._vectors: Optional[np.ndarray] = None
+        self._documents: list[dict] = []
+        self._hnsw = None
+        self._compact: Optional[CompactVectors] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._vectors is not None
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @property
+    def compact(self) -> bool:
+        return self.quantization != "none" or bool(self.search_dimensions)
+
+    def sync(self, collection) -> bool:
+        """Makes sure the mirror matches the collection, returns False if it was already up to date."""
+        fingerprint = collection_fingerprint(collection)
+        if fingerprint == self.fingerprint:
+            return False
+        if self.path and self._open(fingerprint):
+            return True
+        started = time.perf_counter()
+        vectors, documents = self._copy(collection)
+        self._load(vectors, documents, fingerprint)
+        print(f"Local vector index: mirrored {len(documents)} chunks in {time.perf_counter() - started:.1f}s")
+        return True
+
+    def _copy(self, collection) -> tuple[np.ndarray, list[dict]]:
+        count = collection.count_documents({"manifest": {"$exists": False}})
+        vectors: Optional[np.ndarray] = None
+        documents = []
+        cursor = collection.find({"manifest": {"$exists": False}}, {"textContent": 1, "vectorContent": 1, "metadata": 1})
+        for doc in cursor:
+            if len(documents) == count:
+                break  # Written to after the count, the next sync picks the rest up
+            if vectors is None:
+                vectors = self._allocate(count, len(doc["vectorContent"]))
+            vectors[len(documents)] = doc["vectorContent"]
+            documents.append({"_id": str(doc["_id"]), "text": doc["textContent"], "metadata": doc.get("metadata", {})})
+        if vectors is None:
+            vectors = np.zeros((0, 0), dtype=np.float32)
+        vectors = vectors[:len(documents)]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)  # Cosine similarity becomes a dot product
+        return vectors, documents
+
+    def _allocate(self, rows: int, dimensions: int) -> np.ndarray:
+        if not self.path or not self.save:
+            return np.empty((rows, dimensions), dtype=np.float32)
+        os.makedirs(self.path, exist_ok=True)
+        return np.lib.format.open_memmap(self._file(_VECTORS_FILE + ".tmp"), mode="w+", dtype=np.float32,
+                                         shape=(rows, dimensions))
+
+    def _load(self, vectors: np.ndarray, documents: list[dict], fingerprint: str):
+        hnsw = self._build_hnsw(vectors)
+        compact = self._encode(vectors)
+        if self.path and self.save:
+            os.makedirs(self.path, exist_ok=True)
+            # Vectors first, then the documents file that names the fingerprint, so a crash never pairs new
+            # documents with old vectors
+            if isinstance(vectors, np.memmap):
+                vectors.flush()
+                del vectors
+                os.replace(self._file(_VECTORS_FILE + ".tmp"), self._file(_VECTORS_FILE))
+            else:
+                np.save(self._file(_VECTORS_FILE), vectors)
+            if hnsw is not None:
+                hnsw.save_index(self._file(_HNSW_FILE))
+            elif os.path.exists(self._file(_HNSW_FILE)):
+                os.remove(self._file(_HNSW_FILE))
+            CompactVectors.remove_files(self.path)
+            if compact is not None:
+                compact.save(self._file(CompactVectors.filename(compact.method, compact.dimensions)))
+            with open(self._file(_DOCUMENTS_FILE + ".tmp"), "w", encoding="utf-8") as f:
+                json.dump({"fingerprint": fingerprint, "documents": documents}, f)
+            os.replace(self._file(_DOCUMENTS_FILE + ".tmp"), self._file(_DOCUMENTS_FILE))
+            vectors = np.load(self._file(_VECTORS_FILE), mmap_mode="r")
+        with self._lock:
+            self._vectors, self._documents, self._hnsw, self._compact = vectors, documents, hnsw, compact
+            self.fingerprint = fingerprint
+
+    def _open(self, fingerprint: str) -> bool:
+        # Reopens the files a previous run wrote, if they mirror the collection as it is now
+        try:
+            with open(self._file(_DOCUMENTS_FILE), encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved["fingerprint"] != fingerprint:
+                return False
+            vectors = np.load(self._file(_VECTORS_FILE), mmap_mode="r")
+        except (OSError, ValueError, KeyError):
+            return False
+        if len(vectors) != len(saved["documents"]):
+            return False
+        hnsw = None
+        if self._use_hnsw(len(vectors)):
+            if os.path.exists(self._file(_HNSW_FILE)):
+                hnsw = hnswlib.Index(space="ip", dim=vectors.shape[1])
+                hnsw.load_index(self._file(_HNSW_FILE), max_elements=len(vectors))
+                hnsw.set_ef(self.ef_search)
+            else:
+                hnsw = self._build_hnsw(vectors)
+                if self.save:
+                    hnsw.save_index(self._file(_HNSW_FILE))
+        compact = self._open_compact(vectors)
+        with self._lock:
+            self._vectors, self._documents, self._hnsw, self._compact = vectors, saved["documents"], hnsw, compact
+            self.fingerprint = fingerprint
+        print(f"Local vector index: opened {len(vectors)} chunks from {self.path}")
+        return True
+
+    def _use_hnsw(self, rows: int) -> bool:
+        return hnswlib is not None and rows >= self.hnsw_threshold and not self.compact
+
+    def _encode(self, vectors: np.ndarray) -> Optional[CompactVectors]:
+        if not self.compact or len(vectors) == 0:
+            return None
+        compact = CompactVectors.encode(vectors, self.quantization, self.search_dimensions)
+        print(f"Local vector index: {compact.method} search over {compact.dimensions} dimensions, "
+              f"{compact.nbytes / 2**20:.1f}MB instead of {vectors.nbytes / 2**20:.1f}MB of float32")
+        return compact
+
+    def _open_compact(self, vectors: np.ndarray) -> Optional[CompactVectors]:
+        # The compact copy saved with these files, or a new one if it was saved for another configuration
+        if not self.compact or len(vectors) == 0:
+            return None
+        dimensions = min(self.search_dimensions or vectors.shape[1], vectors.shape[1])
+        file = self._file(CompactVectors.filename(self.quantization, dimensions))
+        try:
+            compact = CompactVectors.load(file, self.quantization, dimensions)
+            if len(compact) == len(vectors):
+                return compact
+        except (OSError, ValueError, KeyError):
+            pass
+        compact = self._encode(vectors)
+        if self.save:
+            compact.save(file)
+        return compact
+
+    def _build_hnsw(self, vectors: np.ndarray):
+        if not self._use_hnsw(len(vectors)):
+            return None
+        index = hnswlib.Index(space="ip", dim=vectors.shape[1])
+        index.init_index(max_elements=len(vectors), ef_construction=self.hnsw_ef_construction, M=self.hnsw_m)
+        index.add_items(vectors, np.arange(len(vectors)))
+        index.set_ef(self.ef_search)
+        return index
+
+    def _snapshot(self) -> tuple[Optional[np.ndarray], list[dict], object, Optional[CompactVectors]]:
+        # A concurrent sync swaps them all at once, searches keep using the set they started with
+        with self._lock:
+            return self._vectors, self._documents, self._hnsw, self._compact
+
+    def search_by_vector(self, vector: list[float], k: int = 4) -> list[tuple[dict, float]]:
+        """Returns the k nearest chunks with their cosine similarity, best first."""
+        vectors, documents, hnsw, compact = self._snapshot()
+        if vectors is None or len(vectors) == 0:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1
+        k = min(k, len(vectors))
+        if hnsw is not None:
+            labels, distances = hnsw.knn_query(query, k=k)
+            return [(documents[row], 1 - float(distance)) for row, distance in zip(labels[0], distances[0])]
+        if compact is not None:
+            # Exact scores for the compact search's best candidates only, reading just those rows
+            approximate = compact.score(query)
+            candidates = min(max(k, self.rerank_candidates), len(vectors))
+            rows = np.sort(np.argpartition(-approximate, candidates - 1)[:candidates])
+            scores = np.asarray(vectors[rows]) @ query
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(documents[rows[i]], float(scores[i])) for i in top]
+        scores = vectors @ query
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(documents[row], float(scores[row])) for row in top]
+
+    def similarity_search_with_score(self, query: str, k: int = 4) -> list[tuple[Document, float]]:
+        results = []
+        for doc, score in self.search_by_vector(self.embeddings.embed_query(query), k):
+            # Same shape AzureCosmosDBVectorSearch returns, including the chunk's _id in the metadata
+            results.append((Document(page_content=doc["text"], metadata={**doc["metadata"], "_id": doc["_id"]}), score))
+        return results
+
+    def similarity_search(self, query: str, k: int = 4) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
@@ -0,0 +1,168 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from typing import Any, Callable, Optional
+from aiohttp import web
+
+# SO_REUSEPORT only spreads incoming connections across processes on Linux
+MULTI_WORKER_SUPPORTED = sys.platform.startswith("linux")
+
+_HEARTBEAT_INTERVAL = 1.0
+
+def attach_heartbeat(app: web.Application, heartbeat: Any):
+    """Keeps the worker's shared heartbeat fresh from its event loop, so a blocked loop shows up as a missed beat.
+
+    Also drains and exits the worker if the supervisor is gone, rather than keep serving unsupervised.
+    """
+    parent = os.getppid()
+
+    async def beat():
+        while True:
+            # Sleep first, startup hooks run before the site starts listening
+            await asyncio.sleep(_HEARTBEAT_INTERVAL)
+            heartbeat.value = time.time()
+            if os.getppid() != parent:
+                print("Supervisor exited, shutting down")
+                os.kill(os.getpid(), signal.SIGTERM)
+                return
+
+    async def start(app: web.Application):
+        app["heartbeat_task"] = asyncio.create_task(beat())
+
+    async def stop(app: web.Application):
+        app["heartbeat_task"].cancel()
+
+    app.on_startup.append(start)
+    app.on_cleanup.append(stop)
+
+def _run_worker(target: Callable[[int, Any], None], index: int, heartbeat: Any):
+    # Ctrl+C reaches the terminal's whole process group, leave the workers out of it so they are only told to stop
+    # once, by the supervisor
+    os.setpgrp()
+    target(index, heartbeat)
+
+class Worker:
+    index: int
+    process: multiprocessing.Process
+    heartbeat: Any
+    started: float
+
+    def __init__(self, index: int, process: multiprocessing.Process, heartbeat: Any):
+        self.index = index
+        self.process = process
+        self.heartbeat = heartbeat
+        self.started = time.time()
+
+    @property
+    def healthy(self) -> bool:
+        return self.heartbeat.value > 0
+
+# Runs `workers` server processes on one SO_REUSEPORT port, restarting any that exit or stop beating; worker 0 is
+# the primary, SIGTERM/SIGINT drain them all and SIGHUP replaces them one at a time
+class WorkerSupervisor:
+    def __init__(self, target: Callable[[int, Any], None], workers: int, heartbeat_timeout: float = 30,
+                 startup_timeout: float = 120, stop_timeout: float = 90):
+        self.target = target
+        self.workers = workers
+        self.heartbeat_timeout = heartbeat_timeout
+        self.startup_timeout = startup_timeout
+        self.stop_timeout = stop_timeout
+        self._context = multiprocessing.get_context("spawn")
+        self._slots: list[Optional[Worker]] = [None] * workers
+        self._crashes = [0] * workers
+        self._next_start = [0.0] * workers
+        self._retiring: list[Worker] = []
+        self._restart_queue: list[int] = []
+        self._replacement: Optional[Worker] = None
+        self._stopping = False
+
+    def _spawn(self, index: int) -> Worker:
+        heartbeat = self._context.Value("d", 0.0, lock=False)
+        process = self._context.Process(target=_run_worker, args=(self.target, index, heartbeat),
+                                        name=f"worker-{index}")
+        process.start()
+        print(f"Started worker {index} (pid {process.pid})")
+        return Worker(index, process, heartbeat)
+
+    def _retire(self, worker: Worker):
+        # SIGTERM makes the worker stop listening and drain its sessions
+        if worker.process.is_alive():
+            worker.process.terminate()
+        self._retiring.append(worker)
+
+    def _stale(self, worker: Worker, now: float) -> bool:
+        if not worker.healthy:
+            return now - worker.started > self.startup_timeout
+        return now - worker.heartbeat.value > self.heartbeat_timeout
+
+    def _check(self):
+        now = time.time()
+        for index, worker in enumerate(self._slots):
+            if worker is not None and not worker.process.is_alive():
+                print(f"Worker {index} (pid {worker.process.pid}) exited with code {worker.process.exitcode}")
+                # Crashing right after starting counts against the worker, backing off restarts
+                self._crashes[index] = self._crashes[index] + 1 if now - worker.started < 30 else 0
+                self._next_start[index] = now + min(30, 2 ** self._crashes[index] - 1)
+                self._slots[index] = worker = None
+            elif worker is not None and self._stale(worker, now):
+                print(f"Worker {index} (pid {worker.process.pid}) missed its heartbeat, restarting it")
+                worker.process.kill()
+                worker.process.join()
+                self._slots[index] = worker = None
+            if worker is None and now >= self._next_start[index]:
+                self._slots[index] = self._spawn(index)
+        self._retiring = [worker for worker in self._retiring if worker.process.is_alive()]
+
+    def _roll(self):
+        # One replacement at a time, the old worker only drains once its replacement takes connections
+        if self._replacement is None:
+            if not self._restart_queue:
+                return
+            self._replacement = self._spawn(self._restart_queue[0])
+            return
+        replacement = self._replacement
+        if replacement.healthy:
+            old = self._slots[replacement.index]
+            self._slots[replacement.index] = replacement
+            if old is not None:
+                self._retire(old)
+            self._replacement = None
+            self._restart_queue.pop(0)
+        elif not replacement.process.is_alive() or self._stale(replacement, time.time()):
+            print(f"Replacement for worker {replacement.index} failed to start, keeping the running workers")
+            replacement.process.kill()
+            self._replacement = None
+            self._restart_queue.clear()
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+    def _on_restart(self, signum, frame):
+        if not self._restart_queue:
+            print("Restarting workers one at a time")
+            self._restart_queue = list(range(self.workers))
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_restart)
+        while not self._stopping:
+            self._check()
+            self._roll()
+            time.sleep(0.5)
+
+        print("Stopping workers")
+        workers = [worker for worker in self._slots + [self._replacement] if worker is not None] + self._retiring
+        for worker in workers:
+            if worker.process.is_alive():
+                worker.process.terminate()
+        deadline = time.monotonic() + self.stop_timeout
+        for worker in workers:
+            worker.process.join(max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                print(f"Worker {worker.index} (pid {worker.process.pid}) didn't stop in time, killing it")
+                worker.process.kill()
+                worker.process.join()